@@ -3,13 +3,30 @@ methods for using the bloomberg COM API v3 from python
 
 Written by Brian P. Smith (brian.p.smith@gmail.com)
 """
-from pythoncom import PumpWaitingMessages
-from win32com.client import DispatchWithEvents, constants, CastTo
-from collections import defaultdict, namedtuple
-from datetime import datetime, timedelta
-from pandas import DataFrame, to_datetime, concat, Panel
+try:
+    from pythoncom import PumpWaitingMessages
+    from win32com.client import DispatchWithEvents, CastTo
+    from win32event import MsgWaitForMultipleObjects, CreateEvent, SetEvent, QS_ALLINPUT
+except ImportError:
+    # no COM available (ie not on windows) - only a non-COM transport can be used
+    PumpWaitingMessages = DispatchWithEvents = CastTo = None
+    MsgWaitForMultipleObjects = CreateEvent = SetEvent = QS_ALLINPUT = None
+from collections import defaultdict, namedtuple, deque, OrderedDict
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+import threading
+import time
+import json
+from operator import attrgetter
+from pandas import DataFrame, DatetimeIndex, MultiIndex, Categorical, to_datetime, concat, isnull, date_range, Series
 import numpy as np
 
+try:
+    from pandas import Panel
+except ImportError:
+    # removed from pandas, see HistoricalDataRequest.response_as_block
+    Panel = None
+
 SecurityErrorAttrs = ['security', 'source', 'code', 'category', 'message', 'subcategory']
 SecurityError = namedtuple('SecurityError', SecurityErrorAttrs)
 FieldErrorAttrs = ['security', 'field', 'source', 'code', 'category', 'message', 'subcategory']
@@ -19,6 +36,43 @@ FieldError = namedtuple('FieldError', FieldErrorAttrs)
 DEBUG = False
 
 
+class EventType(object):
+    """ blpapi event types (same values as the blpapicom constants) """
+    ADMIN = 1
+    SESSION_STATUS = 2
+    SUBSCRIPTION_STATUS = 3
+    REQUEST_STATUS = 4
+    RESPONSE = 5
+    PARTIAL_RESPONSE = 6
+    SUBSCRIPTION_DATA = 8
+    SERVICE_STATUS = 9
+    TIMEOUT = 10
+
+
+class SessionError(Exception):
+    """ raised when the session (rather than the request) fails. The pooled session is discarded. """
+    pass
+
+
+class RequestTimeout(Exception):
+    """ the request did not complete within its timeout and was cancelled """
+    pass
+
+
+class RequestCancelled(Exception):
+    """ the request was cancelled before it completed """
+    pass
+
+
+class ResponseError(Exception):
+    """ the server failed the request (a responseError or a RequestFailure), category is the bloomberg error category
+    (ie LIMIT or TIMEOUT) when known """
+
+    def __init__(self, message, category=None):
+        Exception.__init__(self, message)
+        self.category = category
+
+
 class XmlHelper(object):
 
     @staticmethod
@@ -40,9 +94,15 @@ class XmlHelper(object):
             if DEBUG:
                 print msg.Print
             if msg.AsElement.HasElement('responseError'):
-                raise Exception(msg.AsElement.GetValue('message'))
+                category, message = XmlHelper.get_child_values(msg.GetElement('responseError'), ['category', 'message'])
+                raise ResponseError('responseError: %s (%s)' % (message, category), category)
             yield msg
 
+    @staticmethod
+    def correlation_id(cid):
+        """ return the hashable value of a CorrelationId """
+        return cid.Value
+
     @staticmethod
     def get_sequence_value(node):
         """Convert an element with DataType Sequence to a DataFrame.
@@ -81,9 +141,9 @@ class XmlHelper(object):
             v = ele.Value
             return datetime(year=v.year, month=v.month, day=v.day, hour=v.hour, minute=v.minute, second=v.second)
         elif dtype == 14:  # Enumeration
-            raise NotImplementedError('ENUMERATION data type needs implemented')
+            return str(ele.Value)
         elif dtype == 16:  # Choice
-            raise NotImplementedError('CHOICE data type needs implemented')
+            return XmlHelper.as_value(ele.GetChoice())
         elif dtype == 15:  # SEQUENCE
             return XmlHelper.get_sequence_value(ele)
         else:
@@ -156,15 +216,761 @@ class XmlHelper(object):
             return None
 
 
+def to_datetime64(ymd, hms=None):
+    """ vectorized conversion of packed yyyymmdd (and hhmmss) integer arrays to datetime64[ns], 0 is NaT """
+    ymd = np.asarray(ymd, dtype=np.int64)
+    years = (ymd // 10000 - 1970).astype('M8[Y]')
+    months = years.astype('M8[M]') + (ymd // 100 % 100 - 1).astype('m8[M]')
+    result = (months.astype('M8[D]') + (ymd % 100 - 1).astype('m8[D]')).astype('M8[ns]')
+    if hms is not None:
+        hms = np.asarray(hms, dtype=np.int64)
+        secs = hms // 10000 * 3600 + hms // 100 % 100 * 60 + hms % 100
+        result += secs.astype('m8[s]')
+    result[ymd == 0] = np.datetime64('NaT')
+    return result
+
+
+# the element value as is (numbers), without a python frame per call
+_value = attrgetter('Value')
+
+
+def _string(ele):
+    return str(ele.Value)
+
+
+def _date(ele):
+    v = ele.Value
+    return date(v.year, v.month, v.day) if v else np.nan
+
+
+def _datetime(ele):
+    v = ele.Value
+    return datetime(v.year, v.month, v.day, v.hour, v.minute, v.second)
+
+
+def _generic(ele):
+    return XmlHelper.as_value(ele)
+
+
+def _unlearned(ele):
+    raise LookupError('the datatype of %s is not known yet' % ele.Name)
+
+
+class RowDecoder(object):
+    """Decode sequence rows (ie the fieldData of a reference or historical response) with converters compiled
+    for the schema.
+
+    The converter of each field is chosen once from the datatype of the first element seen for it, and the element
+    names of the first complete row are kept as the layout. A row with as many elements as the layout is then read
+    with one GetElement by name per field (the row is complete when none is missing) and its values converted in a
+    single pass, rather than with a HasElement, a GetElement and a Datatype per field. Other rows walk the elements
+    present. A field requested more than once fills each of its positions. A request keeps its decoder for every row
+    of every message of the response. If intern is True, equal strings decoded by the decoder share a single object.
+    """
+    CONVERTERS = {1: _value, 2: _value, 3: _value, 4: _value, 5: _value, 6: _value, 7: _value, 9: _value,
+                  12: _value, 8: _string, 10: _date, 13: _datetime, 14: _string}
+
+    def __init__(self, fields, intern=False):
+        self.fields = list(fields)
+        # element name (as requested and upper case) -> positions of the field
+        self.positions = {}
+        for i, f in enumerate(self.fields):
+            self.positions.setdefault(f.upper(), []).append(i)
+            self.positions[f] = self.positions[f.upper()]
+        self.converters = [None] * len(self.fields)
+        self.datatypes = [None] * len(self.fields)
+        # element name of each field and number of distinct elements, from the first complete row
+        self.layout = None
+        self.nelements = None
+        # element name -> position, when no field is requested twice
+        self.index = None
+        if len(set(f.upper() for f in self.fields)) == len(self.fields):
+            self.index = dict((name, positions[0]) for name, positions in self.positions.iteritems())
+        # the converters (which fail for the fields not seen yet) and whether any field is a SEQUENCE
+        self.compiled = [_unlearned] * len(self.fields)
+        self.has_sequence = False
+        self.strings = {} if intern else None
+
+    def complete(self, row):
+        """ return the elements of the row in field order if it has all the fields of the layout, None otherwise """
+        if self.layout is not None and row.NumElements == self.nelements:
+            try:
+                return map(row.GetElement, self.layout)
+            except Exception:
+                # same number of elements but not the same ones (ie relativeDate in place of a missing field)
+                pass
+        return None
+
+    def elements(self, row):
+        """ return the elements of the row in field order, None for a missing field """
+        eles = self.complete(row)
+        if eles is not None:
+            return eles
+        present = map(row.GetElement, range(row.NumElements))
+        index = self.index
+        if index is not None:
+            eles = [None] * len(self.fields)
+            try:
+                for ele in present:
+                    eles[index[ele.Name]] = ele
+            except KeyError:
+                # an element which is not a field (ie relativeDate) or a name in another case
+                eles = self.lookup(present)
+        else:
+            eles = self.lookup(present)
+        if self.layout is None and None not in eles:
+            self.layout = [ele.Name for ele in eles]
+            self.nelements = len(set(self.layout))
+        return eles
+
+    def lookup(self, present):
+        """ return the elements in field order, matching the names in upper case if not as requested """
+        eles, positions = [None] * len(self.fields), self.positions
+        for ele in present:
+            name = ele.Name
+            for p in positions.get(name, None) or positions.get(str(name).upper(), ()):
+                eles[p] = ele
+        return eles
+
+    def datatype(self, pos, ele):
+        dtype = self.datatypes[pos]
+        if dtype is None:
+            dtype = self.datatypes[pos] = ele.Datatype
+            conv = self.CONVERTERS.get(dtype, _generic)
+            conv = self.converters[pos] = self.interned if conv is _string and self.strings is not None else conv
+            self.compiled[pos] = conv
+            self.has_sequence = self.has_sequence or dtype == 15
+        return dtype
+
+    def interned(self, ele):
+        s = str(ele.Value)
+        return self.strings.setdefault(s, s)
+
+    def converter(self, pos, ele):
+        conv = self.converters[pos]
+        if conv is None:
+            self.datatype(pos, ele)
+            conv = self.converters[pos]
+        return conv
+
+    def values(self, row, sequence=None):
+        """Return the list of values of the row in field order, nan for a missing field.
+
+        sequence : optional callable(position, element) returning the value of a SEQUENCE (bulk) field in place of
+                   the default DataFrame
+        """
+        eles = self.elements(row)
+        if sequence is None or not self.has_sequence:
+            try:
+                return [conv(ele) if ele is not None else np.nan for conv, ele in zip(self.compiled, eles)]
+            except Exception:
+                # a field seen for the first time or a datatype other than the one learned, convert cell by cell
+                pass
+        vals, converters = [], self.converters
+        for pos, ele in enumerate(eles):
+            if ele is None:
+                vals.append(np.nan)
+            elif sequence is not None and self.datatype(pos, ele) == 15:
+                vals.append(sequence(pos, ele))
+            else:
+                conv = converters[pos] or self.converter(pos, ele)
+                try:
+                    vals.append(conv(ele))
+                except Exception:
+                    # datatype differs from the one learned (ie a string for a date)
+                    vals.append(XmlHelper.as_value(ele))
+        return vals
+
+
+def infer_datatype(values):
+    """ return the bloomberg datatype of the first value which is not missing (None if all are missing) """
+    for v in values:
+        if isinstance(v, bool):
+            return 1
+        elif isinstance(v, (int, long, np.integer)):
+            return 5
+        elif isinstance(v, (float, np.floating)):
+            if not np.isnan(v):
+                return 7
+        elif isinstance(v, basestring):
+            return 8
+        elif isinstance(v, datetime):
+            return 13
+        elif isinstance(v, date):
+            return 10
+        elif v is not None:
+            return 15
+    return None
+
+
+def compact_column(values, datatype=None):
+    """Return the column values as a typed array: numbers as float64 (bool or int64 when no value is missing), dates
+    as datetime64[ns] and strings as a Categorical. Other values (ie bulk frames), and values not matching the
+    datatype (inferred from the values if None), are kept as objects.
+    """
+    datatype = datatype if datatype is not None else infer_datatype(values)
+    try:
+        if datatype in (None, 1, 3, 4, 5, 6, 7, 12):
+            if datatype in (1, 3, 4, 5) and not isnull(values).any():
+                return np.asarray(values, dtype=datatype == 1 and np.bool_ or np.int64)
+            return np.asarray(values, dtype=np.float64)
+        elif datatype in (10, 13):
+            return DatetimeIndex(to_datetime(values)).values
+        elif datatype in (2, 8, 14):
+            if all(isinstance(v, basestring) for v in values if v == v):
+                return Categorical(values)
+    except (TypeError, ValueError):
+        pass
+    arr = np.empty(len(values), dtype=object)
+    arr[:] = values
+    return arr
+
+
+class CompactRows(object):
+    """Read only map of security to row (list of field values in field order) backed by the typed columns of a
+    frame, the map response of a compact ReferenceDataRequest. Rows are built when accessed.
+    """
+
+    def __init__(self, frame):
+        self.frame = frame
+        self.columns = [frame[c].values for c in frame.columns]
+        self.positions = dict((sid, i) for i, sid in enumerate(frame.index))
+
+    def __getitem__(self, sid):
+        i = self.positions[sid]
+        return [col[i] for col in self.columns]
+
+    def get(self, sid, default=None):
+        return self[sid] if sid in self.positions else default
+
+    def __contains__(self, sid):
+        return sid in self.positions
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __iter__(self):
+        return iter(self.frame.index)
+
+    def iterkeys(self):
+        return iter(self.frame.index)
+
+    def keys(self):
+        return list(self.frame.index)
+
+    def iteritems(self):
+        for sid in self.frame.index:
+            yield sid, self[sid]
+
+    def items(self):
+        return list(self.iteritems())
+
+    def itervalues(self):
+        for _, row in self.iteritems():
+            yield row
+
+    def values(self):
+        return list(self.itervalues())
+
+
+class ColumnDecoder(object):
+    """Decode an array of sequence rows (ie the historical fieldData) into typed NumPy columns.
+
+    The datatype of each field is resolved once, from the first row containing the field, and the values are
+    written into preallocated arrays: float64 for numbers, datetime64 for dates, object only for strings and
+    other types. Integer columns without missing values are returned as int64. A column with a value of another
+    datatype (ie a string in a numeric field) is returned as objects, the values decoded as with XmlHelper.as_value.
+    Elements are looked up with a RowDecoder, so the row layout is learned once and kept across calls.
+    """
+    NUMERIC = (2, 3, 4, 5, 6, 7, 12)
+    INTEGER = (2, 3, 4, 5)
+
+    def __init__(self, fields):
+        self.fields = list(fields)
+        self.dtypes = {}
+        self.rows = RowDecoder(self.fields)
+
+    def allocate(self, dtype, n):
+        if dtype in self.NUMERIC:
+            return np.empty(n, dtype=np.float64) * np.nan
+        elif dtype == 10:
+            return np.zeros(n, dtype=np.int64)
+        elif dtype == 13:
+            return np.zeros((n, 2), dtype=np.int64)
+        else:
+            return np.empty(n, dtype=object)
+
+    def finalize(self, dtype, arr):
+        if dtype in self.INTEGER and not np.isnan(arr).any():
+            return arr.astype(np.int64)
+        elif dtype == 10:
+            return to_datetime64(arr)
+        elif dtype == 13:
+            return to_datetime64(arr[:, 0], arr[:, 1])
+        return arr
+
+    def as_objects(self, dtype, arr, i):
+        """ return the column decoded up to row i as an object array (the other rows missing) """
+        done = self.finalize(dtype, arr[:i])
+        obj = np.empty(len(arr), dtype=object)
+        obj[:] = np.nan
+        obj[:i] = DatetimeIndex(done).astype(object) if done.dtype.kind == 'M' else done
+        return obj
+
+    def decode(self, farr):
+        """ return an OrderedDict of field to array for the rows of farr """
+        n = farr.NumValues
+        names, nnames = self.fields, len(self.fields)
+        cols, specs, objects = {}, [], set()
+        for i in range(n):
+            eles = self.rows.elements(farr.GetValue(i))
+            if len(specs) < nnames:
+                # resolve the columns of any fields seen for the first time
+                for pos, name in enumerate(names):
+                    if name not in cols and eles[pos] is not None:
+                        dtype = self.dtypes.get(name, None) or eles[pos].Datatype
+                        self.dtypes[name] = dtype
+                        kind = 0 if dtype in self.NUMERIC else dtype
+                        cols[name] = self.allocate(dtype, n)
+                        specs.append((pos, kind, cols[name]))
+
+            for pos, kind, arr in specs:
+                ele = eles[pos]
+                if ele is None:
+                    continue
+                try:
+                    if kind == 0:
+                        v = ele.Value
+                        if isinstance(v, basestring):
+                            raise TypeError('string in a numeric column')
+                        arr[i] = v
+                    elif kind == 10:
+                        v = ele.Value
+                        if v:
+                            arr[i] = v.year * 10000 + v.month * 100 + v.day
+                    elif kind == 13:
+                        v = ele.Value
+                        if v:
+                            arr[i] = (v.year * 10000 + v.month * 100 + v.day,
+                                      v.hour * 10000 + v.minute * 100 + v.second)
+                    elif kind == 8:
+                        v = ele.Value
+                        if not isinstance(v, basestring):
+                            raise TypeError('%r in a string column' % (v,))
+                        arr[i] = str(v)
+                    else:
+                        arr[i] = XmlHelper.as_value(ele)
+                except (TypeError, ValueError, AttributeError):
+                    # datatype differs from the one learned, the column is kept as objects for this call
+                    name = names[pos]
+                    obj = cols[name] = self.as_objects(self.dtypes[name], arr, i)
+                    obj[i] = XmlHelper.as_value(ele)
+                    objects.add(name)
+                    specs[[spec[0] for spec in specs].index(pos)] = (pos, None, obj)
+
+        result = OrderedDict()
+        for name in names:
+            if name in objects:
+                result[name] = cols[name]
+            elif name in cols:
+                result[name] = self.finalize(self.dtypes[name], cols[name])
+            else:
+                result[name] = np.empty(n, dtype=np.float64) * np.nan
+        return result
+
+    def frame(self, farr, index='date'):
+        """ decode the rows of farr into a DataFrame indexed by the index field """
+        cols = self.decode(farr)
+        idx = cols.pop(index)
+        frame = DataFrame(cols, columns=[f for f in self.fields if f != index], index=idx)
+        frame.index.name = index
+        return frame
+
+
+class BulkBuffer(object):
+    """Collect the bulk (SEQUENCE) field values of many securities into one long frame per field, indexed by
+    (security, row) with typed columns, rather than a DataFrame per security.
+
+    The columns of a field are taken from the first row received for it and every later value of the field is
+    decoded with the same ColumnDecoder. A security whose value has a cell of another datatype has that column
+    decoded as objects (see ColumnDecoder), the column of the long frame is then objects.
+    """
+
+    def __init__(self):
+        self.decoders = {}
+        self.parts = OrderedDict()
+
+    def add(self, sid, field, ele):
+        """ decode the bulk value ele of the security's field, return the number of rows """
+        n = ele.NumValues
+        if n:
+            decoder = self.decoders.get(field, None)
+            if decoder is None:
+                row = ele.GetValue(0)
+                columns = [str(row.GetElement(i).Name) for i in range(row.NumElements)]
+                decoder = self.decoders[field] = ColumnDecoder(columns)
+            self.parts.setdefault(field, []).append((sid, decoder.decode(ele), n))
+        return n
+
+    def frame(self, field):
+        parts = self.parts.get(field, [])
+        columns = self.decoders[field].fields if parts else []
+        categories = unique([sid for sid, _, _ in parts])
+        codes = dict((sid, i) for i, sid in enumerate(categories))
+        codes = np.array([codes[sid] for sid, _, _ in parts], dtype=np.int64)
+        sids = Categorical.from_codes(np.repeat(codes, [n for _, _, n in parts]), categories)
+        rows = np.concatenate([np.arange(n) for _, _, n in parts]) if parts else np.array([], dtype=np.int64)
+        data = OrderedDict((c, self.concat_column([cols[c] for _, cols, _ in parts])) for c in columns)
+        index = MultiIndex.from_arrays([sids, rows], names=['security', 'row'])
+        return DataFrame(data, columns=columns, index=index)
+
+    @staticmethod
+    def concat_column(arrays):
+        """ concatenate the column of each security, dates mixed with other types as objects (Timestamps) """
+        kinds = set(a.dtype.kind for a in arrays)
+        if 'M' not in kinds or len(kinds) == 1:
+            return np.concatenate(arrays)
+        # a security without the column has it missing (all nan)
+        arrays = [a.astype('M8[ns]') if a.dtype.kind == 'f' and np.isnan(a).all() else a for a in arrays]
+        if all(a.dtype.kind == 'M' for a in arrays):
+            return np.concatenate(arrays)
+        return np.concatenate([DatetimeIndex(a).astype(object) if a.dtype.kind == 'M' else a for a in arrays])
+
+    def frames(self, fields):
+        """ return a dict of field to long frame """
+        return dict((f, self.frame(f)) for f in fields if f in self.parts)
+
+    @staticmethod
+    def merge(frames):
+        """ concatenate long frames of the same field (ie from chunked requests) """
+        sids = np.concatenate([np.asarray(f.index.get_level_values('security'), dtype=object) for f in frames])
+        rows = np.concatenate([f.index.get_level_values('row').values for f in frames])
+        frame = concat([f.reset_index(drop=True) for f in frames], ignore_index=True)
+        frame.index = MultiIndex.from_arrays([Categorical(sids, unique(sids)), rows], names=['security', 'row'])
+        return frame
+
+
+class GrowableBuffer(object):
+    """ base of the typed row buffers: the arrays named by BUFFERS have one row per item and grow together """
+    BUFFERS = ()
+    NS_PER_DAY = 86400 * 10 ** 9
+    EPOCH = datetime(1970, 1, 1).toordinal()
+
+    def __init__(self):
+        self.size = 0
+        self._days = {}
+
+    def reserve(self, n):
+        """ ensure there is room for n more rows, at least doubling the capacity when growing """
+        needed = self.size + n
+        capacity = len(self.times)
+        if needed > capacity:
+            capacity = max(needed, 2 * capacity)
+            for name in self.BUFFERS:
+                old = getattr(self, name)
+                new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+                new[:self.size] = old[:self.size]
+                setattr(self, name, new)
+
+    def day_ns(self, ts):
+        """ return the epoch nanoseconds of the day of ts """
+        key = (ts.year, ts.month, ts.day)
+        ns = self._days.get(key, None)
+        if ns is None:
+            ns = self._days[key] = (datetime(*key).toordinal() - self.EPOCH) * self.NS_PER_DAY
+        return ns
+
+
+class BarBuffer(GrowableBuffer):
+    """Growable typed columns for intraday bars. Prices are kept in one float64 block, volume and events in one
+    int64 block and the bar times as int64 epoch nanoseconds so the frame can be built from views of the buffers.
+    """
+    PRICES = ['open', 'high', 'low', 'close']
+    COUNTS = ['volume', 'events']
+    BUFFERS = ('times', 'prices', 'counts')
+
+    def __init__(self, capacity=1024):
+        GrowableBuffer.__init__(self)
+        self.times = np.empty(capacity, dtype=np.int64)
+        self.prices = np.empty((capacity, len(self.PRICES)), dtype=np.float64)
+        self.counts = np.empty((capacity, len(self.COUNTS)), dtype=np.int64)
+
+    def append(self, bars):
+        """ append the bars of a barTickData element """
+        n = bars.NumValues
+        self.reserve(n)
+        times, prices, counts, i = self.times, self.prices, self.counts, self.size
+        for j in range(n):
+            bar = bars.GetValue(j)
+            ts = bar.GetElement(0).Value
+            times[i] = self.day_ns(ts) + (ts.hour * 3600 + ts.minute * 60) * 10 ** 9
+            prices[i] = (bar.GetElement(1).Value, bar.GetElement(2).Value, bar.GetElement(3).Value, bar.GetElement(4).Value)
+            counts[i] = (bar.GetElement(5).Value, bar.GetElement(6).Value)
+            i += 1
+        self.size = i
+
+    def frame(self, start=0):
+        """ return a DataFrame (time indexed) of the bars from start which shares memory with the buffers """
+        n = self.size
+        idx = DatetimeIndex(self.times[start:n].view('M8[ns]'))
+        return concat([DataFrame(self.prices[start:n], index=idx, columns=self.PRICES, copy=False),
+                       DataFrame(self.counts[start:n], index=idx, columns=self.COUNTS, copy=False)], axis=1, copy=False)
+
+    @staticmethod
+    def long_frame(buffers):
+        """ return a single long format frame from a list of (security, BarBuffer) """
+        sizes = [b.size for _, b in buffers]
+        codes = np.repeat(np.arange(len(buffers)), sizes)
+        frame = DataFrame(np.concatenate([b.prices[:b.size] for _, b in buffers] or [np.empty((0, 4))]),
+                          columns=BarBuffer.PRICES)
+        frame.insert(0, 'security', Categorical.from_codes(codes, [s for s, _ in buffers]))
+        frame.insert(1, 'time', np.concatenate([b.times[:b.size] for _, b in buffers] or [np.empty(0, np.int64)]).view('M8[ns]'))
+        counts = np.concatenate([b.counts[:b.size] for _, b in buffers] or [np.empty((0, 2), np.int64)])
+        frame['volume'], frame['events'] = counts[:, 0], counts[:, 1]
+        return frame
+
+
+class PeriodResampler(object):
+    """Derive WEEKLY, MONTHLY, QUARTERLY, SEMI-ANNUAL or YEARLY history from DAILY history, grouping the dates by
+    calendar period (periodicityAdjustment CALENDAR): weeks end on Friday and the other periods on the last day of
+    their month, quarter, half year or year. As in the terminal's response, a period is labeled with its last date
+    with data (not the calendar end, which may not be a trading day) and periods without any data are left out.
+
+    Each field is aggregated over its non missing values in the period: first for PX_OPEN, max for PX_HIGH, min for
+    PX_LOW, sum for volumes and counts, and the last value (as Bloomberg fills the period end) for any other field.
+
+    Parameters
+    ----------
+    period : one of the periods HistoricalDataRequest accepts
+    aggregations : map of field to first, last, max, min or sum overriding the default aggregation
+    """
+    MONTHS = {'MONTHLY': 1, 'QUARTERLY': 3, 'SEMI-ANNUAL': 6, 'YEARLY': 12}
+    AGGREGATIONS = {'PX_OPEN': 'first', 'PX_HIGH': 'max', 'PX_LOW': 'min', 'PX_VOLUME': 'sum', 'VOLUME': 'sum',
+                    'TURNOVER': 'sum', 'NUM_TRADES': 'sum', 'PX_VOLUME_1D': 'sum', 'EQY_TURNOVER': 'sum'}
+
+    def __init__(self, period, aggregations=None):
+        assert period == 'WEEKLY' or period in self.MONTHS, 'can not derive %s history' % period
+        self.period = period
+        self.aggregations = dict((f.upper(), how) for f, how in (aggregations or {}).iteritems())
+
+    def how(self, field):
+        field = field.upper()
+        return self.aggregations.get(field, None) or self.AGGREGATIONS.get(field, 'last')
+
+    def period_ends(self, dates):
+        """ return the calendar period end date (datetime64[ns]) of each date """
+        dates = DatetimeIndex(dates)
+        if self.period == 'WEEKLY':
+            days = dates.values.astype('M8[D]')
+            labels = (days + ((4 - np.asarray(dates.weekday)) % 7).astype('m8[D]')).astype('M8[ns]')
+        else:
+            k = self.MONTHS[self.period]
+            month = (np.asarray(dates.month) - 1) // k * k + k
+            # the day before the first day of the month after the period end month
+            year = np.asarray(dates.year) + month // 12
+            labels = to_datetime64(year * 10000 + (month % 12 + 1) * 100 + 1) - np.timedelta64(1, 'D')
+        return labels
+
+    def resample(self, frame):
+        """ return the date indexed daily frame aggregated by period """
+        frame = frame[frame.notnull().any(axis=1)] if len(frame.columns) else frame
+        dates = DatetimeIndex(frame.index).values
+        ends = self.period_ends(dates)
+        grouped = frame.groupby(ends)
+        cols = OrderedDict()
+        for f in frame.columns:
+            how = self.how(f)
+            cols[f] = grouped[f].sum(min_count=1) if how == 'sum' else grouped[f].agg(how)
+        result = DataFrame(cols, columns=frame.columns)
+        # the groups are sorted by period end, as are their last dates
+        result.index = DatetimeIndex(Series(dates).groupby(ends).max().values, name='date')
+        return result
+
+
+class HistoricalBlock(object):
+    """Historical data of many securities aligned on the union of their dates in a single date x security x field
+    NumPy array. The array is float64 when every field is numeric (missing values are NaN), object otherwise.
+
+    dates : DatetimeIndex
+    securities : list (sorted)
+    fields : list
+    values : array of shape (dates, securities, fields)
+    """
+
+    def __init__(self, dates, securities, fields, values):
+        self.dates = dates
+        self.securities = securities
+        self.fields = fields
+        self.values = values
+
+    @classmethod
+    def from_frames(cls, frames, fields):
+        """ build the block from a map of security to date indexed frame (the HistoricalDataRequest response) """
+        sids, fields = sorted(frames), list(fields)
+        stamps, arrays = [], []
+        for sid in sids:
+            frame = frames[sid]
+            stamps.append(DatetimeIndex(frame.index).values)
+            arrays.append((frame if list(frame.columns) == fields else frame.reindex(columns=fields)).values)
+        dates = np.unique(np.concatenate(stamps)) if stamps else np.empty(0, dtype='M8[ns]')
+        numeric = all(arr.dtype.kind in 'biuf' for arr in arrays)
+        values = np.empty((len(dates), len(sids), len(fields)), dtype=np.float64 if numeric else object)
+        values.fill(np.nan)
+        for j, (ts, arr) in enumerate(zip(stamps, arrays)):
+            values[dates.searchsorted(ts), j, :] = arr
+        return cls(DatetimeIndex(dates, name='date'), sids, fields, values)
+
+    def wide(self):
+        """ return a date indexed frame with (field, security) MultiIndex columns """
+        ndates, nsids, nfields = self.values.shape
+        columns = MultiIndex.from_product([self.fields, self.securities], names=[None, 'security'])
+        return DataFrame(self.values.transpose(0, 2, 1).reshape(ndates, nfields * nsids), index=self.dates,
+                         columns=columns)
+
+    def long(self):
+        """ return a tidy frame with date, security and field columns, one row per date and security with data """
+        ndates, nsids, nfields = self.values.shape
+        arr = self.values.reshape(ndates * nsids, nfields)
+        mask = ~isnull(arr).all(axis=1)
+        frame = DataFrame(arr[mask], columns=self.fields)
+        frame.insert(0, 'date', np.repeat(self.dates.values, nsids)[mask])
+        frame.insert(1, 'security', Categorical.from_codes(np.tile(np.arange(nsids), ndates)[mask], self.securities))
+        return frame
+
+    def to_xarray(self):
+        """ return an xarray DataArray with date, security and field dimensions (requires xarray) """
+        import xarray
+        return xarray.DataArray(self.values, coords=[('date', self.dates), ('security', self.securities),
+                                                     ('field', self.fields)])
+
+
+class TickBuffer(GrowableBuffer):
+    """Growable typed columns for intraday ticks: int64 epoch nanosecond times, value and size in one float64 block
+    and the event type, condition codes and exchange dictionary encoded (int32 codes into per buffer categories).
+    Ticks without condition codes or exchange (or when they are not requested) have the empty string.
+    """
+    CODED = ['type', 'conditions', 'exchange']
+    BUFFERS = ('times', 'values', 'codes')
+
+    def __init__(self, capacity=1024, conditions=False, exchange=False):
+        GrowableBuffer.__init__(self)
+        self.times = np.empty(capacity, dtype=np.int64)
+        self.values = np.empty((capacity, 2), dtype=np.float64)
+        self.codes = np.empty((capacity, len(self.CODED)), dtype=np.int32)
+        self.categories = [[] for _ in self.CODED]
+        self._lookup = [{} for _ in self.CODED]
+        fields = ['time', 'type', 'value', 'size']
+        self.conditions = conditions and len(fields) or None
+        conditions and fields.append('conditionCodes')
+        self.exchange = exchange and len(fields) or None
+        exchange and fields.append('exchangeCode')
+        self.rows = RowDecoder(fields)
+
+    def code(self, i, value):
+        """ return the dictionary code of the value of the i-th coded column """
+        lookup = self._lookup[i]
+        code = lookup.get(value, None)
+        if code is None:
+            code = lookup[value] = len(lookup)
+            self.categories[i].append(value)
+        return code
+
+    def append(self, ticks):
+        """ append the ticks of a tickData array element """
+        n = ticks.NumValues
+        self.reserve(n)
+        times, values, codes, i = self.times, self.values, self.codes, self.size
+        elements, code, cpos, epos = self.rows.elements, self.code, self.conditions, self.exchange
+        for j in range(n):
+            eles = elements(ticks.GetValue(j))
+            ts, typ, value, size = eles[:4]
+            cond = eles[cpos] if cpos else None
+            exch = eles[epos] if epos else None
+            ts = ts.Value
+            times[i] = self.day_ns(ts) + ((ts.hour * 3600 + ts.minute * 60 + ts.second) * 10 ** 6 +
+                                          getattr(ts, 'microsecond', 0)) * 1000
+            values[i] = (value.Value, size.Value)
+            codes[i] = (code(0, str(typ.Value)), code(1, str(cond.Value) if cond is not None else ''),
+                        code(2, str(exch.Value) if exch is not None else ''))
+            i += 1
+        self.size = i
+
+    def frame(self, start=0):
+        """ return a DataFrame (time indexed) of the ticks from start """
+        n = self.size
+        idx = DatetimeIndex(self.times[start:n].view('M8[ns]'))
+        data = OrderedDict([('type', Categorical.from_codes(self.codes[start:n, 0], self.categories[0])),
+                            ('value', self.values[start:n, 0]), ('size', self.values[start:n, 1]),
+                            ('conditions', Categorical.from_codes(self.codes[start:n, 1], self.categories[1])),
+                            ('exchange', Categorical.from_codes(self.codes[start:n, 2], self.categories[2]))])
+        return DataFrame(data, index=idx, columns=list(data))
+
+    @staticmethod
+    def merge(buffers):
+        """ return a single buffer with the ticks of the buffers (in order), the codes remapped to the union of
+        the categories """
+        merged = TickBuffer(capacity=sum(b.size for b in buffers))
+        for b in buffers:
+            n, i = b.size, merged.size
+            merged.times[i:i + n] = b.times[:n]
+            merged.values[i:i + n] = b.values[:n]
+            for k in range(len(TickBuffer.CODED)):
+                remap = np.array([merged.code(k, c) for c in b.categories[k]] or [0], dtype=np.int32)
+                merged.codes[i:i + n, k] = remap[b.codes[:n, k]]
+            merged.size += n
+        return merged
+
+
+def unique(items):
+    """ return the items with duplicates removed, keeping the first occurrence order """
+    seen = set()
+    return [i for i in items if not (i in seen or seen.add(i))]
+
+
+class MessageList(object):
+    """ event-like view over a subset of an event's messages (ie the messages for one correlation id) """
+
+    def __init__(self, event_type, messages):
+        self.EventType = event_type
+        self.messages = messages
+
+    def CreateMessageIterator(self):
+        return MessageListIterator(self.messages)
+
+
+class MessageListIterator(object):
+    def __init__(self, messages):
+        self.messages = messages
+        self.pos = -1
+
+    def Next(self):
+        self.pos += 1
+        return self.pos < len(self.messages)
+
+    @property
+    def Message(self):
+        return self.messages[self.pos]
+
+
 def debug_event(evt):
     print 'unhandled event: %s' % evt.EventType
-    if evt.EventType in [constants.RESPONSE, constants.PARTIAL_RESPONSE]:
+    if evt.EventType in [EventType.RESPONSE, EventType.PARTIAL_RESPONSE]:
         print 'messages:'
         for msg in XmlHelper.message_iter(evt):
             print msg.Print
 
 
 class ResponseHandler(object):
+    # session status messages which mean the session can no longer be used
+    DEAD_SESSION_MESSAGES = ('SessionTerminated', 'SessionStartupFailure')
+    # optional object whose record(evt) is called with every event (see replay.RecordingTransport)
+    recorder = None
+
+    def __init__(self):
+        self.waiting = False
+        self.exc_info = None
+        self.handler = None
+        self.alive = True
 
     def do_init(self, handler):
         """ will be called prior to waiting for the message """
@@ -176,15 +982,21 @@ class ResponseHandler(object):
         self.handler = handler
 
     def OnProcessEvent(self, evt):
+        self.process_event(CastTo(evt, 'Event'))
+
+    def process_event(self, evt):
+        """ dispatch the event to the request handler (non-COM transports call this directly) """
         try:
-            evt = CastTo(evt, 'Event')
-            if not self.handler:
-                debug_event(evt)
+            self.recorder is not None and self.recorder.record(evt)
+            if evt.EventType == EventType.SESSION_STATUS:
+                self.on_session_status(evt)
 
-            if evt.EventType == constants.RESPONSE:
+            if not self.handler:
+                DEBUG and debug_event(evt)
+            elif evt.EventType == EventType.RESPONSE:
                 self.handler.on_event(evt, is_final=True)
                 self.waiting = False
-            elif evt.EventType == constants.PARTIAL_RESPONSE:
+            elif evt.EventType == EventType.PARTIAL_RESPONSE:
                 self.handler.on_event(evt, is_final=False)
             else:
                 self.handler.on_admin_event(evt)
@@ -193,6 +1005,15 @@ class ResponseHandler(object):
             self.waiting = False
             self.exc_info = sys.exc_info()
 
+    def on_session_status(self, evt):
+        """ flag the session as dead if it has been terminated, failing any outstanding request """
+        iter = evt.CreateMessageIterator()
+        while iter.Next():
+            if str(iter.Message.MessageTypeName) in self.DEAD_SESSION_MESSAGES:
+                self.alive = False
+                if self.waiting:
+                    raise SessionError('session terminated (%s)' % iter.Message.MessageTypeName)
+
     @property
     def has_deferred_exception(self):
         return self.exc_info is not None
@@ -206,12 +1027,260 @@ class ResponseHandler(object):
         self.handler = None
 
 
+class ComTransport(object):
+    """Create blpapicom sessions through win32com, events are delivered by pumping the COM message queue.
+
+    A transport is the event source of the sessions it creates and provides
+        create_session() : return a new (unstarted) session
+        pump() : deliver the waiting events to the sessions' handlers without blocking
+        wait(timeout) : block until events may be waiting, wakeup() is called or timeout seconds elapse
+        wakeup() : interrupt wait (can be called from any thread)
+    and optionally
+        sent(session, request, cid) : called with each Request sent by a RequestBatch
+        thread_affine : True if the events of a session are only delivered on the thread which created it
+    """
+    thread_affine = True
+
+    def __init__(self, progid='blpapicom.ProviderSession.1'):
+        self.progid = progid
+        self.wakeup_event = CreateEvent and CreateEvent(None, 0, 0, None)
+
+    def create_session(self):
+        if DispatchWithEvents is None:
+            raise Exception('win32com is required to create a %s session' % self.progid)
+        return DispatchWithEvents(self.progid, ResponseHandler)
+
+    def pump(self):
+        PumpWaitingMessages()
+
+    def wait(self, timeout):
+        """ sleep in MsgWaitForMultipleObjects until a window message (ie a COM event) arrives """
+        MsgWaitForMultipleObjects([self.wakeup_event], 0, int(timeout * 1000), QS_ALLINPUT)
+
+    def wakeup(self):
+        SetEvent(self.wakeup_event)
+
+
+class PooledSession(object):
+    """ a started session along with the services already opened on it """
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.session = None
+        self.services = {}
+        self.last_used = None
+        # the thread which created the session (and pumps its events)
+        self.thread = threading.current_thread()
+
+    def open(self):
+        try:
+            self.session = self.transport.create_session()
+            self.session.Start()
+        except SessionError:
+            raise
+        except Exception, e:
+            raise SessionError('failed to start session: %s' % e)
+        self.last_used = time.time()
+        return self
+
+    @property
+    def is_healthy(self):
+        return self.session is not None and getattr(self.session, 'alive', True)
+
+    def get_service(self, svcname):
+        svc = self.services.get(svcname, None)
+        if svc is None:
+            try:
+                opened = self.session.OpenService(svcname)
+            except Exception, e:
+                raise SessionError('failed to open service %s: %s' % (svcname, e))
+            if not opened:
+                raise SessionError('failed to open service %s' % svcname)
+            svc = self.services[svcname] = self.session.GetService(svcname)
+        return svc
+
+    def send(self, bbgrequest):
+        try:
+            return self.session.SendRequest(bbgrequest)
+        except Exception, e:
+            raise SessionError('failed to send request: %s' % e)
+
+    def cancel(self, cid):
+        """ ask the server to stop sending the response for the correlation id (any late messages are dropped) """
+        try:
+            self.session.Cancel(cid)
+        except Exception:
+            pass
+
+    def close(self):
+        session, self.session = self.session, None
+        self.services = {}
+        if session is not None:
+            try:
+                session.Stop()
+            except Exception:
+                pass
+
+
+class SessionPool(object):
+    """Pool of long lived sessions so that each request does not pay for session startup and service open.
+
+    Parameters
+    ----------
+    transport : creates the sessions and pumps their events (defaults to ComTransport)
+    size : maximum number of sessions, acquire blocks when all are in use
+    idle_timeout : seconds a session can sit unused in the pool before it is stopped (None to never expire)
+    retries : number of times to reconnect and resend a request when the session fails before the request is sent
+
+    Note: COM delivers events on the thread which created the session, so for a thread_affine transport (ie the
+    ComTransport) an idle session is only given to the thread which created it. An idle session of another thread
+    is stopped to make room when the pool is full, and those of threads which have exited are stopped.
+    """
+
+    def __init__(self, transport=None, size=1, idle_timeout=600, retries=1):
+        assert size > 0
+        self.transport = transport or ComTransport()
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.retries = retries
+        self.thread_affine = getattr(self.transport, 'thread_affine', False)
+        self._idle = []
+        self._count = 0
+        self._cond = threading.Condition()
+
+    def _expired(self, ps, now):
+        return self.idle_timeout is not None and now - ps.last_used > self.idle_timeout
+
+    def _foreign(self, ps, thread):
+        """ True if the session can not be used by the thread (its events are pumped by another live thread) """
+        return self.thread_affine and ps.thread is not thread and ps.thread.is_alive()
+
+    def acquire(self):
+        """ return a healthy PooledSession, starting a new one if none are idle (for this thread) """
+        thread = threading.current_thread()
+        with self._cond:
+            while True:
+                now = time.time()
+                for ps in self._idle[::-1]:
+                    if self._foreign(ps, thread):
+                        continue
+                    self._idle.remove(ps)
+                    # a session of an exited thread is stopped as its events can no longer be pumped
+                    exited = self.thread_affine and ps.thread is not thread
+                    if ps.is_healthy and not self._expired(ps, now) and not exited:
+                        return ps
+                    self._count -= 1
+                    ps.close()
+                if self._count >= self.size and self._idle:
+                    # the idle sessions belong to other threads, stop the least recently used one
+                    self._count -= 1
+                    self._idle.pop(0).close()
+                if self._count < self.size:
+                    self._count += 1
+                    break
+                self._cond.wait()
+
+        try:
+            return PooledSession(self.transport).open()
+        except Exception:
+            with self._cond:
+                self._count -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, ps, discard=False):
+        """ return the session to the pool, discarding it if requested or if it is no longer healthy """
+        with self._cond:
+            if discard or not ps.is_healthy:
+                self._count -= 1
+                ps.close()
+            else:
+                ps.last_used = time.time()
+                self._idle.append(ps)
+            self._cond.notify()
+
+    def reap(self):
+        """ stop any idle sessions which have exceeded the idle timeout """
+        with self._cond:
+            now = time.time()
+            expired = [ps for ps in self._idle if not ps.is_healthy or self._expired(ps, now)]
+            self._idle = [ps for ps in self._idle if ps not in expired]
+            self._count -= len(expired)
+        [ps.close() for ps in expired]
+        return len(expired)
+
+    def close(self):
+        """ stop all idle sessions """
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._count -= len(idle)
+        [ps.close() for ps in idle]
+
+
+class RequestMetrics(object):
+    """Timings and counts collected while a request executes (see Request.instrument and Terminal.set_metrics_sink).
+
+    timings (seconds by phase)
+        session : acquiring the pooled session, including starting it when none is idle
+        open_service : opening the service (0 once it is open on the pooled session)
+        build : creating the bloomberg request
+        send : SendRequest
+        first_message : from the send to the first response message (server time to first partial)
+        server : from the send to the final response
+        decode : in the request's on_event, ie element traversal and python conversion (includes assemble)
+        assemble : building the response DataFrames
+    counts
+        events, partials, messages, cells (decoded), bytes_sent and bytes_received (service.py clients)
+
+    The metrics of a request made of several bloomberg requests are summed over its parts.
+    """
+
+    def __init__(self, request_type):
+        self.request_type = request_type
+        self.timings = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.failed = False
+        self.sent_at = None
+
+    def add(self, phase, seconds):
+        self.timings[phase] += seconds
+
+    def count(self, name, n=1):
+        self.counts[name] += n
+
+    def merge(self, parts):
+        """ add the timings and counts of the parts' metrics """
+        for m in parts:
+            [self.add(phase, t) for phase, t in m.timings.iteritems()]
+            [self.count(name, n) for name, n in m.counts.iteritems()]
+            self.failed = self.failed or m.failed
+        return self
+
+    def as_dict(self):
+        return {'type': self.request_type, 'failed': self.failed, 'timings': dict(self.timings),
+                'counts': dict(self.counts)}
+
+    def __repr__(self):
+        timings = ' '.join('%s=%.4fs' % kv for kv in sorted(self.timings.iteritems()))
+        counts = ' '.join('%s=%s' % kv for kv in sorted(self.counts.iteritems()))
+        return '<%s %s%s %s>' % (self.request_type, self.failed and 'FAILED ' or '', timings, counts)
+
+
 class Request(object):
+    # False for requests made of several bloomberg requests, which can not be sent as part of a RequestBatch
+    batchable = True
+    # RequestMetrics of the last execution, only collected once instrumented
+    metrics = None
+
     def __init__(self, ignore_security_error=0, ignore_field_error=0):
         self.field_errors = []
         self.security_errors = []
         self.ignore_security_error = ignore_security_error
         self.ignore_field_error = ignore_field_error
+        # streaming related
+        self.buffered = True
+        self.chunk_callback = None
+        self.chunks = None
 
     @property
     def has_exception(self):
@@ -241,34 +1310,154 @@ class Request(object):
     def on_admin_event(self, evt):
         pass
 
-    def execute(self):
-        Terminal.execute_request(self)
+    def execute(self, timeout=None):
+        if Terminal.coalescer is not None:
+            Terminal.coalescer.execute(self, timeout=timeout)
+        else:
+            Terminal.execute_request(self, timeout=timeout)
+        return self
+
+    def instrument(self):
+        """ collect the RequestMetrics of the next execution in self.metrics """
+        self.metrics = RequestMetrics(type(self).__name__)
         return self
 
+    @contextmanager
+    def timed(self, phase):
+        """ add the time spent in the with block to the phase of the metrics (if instrumented) """
+        if self.metrics is None:
+            yield
+        else:
+            t0 = time.time()
+            try:
+                yield
+            finally:
+                self.metrics.add(phase, time.time() - t0)
+
+    def stream(self, callback, buffered=True):
+        """ invoke callback(chunk) with the data decoded from each partial response as it arrives. If buffered is
+        False the full response is not built. """
+        self.chunk_callback = callback
+        self.buffered = buffered
+        return self
+
+    def execute_iter(self, buffered=False, timeout=None):
+        """ execute the request, yielding the data decoded from each partial response as it arrives. If buffered is
+        False the full response is not built. """
+        self.buffered = buffered
+        self.chunks = deque()
+        batch = None
+        try:
+            batch = Terminal.submit_many([self], timeout=timeout)
+            while True:
+                done = batch.poll(batch.max_wait)
+                while self.chunks:
+                    yield self.chunks.popleft()
+                if done:
+                    break
+            batch.raise_errors()
+        finally:
+            self.chunks = None
+            if batch is not None and not batch.done:
+                # the consumer stopped early (or poll failed), cancel the request and give the session back
+                batch.ps is not None and batch.cancel()
+                batch.ps is not None and batch.process_cancels()
+                batch.close(discard=True)
+
+    def emit(self, chunk):
+        """ deliver a decoded chunk to the stream consumers """
+        self.chunks is not None and self.chunks.append(chunk)
+        self.chunk_callback and self.chunk_callback(chunk)
+
+    @property
+    def is_streaming(self):
+        return self.chunks is not None or self.chunk_callback is not None
+
+    def response_from_chunks(self, chunks):
+        """ set the response from the chunks yielded by execute_iter (ie on the client of a remote terminal) """
+        raise NotImplementedError()
+
+    def to_spec(self):
+        """ return a json serializable description of the request, see Request.from_spec """
+        raise NotImplementedError()
+
+    @staticmethod
+    def from_spec(spec):
+        """ create the request described by spec """
+        cls = globals().get(spec['type'], None)
+        if not (isinstance(cls, type) and issubclass(cls, Request)):
+            raise ValueError('unknown request type %s' % spec['type'])
+        return cls(**dict((str(k), v) for k, v in spec['args'].iteritems()))
+
+    def subset(self, symbols, fields):
+        """ return a new request for the subset of symbols and fields (used to chunk requests) """
+        raise NotImplementedError()
+
+    def coalesce_key(self):
+        """ return the key shared by the requests which can be answered by a single terminal request, ie requests
+        which only differ by their symbols and error handling (None if the request can not be coalesced) """
+        try:
+            spec = self.to_spec()
+            [spec['args'].pop(k, None) for k in ('symbols', 'ignore_security_error', 'ignore_field_error')]
+            return json.dumps(spec, sort_keys=True)
+        except (NotImplementedError, TypeError, ValueError):
+            # no spec, or one which is not serializable (ie datetime or numpy override values)
+            return None
+
+    def widen(self, symbols):
+        """ return the request sent to the terminal for the coalesced requests of the symbols """
+        if symbols is None:
+            return Request.from_spec(self.to_spec())
+        return self.subset(symbols, self.fields)
+
+    def take_response(self, source):
+        """ set the response and errors from source, the executed widen request this request was coalesced into """
+        self.response = source.response
+        self.security_errors = list(source.security_errors)
+        self.field_errors = list(source.field_errors)
+
+    def merge_responses(self, parts):
+        """ set the response and errors of this request from the executed subset requests """
+        # a security error is reported once per field chunk
+        self.security_errors.extend(unique([e for p in parts for e in p.security_errors]))
+        [self.field_errors.extend(p.field_errors) for p in parts]
+
     @staticmethod
     def apply_overrides(request, omap):
         """ add the given overrides (omap) to bloomberg request """
         if omap:
             for k, v in omap.iteritems():
-                o = request.GetElement('overrides').AppendElment()
+                o = request.GetElement('overrides').AppendElement()
                 o.SetElement('fieldId', k)
                 o.SetElement('value', v)
 
 
 class ReferenceDataRequest(Request):
 
-    def __init__(self, symbols, fields, overrides=None, response_type='frame', ignore_security_error=0, ignore_field_error=0):
+    def __init__(self, symbols, fields, overrides=None, response_type='frame', ignore_security_error=0, ignore_field_error=0,
+                 bulk='frame', compact=0):
         """
         response_type: (frame, map) how to return the results
+        bulk: (frame, long) how to return bulk fields. frame puts a DataFrame per security in the cell. long decodes
+              every security into one frame per field, indexed by (security, row), in bulk_response and puts the
+              number of rows in the cell. Streamed requests receive the frames last, as (field, frame) chunks.
+        compact: bool, if True strings are interned while decoding and the frame has typed columns (see
+                 compact_column), strings as categoricals. The map response is then a CompactRows.
         """
         assert response_type in ('frame', 'map')
+        assert bulk in ('frame', 'long')
         Request.__init__(self, ignore_security_error=ignore_security_error, ignore_field_error=ignore_field_error)
         self.symbols = isinstance(symbols, basestring) and [symbols] or symbols
         self.fields = isinstance(fields, basestring) and [fields] or fields
         self.overrides = overrides
         # response related
-        self.response = {} if response_type == 'map' else defaultdict(list)
+        self.response = {} if response_type == 'map' and not compact else defaultdict(list)
         self.response_type = response_type
+        self.compact = compact
+        self.decoder = RowDecoder(self.fields, intern=compact)
+        self.bulk = bulk
+        self.bulk_buffer = BulkBuffer() if bulk == 'long' else None
+        self.bulk_response = {}
 
     def get_bbg_service_name(self):
         return '//blp/refdata'
@@ -284,36 +1473,241 @@ class ReferenceDataRequest(Request):
     def on_security_node(self, node):
         sid = XmlHelper.get_child_value(node, 'security')
         farr = node.GetElement('fieldData')
-        fdata = XmlHelper.get_child_values(farr, self.fields)
-        assert len(fdata) == len(self.fields), 'field length must match data length'
-        if self.response_type == 'map':
-            self.response[sid] = fdata
+        if self.bulk_buffer is None:
+            fdata = self.decoder.values(farr)
         else:
-            self.response['security'].append(sid)
-            [self.response[f].append(d) for f, d in zip(self.fields, fdata)]
+            fdata = self.decoder.values(farr, lambda pos, ele: self.bulk_buffer.add(sid, self.fields[pos], ele))
+        assert len(fdata) == len(self.fields), 'field length must match data length'
         # Add any field errors if
         ferrors = XmlHelper.get_field_errors(node)
         ferrors and self.field_errors.extend(ferrors)
+        return sid, fdata
+
+    def as_response(self, sids, rows):
+        """ return the rows in the response_type format """
+        if self.compact:
+            return self.as_compact_response(sids, map(list, zip(*rows)) or [[] for _ in self.fields])
+        if self.response_type == 'map':
+            return dict(zip(sids, rows))
+        frame = DataFrame(dict(zip(self.fields, map(list, zip(*rows)))), columns=self.fields, index=sids)
+        frame.index.name = 'security'
+        return frame
+
+    def as_compact_response(self, sids, columns):
+        """ return the field columns as a frame of typed columns (a CompactRows for the map response_type) """
+        data = OrderedDict((f, compact_column(col, dtype))
+                           for f, col, dtype in zip(self.fields, columns, self.decoder.datatypes))
+        frame = DataFrame(data, columns=self.fields, index=sids)
+        frame.index.name = 'security'
+        return CompactRows(frame) if self.response_type == 'map' else frame
 
     def on_event(self, evt, is_final):
         """ this is invoked from in response to COM PumpWaitingMessages - different thread """
+        sids, rows = [], []
         for msg in XmlHelper.message_iter(evt):
             for node, error in XmlHelper.security_iter(msg.GetElement('securityData')):
                 if error:
                     self.security_errors.append(error)
                 else:
-                    self.on_security_node(node)
+                    sid, fdata = self.on_security_node(node)
+                    sids.append(sid)
+                    rows.append(fdata)
+        self.metrics is not None and self.metrics.count('cells', len(sids) * len(self.fields))
+
+        if self.is_streaming and sids:
+            with self.timed('assemble'):
+                self.emit(self.as_response(sids, rows))
+
+        if self.buffered:
+            if self.response_type == 'map' and not self.compact:
+                self.response.update(zip(sids, rows))
+            else:
+                self.response['security'].extend(sids)
+                [self.response[f].extend(col) for f, col in zip(self.fields, zip(*rows))]
 
-        if is_final and self.response_type == 'frame':
-            index = self.response.pop('security')
+        if is_final:
+            with self.timed('assemble'):
+                self.on_final()
+
+    def on_final(self):
+        """ build the response frames once the last message is decoded """
+        if self.bulk_buffer is not None:
+            self.bulk_response = self.bulk_buffer.frames(self.fields)
+            self.bulk_buffer = None
+            # stream consumers receive the long bulk frames last, as (field, frame)
+            if self.is_streaming:
+                [self.emit((f, self.bulk_response[f])) for f in self.fields if f in self.bulk_response]
+
+        if self.compact:
+            index = self.response.pop('security', [])
+            self.response = self.as_compact_response(index, [self.response[f] for f in self.fields])
+        elif self.response_type == 'frame':
+            index = self.response.pop('security', [])
             frame = DataFrame(self.response, columns=self.fields, index=index)
             frame.index.name = 'security'
             self.response = frame
 
+    def to_spec(self):
+        return {'type': 'ReferenceDataRequest',
+                'args': {'symbols': self.symbols, 'fields': self.fields, 'overrides': self.overrides,
+                         'response_type': self.response_type, 'ignore_security_error': self.ignore_security_error,
+                         'ignore_field_error': self.ignore_field_error, 'bulk': self.bulk, 'compact': self.compact}}
+
+    def response_from_chunks(self, chunks):
+        self.bulk_response = dict(c for c in chunks if isinstance(c, tuple))
+        chunks = [c for c in chunks if not isinstance(c, tuple)]
+        if self.compact and chunks:
+            frame = self.compact_concat([c.frame if isinstance(c, CompactRows) else c for c in chunks])
+            self.response = CompactRows(frame) if self.response_type == 'map' else frame
+        elif self.response_type == 'map' and not self.compact:
+            self.response = {}
+            [self.response.update(c) for c in chunks]
+        else:
+            self.response = concat(chunks) if chunks else self.as_response([], [])
+
+    def subset(self, symbols, fields):
+        return ReferenceDataRequest(symbols, fields, overrides=self.overrides, response_type=self.response_type,
+                                    ignore_security_error=1, ignore_field_error=1, bulk=self.bulk, compact=self.compact)
+
+    def take_response(self, source):
+        sids = unique(self.symbols)
+        wanted = set(sids)
+        self.security_errors = [e for e in source.security_errors if e.security in wanted]
+        self.field_errors = [e for e in source.field_errors if e.security in wanted]
+        if self.compact:
+            frame = source.response.frame if self.response_type == 'map' else source.response
+            frame = frame.reindex([sid for sid in sids if sid in frame.index])
+            self.response = CompactRows(frame) if self.response_type == 'map' else frame
+        elif self.response_type == 'map':
+            self.response = dict((sid, source.response[sid]) for sid in sids if sid in source.response)
+        else:
+            self.response = source.response.reindex([sid for sid in sids if sid in source.response.index])
+        self.bulk_response = {}
+        for f, frame in source.bulk_response.iteritems():
+            frame = frame[frame.index.get_level_values('security').isin(sids)]
+            frame.index = MultiIndex.from_arrays([Categorical(frame.index.get_level_values('security'), sids),
+                                                  frame.index.get_level_values('row')], names=['security', 'row'])
+            self.bulk_response[f] = frame
+
+    def merge_responses(self, parts):
+        Request.merge_responses(self, parts)
+        bulk = OrderedDict()
+        [bulk.setdefault(f, []).append(frame) for p in parts for f, frame in p.bulk_response.iteritems()]
+        self.bulk_response = dict((f, BulkBuffer.merge(frames)) for f, frames in bulk.iteritems())
+        if not parts:
+            # no symbols or no fields were requested
+            self.response = self.as_response([], [])
+            return
+        # parts are ordered by field chunk then security chunk
+        fchunks = OrderedDict()
+        [fchunks.setdefault(tuple(p.fields), []).append(p) for p in parts]
+        sids = unique(self.symbols)
+        if self.response_type == 'map' and not self.compact:
+            fmaps = []
+            for flds, fparts in fchunks.iteritems():
+                fmap = {}
+                [fmap.update(p.response) for p in fparts]
+                fmaps.append((flds, fmap))
+            present = set(sid for _, fmap in fmaps for sid in fmap)
+            self.response = dict((sid, sum([fmap.get(sid, [np.nan] * len(flds)) for flds, fmap in fmaps], []))
+                                 for sid in sids if sid in present)
+        elif self.compact:
+            frames = [self.compact_concat([p.response.frame if self.response_type == 'map' else p.response
+                                           for p in fparts]) for fparts in fchunks.itervalues()]
+            frame = concat(frames, axis=1) if len(frames) > 1 else frames[0]
+            frame = frame.reindex([sid for sid in sids if sid in frame.index])
+            frame.index.name = 'security'
+            self.response = CompactRows(frame) if self.response_type == 'map' else frame
+        else:
+            frames = [concat([p.response for p in fparts]) for fparts in fchunks.itervalues()]
+            frame = concat(frames, axis=1) if len(frames) > 1 else frames[0]
+            frame = frame.reindex([sid for sid in sids if sid in frame.index])
+            frame.index.name = 'security'
+            self.response = frame
+
+    @staticmethod
+    def compact_concat(frames):
+        """ concat compact frames, keeping the categorical columns categorical (concat makes them objects when the
+        categories differ) """
+        frame = concat(frames)
+        for c in frame.columns:
+            if frame[c].dtype == object and any(str(f[c].dtype) == 'category' for f in frames):
+                frame[c] = Categorical(frame[c])
+        return frame
+
+
+class MultiOverrideRequest(Request):
+    batchable = False
+
+    def __init__(self, symbols, fields, overrides, keys=None, max_inflight=None, ignore_security_error=0,
+                 ignore_field_error=0):
+        """Reference data of the same securities and fields for many override maps (ie SETTLE_DT scenarios), fetched
+        concurrently on one session (one ReferenceDataRequest per distinct override map) into a single frame indexed
+        by (overrides, security).
+
+        Parameters
+        ----------
+        symbols : string or list
+        fields : string or list
+        overrides : list of override maps
+        keys : label of each override map in the overrides level of the index (defaults to its position)
+        max_inflight : maximum number of outstanding requests (None for no limit)
+        """
+        Request.__init__(self, ignore_security_error=ignore_security_error, ignore_field_error=ignore_field_error)
+        self.symbols = isinstance(symbols, basestring) and [symbols] or symbols
+        self.fields = isinstance(fields, basestring) and [fields] or fields
+        self.overrides = list(overrides)
+        self.keys = list(keys) if keys is not None else range(len(self.overrides))
+        assert len(self.keys) == len(self.overrides), 'one key is required per override map'
+        self.max_inflight = max_inflight
+        # identical override maps share a request, the requests share a decoder
+        self.parts = OrderedDict()
+        decoder = RowDecoder(self.fields)
+        for omap in self.overrides:
+            okey = tuple(sorted((omap or {}).iteritems()))
+            if okey not in self.parts:
+                part = self.parts[okey] = ReferenceDataRequest(self.symbols, self.fields, overrides=omap,
+                                                               ignore_security_error=1, ignore_field_error=1)
+                part.decoder = decoder
+        self.response = None
+
+    def execute(self, pool=None, timeout=None):
+        parts = self.parts.values()
+        self.metrics is not None and [p.instrument() for p in parts]
+        Terminal.execute_many(parts, max_inflight=self.max_inflight, pool=pool, timeout=timeout)
+        self.metrics is not None and self.metrics.merge([p.metrics for p in parts])
+        # a security error is reported by every part
+        self.security_errors = unique([e for p in parts for e in p.security_errors])
+        self.field_errors = unique([e for p in parts for e in p.field_errors])
+        self.has_exception and self.raise_exception()
+        okeys = [tuple(sorted((omap or {}).iteritems())) for omap in self.overrides]
+        frames = [self.parts[okey].response for okey in okeys]
+        sizes = [len(f) for f in frames]
+        index = MultiIndex.from_arrays([np.repeat(np.array(self.keys, dtype=object), sizes),
+                                        np.concatenate([f.index.values for f in frames] or [[]])],
+                                       names=['overrides', 'security'])
+        data = OrderedDict((f, np.concatenate([fr[f].values for fr in frames] or [[]])) for f in self.fields)
+        self.response = DataFrame(data, index=index, columns=self.fields)
+        return self
+
+    def execute_iter(self, buffered=False, timeout=None):
+        """ the override maps are fetched concurrently so the frame is yielded as a single chunk """
+        yield self.execute(timeout=timeout).response
+
+    def to_spec(self):
+        return {'type': 'MultiOverrideRequest',
+                'args': {'symbols': self.symbols, 'fields': self.fields, 'overrides': self.overrides, 'keys': self.keys,
+                         'max_inflight': self.max_inflight, 'ignore_security_error': self.ignore_security_error,
+                         'ignore_field_error': self.ignore_field_error}}
+
+    def response_from_chunks(self, chunks):
+        self.response = chunks[0] if chunks else None
+
 
 class HistoricalDataRequest(Request):
 
-    def __init__(self, symbols, fields, start=None, end=None, period='DAILY', addtl_sets=None, ignore_security_error=0, ignore_field_error=0):
+    def __init__(self, symbols, fields, start=None, end=None, period='DAILY', addtl_sets=None, ignore_security_error=0, ignore_field_error=0,
+                 columnar=0, spill=None, derive=0, aggregations=None):
         """Historical data request for bloomberg.
 
         Parameters
@@ -325,6 +1719,12 @@ class HistoricalDataRequest(Request):
         period : ('DAILY', 'WEEKLY', 'MONTHLY', 'QUARTERLY', 'SEMI-ANNUAL', 'YEARLY')
         ignore_field_errors : bool
         ignore_security_errors : bool
+        columnar : bool, if True decode each security with the ColumnDecoder (typed columns and a DatetimeIndex)
+        spill : spill.SpillStore (or any object with add(sid, frame)) receiving each security as it is decoded. The
+                store is the response, securities are decoded with the ColumnDecoder.
+        derive : bool, if True fetch DAILY history and derive the period locally (see PeriodResampler), the
+                 request is sent with periodicityAdjustment CALENDAR
+        aggregations : map of field to aggregation (first, last, max, min, sum) used by derive
         """
         Request.__init__(self, ignore_security_error=ignore_security_error, ignore_field_error=ignore_field_error)
         assert period in ('DAILY', 'WEEKLY', 'MONTHLY', 'QUARTERLY', 'SEMI-ANNUAL', 'YEARLY')
@@ -337,8 +1737,14 @@ class HistoricalDataRequest(Request):
         self.start = to_datetime(start)
         self.end = to_datetime(end)
         self.period = period
+        self.derive = derive
+        self.aggregations = aggregations
+        self.resampler = derive and period != 'DAILY' and PeriodResampler(period, aggregations) or None
+        self.columnar = 1 if spill is not None else columnar
+        self.spill = spill
         # response related
-        self.response = {}
+        self.response = {} if spill is None else spill
+        self.decoder = (self.columnar and ColumnDecoder or RowDecoder)(['date'] + self.fields)
 
     def get_bbg_service_name(self):
         return '//blp/refdata'
@@ -350,44 +1756,136 @@ class HistoricalDataRequest(Request):
         [request.GetElement('fields').AppendValue(fld) for fld in self.fields]
         request.Set('startDate', self.start.strftime('%Y%m%d'))
         request.Set('endDate', self.end.strftime('%Y%m%d'))
-        request.Set('periodicitySelection', self.period)
+        request.Set('periodicitySelection', self.fetch_period)
+        # the periods PeriodResampler derives are calendar periods
+        self.resampler is not None and request.Set('periodicityAdjustment', 'CALENDAR')
         return request
 
+    @property
+    def fetch_period(self):
+        """ the periodicity requested from the terminal """
+        return 'DAILY' if self.resampler is not None else self.period
+
     def on_security_data_node(self, node):
         """process a securityData node - FIXME: currently not handling relateDate node """
         sid = XmlHelper.get_child_value(node, 'security')
+        ferrors = node.HasElement('fieldExceptions') and XmlHelper.get_field_errors(node)
+        ferrors and self.field_errors.extend(ferrors)
         farr = node.GetElement('fieldData')
-        dmap = defaultdict(list)
-        for i in range(farr.NumValues):
-            pt = farr.GetValue(i)
-            [dmap[f].append(XmlHelper.get_child_value(pt, f)) for f in ['date'] + self.fields]
-        idx = dmap.pop('date')
-        frame = DataFrame(dmap, columns=self.fields, index=idx)
-        frame.index.name = 'date'
-        self.response[sid] = frame
+        if self.columnar:
+            frame = self.decoder.frame(farr)
+        else:
+            rows = [self.decoder.values(farr.GetValue(i)) for i in range(farr.NumValues)]
+            with self.timed('assemble'):
+                cols = map(list, zip(*rows)) or [[] for _ in range(len(self.fields) + 1)]
+                frame = DataFrame(dict(zip(self.fields, cols[1:])), columns=self.fields, index=cols[0])
+                frame.index.name = 'date'
+        self.metrics is not None and self.metrics.count('cells', len(frame) * (len(self.fields) + 1))
+        if self.resampler is not None:
+            with self.timed('assemble'):
+                frame = self.resampler.resample(frame)
+        self.is_streaming and self.emit((sid, frame))
+        if self.buffered:
+            if self.spill is None:
+                self.response[sid] = frame
+            else:
+                self.spill.add(sid, frame)
 
     def on_event(self, evt, is_final):
         """ this is invoked from in response to COM PumpWaitingMessages - different thread """
         for msg in XmlHelper.message_iter(evt):
             # Single security element in historical request
             node = msg.GetElement('securityData')
-            if node.HasElement('securityError'):
-                self.security_errors.append(XmlHelper.as_security_error(node.GetElement('securityError')))
+            error = XmlHelper.get_security_error(node)
+            if error:
+                self.security_errors.append(error)
             else:
                 self.on_security_data_node(node)
 
+    def to_spec(self):
+        return {'type': 'HistoricalDataRequest',
+                'args': {'symbols': self.symbols, 'fields': self.fields, 'start': self.start.isoformat(),
+                         'end': self.end.isoformat(), 'period': self.period, 'columnar': self.columnar,
+                         'derive': self.derive, 'aggregations': self.aggregations,
+                         'ignore_security_error': self.ignore_security_error,
+                         'ignore_field_error': self.ignore_field_error}}
+
+    def response_from_chunks(self, chunks):
+        if self.spill is None:
+            self.response = dict(chunks)
+        else:
+            [self.spill.add(sid, frame) for sid, frame in chunks]
+
+    def subset(self, symbols, fields):
+        return HistoricalDataRequest(symbols, fields, start=self.start, end=self.end, period=self.period,
+                                     ignore_security_error=1, ignore_field_error=1, columnar=self.columnar,
+                                     derive=self.derive, aggregations=self.aggregations)
+
+    def derived(self, period, aggregations=None):
+        """ return a request for period answered locally from the DAILY response of this (executed) request """
+        assert self.fetch_period == 'DAILY' and self.resampler is None, 'only DAILY history can be derived'
+        request = HistoricalDataRequest(self.symbols, self.fields, start=self.start, end=self.end, period=period,
+                                        ignore_security_error=self.ignore_security_error,
+                                        ignore_field_error=self.ignore_field_error, columnar=self.columnar, derive=1,
+                                        aggregations=aggregations)
+        request.security_errors = list(self.security_errors)
+        request.field_errors = list(self.field_errors)
+        if request.resampler is None:
+            request.response = dict(self.response.iteritems())
+        else:
+            request.response = dict((sid, request.resampler.resample(f)) for sid, f in self.response.iteritems())
+        return request
+
+    def derived_periods(self, periods, aggregations=None):
+        """ return a map of period to request derived from the DAILY response, ie to answer several periodicities
+        of one universe with a single terminal request """
+        return OrderedDict((p, self.derived(p, aggregations)) for p in periods)
+
+    def take_response(self, source):
+        wanted = set(self.symbols)
+        self.security_errors = [e for e in source.security_errors if e.security in wanted]
+        self.field_errors = [e for e in source.field_errors if e.security in wanted]
+        frames = [(sid, source.response[sid]) for sid in unique(self.symbols) if sid in source.response]
+        if self.spill is None:
+            self.response = dict(frames)
+        else:
+            [self.spill.add(sid, frame) for sid, frame in frames]
+
+    def merge_responses(self, parts):
+        Request.merge_responses(self, parts)
+        bysid = OrderedDict()
+        [bysid.setdefault(sid, []).append(frame) for p in parts for sid, frame in p.response.iteritems()]
+        self.response = {} if self.spill is None else self.spill
+        for sid, frames in bysid.iteritems():
+            frame = concat(frames, axis=1) if len(frames) > 1 else frames[0]
+            frame.index.name = 'date'
+            if self.spill is None:
+                self.response[sid] = frame
+            else:
+                self.spill.add(sid, frame)
+
+    def response_as_block(self):
+        """ return the response as a HistoricalBlock (date x security x field array) """
+        return HistoricalBlock.from_frames(self.response, self.fields)
+
     def response_as_single(self, copy=0):
-        """ convert the response map to a single data frame with Multi-Index columns """
-        arr = []
-        for sid, frame in self.response.iteritems():
-            if copy:
-                frame = frame.copy()
-            'security' not in frame and frame.insert(0, 'security', sid)
-            arr.append(frame.reset_index().set_index(['date', 'security']))
-        return concat(arr).unstack()
+        """ convert the response map to a single data frame with Multi-Index (field, security) columns. The frame
+        never shares memory with the response, copy is kept for compatibility. """
+        return self.response_as_block().wide()
+
+    def response_as_long(self):
+        """ convert the response map to a single tidy frame with date, security and field columns """
+        return self.response_as_block().long()
+
+    def response_as_xarray(self):
+        return self.response_as_block().to_xarray()
 
     def response_as_panel(self, swap=False):
-        panel = Panel(self.response)
+        if Panel is None:
+            raise NotImplementedError('pandas no longer has Panel, use response_as_xarray or response_as_block')
+        block = self.response_as_block()
+        panel = Panel(block.values.transpose(1, 0, 2), items=block.securities, major_axis=block.dates,
+                      minor_axis=block.fields)
         if swap:
             panel = panel.swapaxes('items', 'minor')
         return panel
@@ -420,7 +1918,8 @@ class IntrdayBarRequest(Request):
         self.end = to_datetime(end)
         self.event = event
         # response related
-        self.response = defaultdict(list)
+        self.bars = BarBuffer()
+        self.response = None
 
     def get_bbg_service_name(self):
         return '//blp/refdata'
@@ -438,47 +1937,662 @@ class IntrdayBarRequest(Request):
 
     def on_event(self, evt, is_final):
         """ this is invoked from in response to COM PumpWaitingMessages - different thread """
-        response = self.response
+        if not self.buffered:
+            # each chunk owns its buffer as the frames share memory with it
+            self.bars = BarBuffer(capacity=1)
+        start = self.bars.size
         for msg in XmlHelper.message_iter(evt):
-            bars = msg.GetElement('barData').GetElement('barTickData')
-            for i in range(bars.NumValues):
-                bar = bars.GetValue(i)
-                ts = bar.GetElement(0).Value
-                response['time'].append(datetime(ts.year, ts.month, ts.day, ts.hour, ts.minute))
-                response['open'].append(bar.GetElement(1).Value)
-                response['high'].append(bar.GetElement(2).Value)
-                response['low'].append(bar.GetElement(3).Value)
-                response['close'].append(bar.GetElement(4).Value)
-                response['volume'].append(bar.GetElement(5).Value)
-                response['events'].append(bar.GetElement(6).Value)
+            self.bars.append(msg.GetElement('barData').GetElement('barTickData'))
+        # time plus the price and count columns
+        ncols = 1 + len(BarBuffer.PRICES) + len(BarBuffer.COUNTS)
+        self.metrics is not None and self.metrics.count('cells', (self.bars.size - start) * ncols)
 
-        if is_final:
-            idx = response.pop('time')
-            self.response = DataFrame(response, columns=['open', 'high', 'low', 'close', 'volume', 'events'], index=idx)
+        if self.is_streaming and self.bars.size > start:
+            with self.timed('assemble'):
+                self.emit(self.bars.frame(start=start))
 
+        if is_final and self.buffered:
+            with self.timed('assemble'):
+                self.response = self.bars.frame()
 
-class Terminal(object):
-    @staticmethod
-    def execute_request(request):
-        session = DispatchWithEvents('blpapicom.ProviderSession.1', ResponseHandler)
-        session.Start()
+    def to_spec(self):
+        return {'type': 'IntrdayBarRequest',
+                'args': {'symbol': self.symbol, 'interval': self.interval, 'start': self.start.isoformat(),
+                         'end': self.end.isoformat(), 'event': self.event}}
+
+    def response_from_chunks(self, chunks):
+        self.response = concat(chunks) if chunks else BarBuffer(capacity=0).frame()
+
+
+class MultiIntradayBarRequest(Request):
+    batchable = False
+
+    def __init__(self, symbols, interval, start=None, end=None, event='TRADE', max_inflight=None, ignore_security_error=0):
+        """Intraday bars for many securities, fetched concurrently (one IntrdayBarRequest per security) into a single
+        long format frame with columns security, time, open, high, low, close, volume, events.
+
+        Parameters
+        ----------
+        symbols : string or list
+        interval : number of minutes
+        start : start date
+        end : end date (if None then use today)
+        event : (TRADE,BID,ASK,BEST_BID,BEST_ASK)
+        max_inflight : maximum number of outstanding requests (None for no limit)
+        ignore_security_error : bool, if True securities whose request fails are left out of the response
+        """
+        Request.__init__(self, ignore_security_error=ignore_security_error)
+        self.symbols = unique(isinstance(symbols, basestring) and [symbols] or symbols)
+        self.parts = [IntrdayBarRequest(s, interval, start=start, end=end, event=event) for s in self.symbols]
+        self.interval = interval
+        self.event = event
+        self.max_inflight = max_inflight
+        self.response = None
+
+    def execute(self, pool=None, timeout=None):
+        self.metrics is not None and [p.instrument() for p in self.parts]
+        batch = RequestBatch(self.parts, pool or Terminal.get_pool(), max_inflight=self.max_inflight, timeout=timeout,
+                             sink=Terminal.metrics_sink)
+        batch.wait(raise_errors=False)
+        self.metrics is not None and self.metrics.merge([p.metrics for p in self.parts])
+        for part, exc_info in batch.errors:
+            self.security_errors.append(SecurityError(security=part.symbol, source=None, code=None, category='REQUEST_FAILURE',
+                                                      message=str(exc_info[1]), subcategory=None))
+        self.has_exception and self.raise_exception()
+        failed = set(e.security for e in self.security_errors)
+        self.response = BarBuffer.long_frame([(p.symbol, p.bars) for p in self.parts if p.symbol not in failed])
+        return self
+
+    def execute_iter(self, buffered=False, timeout=None):
+        """ the securities are fetched concurrently so the long frame is yielded as a single chunk """
+        yield self.execute(timeout=timeout).response
+
+    def to_spec(self):
+        part = self.parts[0] if self.parts else IntrdayBarRequest('', self.interval)
+        return {'type': 'MultiIntradayBarRequest',
+                'args': {'symbols': self.symbols, 'interval': self.interval, 'start': part.start.isoformat(),
+                         'end': part.end.isoformat(), 'event': self.event, 'max_inflight': self.max_inflight,
+                         'ignore_security_error': self.ignore_security_error}}
+
+    def response_from_chunks(self, chunks):
+        self.response = chunks[0] if chunks else BarBuffer.long_frame([])
+
+
+class IntradayTickRequest(Request):
+
+    def __init__(self, symbol, start=None, end=None, events='TRADE', conditions=False, exchange=False, page=None,
+                 max_inflight=None):
+        """Intraday tick request for bloomberg, returning a time indexed frame with columns type, value, size,
+        conditions and exchange (the last three categorical).
+
+        Parameters
+        ----------
+        symbol : string
+        start : start datetime (if None then 1 day ago)
+        end : end datetime (if None then now)
+        events : event type or list of (TRADE, BID, ASK, BEST_BID, BEST_ASK)
+        conditions : bool, if True include the condition codes
+        exchange : bool, if True include the exchange codes
+        page : minutes, if set the window is fetched as concurrent sub-requests of at most page minutes
+        max_inflight : maximum number of outstanding pages (None for no limit)
+        """
+        Request.__init__(self)
+        assert isinstance(symbol, basestring)
+        events = isinstance(events, basestring) and [events] or list(events)
+        assert all(e in ('TRADE', 'BID', 'ASK', 'BEST_BID', 'BEST_ASK') for e in events)
+        if start is None:
+            start = datetime.today() - timedelta(1)
+        if end is None:
+            end = datetime.today()
+        self.symbol = symbol
+        self.start = to_datetime(start)
+        self.end = to_datetime(end)
+        self.events = events
+        self.conditions = conditions
+        self.exchange = exchange
+        self.page = page
+        self.max_inflight = max_inflight
+        # a long window is sent as pages
+        self.parts = []
+        if page and self.end - self.start > timedelta(minutes=page):
+            bounds = list(date_range(self.start, self.end, freq='%dmin' % page))
+            bounds[-1] < self.end and bounds.append(self.end)
+            self.parts = [IntradayTickRequest(symbol, s, e, events, conditions, exchange)
+                          for s, e in zip(bounds[:-1], bounds[1:])]
+        self.batchable = not self.parts
+        # response related
+        self.ticks = self.new_buffer()
+        self.response = None
+
+    def new_buffer(self, capacity=1024):
+        return TickBuffer(capacity, conditions=self.conditions, exchange=self.exchange)
+
+    def execute(self, timeout=None):
+        if not self.parts:
+            return Request.execute(self, timeout=timeout)
+        self.metrics is not None and [p.instrument() for p in self.parts]
+        Terminal.execute_many(self.parts, max_inflight=self.max_inflight, timeout=timeout)
+        self.metrics is not None and self.metrics.merge([p.metrics for p in self.parts])
+        self.ticks = TickBuffer.merge([p.ticks for p in self.parts])
+        self.response = self.ticks.frame()
+        return self
+
+    def execute_iter(self, buffered=False, timeout=None):
+        if not self.parts:
+            for chunk in Request.execute_iter(self, buffered=buffered, timeout=timeout):
+                yield chunk
+        else:
+            # the pages are fetched concurrently so the frame is yielded as a single chunk
+            yield self.execute(timeout=timeout).response
+
+    def get_bbg_service_name(self):
+        return '//blp/refdata'
+
+    def get_bbg_request(self, svc, session):
+        start, end = self.start, self.end
+        request = svc.CreateRequest('IntradayTickRequest')
+        request.Set('security', self.symbol)
+        [request.GetElement('eventTypes').AppendValue(e) for e in self.events]
+        request.Set('startDateTime', session.CreateDatetime(start.year, start.month, start.day, start.hour, start.minute))
+        request.Set('endDateTime', session.CreateDatetime(end.year, end.month, end.day, end.hour, end.minute))
+        self.conditions and request.Set('includeConditionCodes', True)
+        self.exchange and request.Set('includeExchangeCodes', True)
+        return request
+
+    def on_event(self, evt, is_final):
+        """ this is invoked from in response to COM PumpWaitingMessages - different thread """
+        if not self.buffered:
+            # each chunk owns its buffer as the frames share memory with it
+            self.ticks = self.new_buffer(capacity=1)
+        start = self.ticks.size
+        for msg in XmlHelper.message_iter(evt):
+            self.ticks.append(msg.GetElement('tickData').GetElement('tickData'))
+        # time, type, value, size, conditions and exchange
+        self.metrics is not None and self.metrics.count('cells', (self.ticks.size - start) * 6)
+
+        if self.is_streaming and self.ticks.size > start:
+            with self.timed('assemble'):
+                self.emit(self.ticks.frame(start=start))
+
+        if is_final and self.buffered:
+            with self.timed('assemble'):
+                self.response = self.ticks.frame()
+
+    def to_spec(self):
+        return {'type': 'IntradayTickRequest',
+                'args': {'symbol': self.symbol, 'start': self.start.isoformat(), 'end': self.end.isoformat(),
+                         'events': self.events, 'conditions': self.conditions, 'exchange': self.exchange,
+                         'page': self.page, 'max_inflight': self.max_inflight}}
+
+    def response_from_chunks(self, chunks):
+        self.response = concat(chunks) if chunks else self.new_buffer(capacity=0).frame()
+
+
+class RequestBatch(object):
+    """Send many requests on a single pooled session and route each response message to its request by
+    correlation id. At most max_inflight requests are outstanding, the rest are sent as others complete.
+
+    The batch is the event handler for the session. Drive it with poll() (suitable for an external event loop)
+    or wait(), both sleep in the transport until events arrive rather than spinning.
+
+    A request which is not complete timeout seconds after it is sent fails with RequestTimeout, cancel() fails the
+    outstanding requests with RequestCancelled. Both are cancelled on the session.
+
+    When a metrics sink is given, every request is instrumented and sink.record(request.metrics) is called as it
+    completes or fails (requests instrumented beforehand collect their metrics without a sink).
+    """
+    # longest time poll sleeps in the transport waiting for events
+    max_wait = 1.
+
+    def __init__(self, requests, pool, max_inflight=None, timeout=None, sink=None):
+        assert max_inflight is None or max_inflight > 0
+        assert timeout is None or timeout > 0
+        self.requests = list(requests)
+        self.pool = pool
+        self.max_inflight = max_inflight or len(self.requests) or 1
+        self.timeout = timeout
+        self.pending = deque(self.requests)
+        self.inflight = {}
+        self.sent = {}  # correlation id value -> (CorrelationId, deadline)
+        self.cancels = deque()
+        self.errors = []
+        self.ps = None
+        self.sink = sink
+        sink is not None and [r.instrument() for r in self.requests if r.metrics is None]
+
+    @property
+    def done(self):
+        return not self.pending and not self.inflight
+
+    def start(self):
+        self.start_session()
+        self.fill()
+        return self
+
+    def send(self, request):
+        """ send the request, reconnecting if the session fails while nothing else is in flight """
+        attempt = 0
+        while True:
+            try:
+                t0 = time.time()
+                svc = self.ps.get_service(request.get_bbg_service_name())
+                t1 = time.time()
+                asbbg = request.get_bbg_request(svc, self.ps.session)
+                t2 = time.time()
+                cid = self.ps.send(asbbg)
+                metrics = request.metrics
+                if metrics is not None:
+                    metrics.sent_at = time.time()
+                    metrics.add('open_service', t1 - t0)
+                    metrics.add('build', t2 - t1)
+                    metrics.add('send', metrics.sent_at - t2)
+                return cid
+            except SessionError:
+                attempt += 1
+                if self.inflight or attempt > self.pool.retries:
+                    raise
+                self.close(discard=True)
+                self.start_session()
+
+    def start_session(self):
+        t0 = time.time()
+        self.ps = self.pool.acquire()
+        self.ps.session.do_init(self)
+        elapsed = time.time() - t0
+        [r.metrics.add('session', elapsed) for r in self.pending if r.metrics is not None]
+
+    def fill(self):
+        while self.pending and len(self.inflight) < self.max_inflight:
+            request = self.pending.popleft()
+            try:
+                cid = self.send(request)
+            except SessionError:
+                raise
+            except Exception:
+                self.on_failure(request)
+            else:
+                key = XmlHelper.correlation_id(cid)
+                self.inflight[key] = request
+                self.sent[key] = (cid, self.timeout and time.time() + self.timeout)
+                # transports can observe the requests sent (ie to record them)
+                sent = getattr(self.pool.transport, 'sent', None)
+                sent and sent(self.ps.session, request, cid)
+
+    def on_failure(self, request, exc_info=None):
+        import sys
+        self.errors.append((request, exc_info or sys.exc_info()))
+        if request.metrics is not None:
+            request.metrics.failed = True
+            self.report(request)
+
+    def report(self, request):
+        """ pass the metrics of the completed request to the sink """
+        self.sink is not None and request.metrics is not None and self.sink.record(request.metrics)
+
+    def finish(self, cid):
+        request = self.inflight.pop(cid)
+        self.sent.pop(cid, None)
         try:
-            svcname = request.get_bbg_service_name()
-            if not session.OpenService(svcname):
-                raise Exception('failed to open service %s' % svcname)
-
-            svc = session.GetService(svcname)
-            asbbg = request.get_bbg_request(svc, session)
-            session.SendRequest(asbbg)
-            session.do_init(request)
-            while session.waiting:
-                PumpWaitingMessages()
-            session.has_deferred_exception and session.raise_deferred_exception()
             request.has_exception and request.raise_exception()
-            return request
+        except Exception:
+            self.on_failure(request)
+        else:
+            self.report(request)
+
+    def on_event(self, evt, is_final):
+        groups = OrderedDict()
+        iter = evt.CreateMessageIterator()
+        while iter.Next():
+            msg = iter.Message
+            groups.setdefault(XmlHelper.correlation_id(msg.CorrelationId), []).append(msg)
+
+        for cid, msgs in groups.iteritems():
+            request = self.inflight.get(cid, None)
+            if request is None:
+                DEBUG and debug_event(evt)
+                continue
+            metrics = request.metrics
+            try:
+                if metrics is None:
+                    request.on_event(MessageList(evt.EventType, msgs), is_final)
+                else:
+                    self.on_instrumented_event(request, metrics, MessageList(evt.EventType, msgs), is_final)
+            except Exception:
+                self.inflight.pop(cid)
+                self.sent.pop(cid, None)
+                self.on_failure(request)
+            else:
+                is_final and self.finish(cid)
+
+    @staticmethod
+    def on_instrumented_event(request, metrics, evt, is_final):
+        """ deliver the event to the request, collecting its metrics """
+        t0 = time.time()
+        counts = metrics.counts
+        if not counts['messages'] and metrics.sent_at:
+            metrics.add('first_message', t0 - metrics.sent_at)
+        counts['events'] += 1
+        counts['partials'] += not is_final
+        counts['messages'] += len(evt.messages)
+        request.on_event(evt, is_final)
+        t1 = time.time()
+        metrics.add('decode', t1 - t0)
+        is_final and metrics.sent_at and metrics.add('server', t1 - metrics.sent_at)
+
+    def on_admin_event(self, evt):
+        """ fail any request the server reports as failed (REQUEST_STATUS RequestFailure) """
+        iter = evt.CreateMessageIterator()
+        while iter.Next():
+            msg = iter.Message
+            cid = XmlHelper.correlation_id(msg.CorrelationId)
+            if str(msg.MessageTypeName) == 'RequestFailure' and cid in self.inflight:
+                self.sent.pop(cid, None)
+                reason = msg.GetElement('reason')
+                category = reason.HasElement('category') and XmlHelper.get_child_value(reason, 'category') or None
+                exc = ResponseError('RequestFailure: %s' % msg.Print, category)
+                self.on_failure(self.inflight.pop(cid), (ResponseError, exc, None))
+
+    def on_dead_session(self):
+        """ fail the outstanding requests of the terminated session and send the pending ones on a new session """
+        exc = SessionError('session terminated with requests outstanding')
+        for cid, request in self.inflight.items():
+            self.on_failure(request, (SessionError, exc, None))
+        self.inflight.clear()
+        self.sent.clear()
+        self.close(discard=True)
+        self.pending and self.start_session()
+
+    def abandon(self, cid, exc):
+        """ fail the outstanding request with exc and cancel it on the session """
+        request = self.inflight.pop(cid)
+        self.ps.cancel(self.sent.pop(cid)[0])
+        self.on_failure(request, (type(exc), exc, None))
+
+    def cancel(self, requests=None):
+        """ cancel the requests (all if None) which are not complete. Can be called from any thread, the requests
+        are failed with RequestCancelled by the next poll. """
+        self.cancels.append(requests)
+        self.pool.transport.wakeup()
+
+    def expire(self, now):
+        """ fail the requests which have exceeded their timeout """
+        for cid, (_, deadline) in self.sent.items():
+            if deadline and deadline <= now:
+                self.abandon(cid, RequestTimeout('request timed out after %ss' % self.timeout))
+
+    def process_cancels(self):
+        while self.cancels:
+            requests = self.cancels.popleft()
+            cancelled = lambda r: requests is None or r in requests
+            for request in [r for r in self.pending if cancelled(r)]:
+                self.pending.remove(request)
+                self.on_failure(request, (RequestCancelled, RequestCancelled('request cancelled'), None))
+            for cid, request in self.inflight.items():
+                cancelled(request) and self.abandon(cid, RequestCancelled('request cancelled'))
+
+    def next_wait(self, timeout):
+        """ seconds to sleep waiting for events: timeout capped by the earliest request deadline """
+        deadlines = [deadline for _, deadline in self.sent.itervalues() if deadline]
+        if not deadlines:
+            return timeout
+        # a deadline already due is 0, not a full timeout
+        return max(0, min(timeout, min(deadlines) - time.time()))
+
+    def poll(self, timeout=0):
+        """Deliver the waiting events and send queued requests, return True when all requests are complete.
+
+        timeout : seconds to sleep in the transport until events arrive (0 to not block)
+        """
+        if self.ps is None:
+            self.start()
+        if not self.done:
+            self.process_cancels()
+            transport = self.pool.transport
+            if timeout and not self.done:
+                transport.wait(self.next_wait(timeout))
+            transport.pump()
+            session = self.ps.session
+            if session.has_deferred_exception and session.alive:
+                # closing the session clears its deferred exception
+                exc_info = session.exc_info
+                self.close(discard=True)
+                raise exc_info[1], None, exc_info[2]
+            # a session terminated while waiting for a response defers a SessionError, fail the requests instead
+            session.alive or self.on_dead_session()
+            self.process_cancels()
+            self.expire(time.time())
+            self.fill()
+        if self.done:
+            self.close()
+        return self.done
+
+    def wait(self, raise_errors=True):
+        """ block until all requests are complete, raising the first failure if raise_errors """
+        try:
+            while not self.poll(self.max_wait):
+                pass
+        except Exception:
+            self.close(discard=True)
+            raise
+        raise_errors and self.raise_errors()
+        return self.requests
+
+    def raise_errors(self):
+        """ raise the first request failure (if any) """
+        if self.errors:
+            exc_info = self.errors[0][1]
+            raise exc_info[1], None, exc_info[2]
+
+    def close(self, discard=False):
+        ps, self.ps = self.ps, None
+        if ps is not None:
+            ps.session and ps.session.do_cleanup()
+            self.pool.release(ps, discard=discard)
+
+
+class Terminal(object):
+    # the shared SessionPool used by Request.execute (created on first use)
+    pool = None
+    # RequestCoalescer used by Request.execute (None to send every request)
+    coalescer = None
+    # receives the RequestMetrics of every request executed (None to not instrument requests)
+    metrics_sink = None
+
+    @classmethod
+    def configure(cls, transport=None, size=1, idle_timeout=600, retries=1):
+        """ replace the shared session pool, stopping the sessions of the current pool """
+        cls.pool and cls.pool.close()
+        cls.pool = SessionPool(transport=transport, size=size, idle_timeout=idle_timeout, retries=retries)
+        return cls.pool
+
+    @classmethod
+    def set_coalescer(cls, coalescer):
+        """ execute the requests through the RequestCoalescer (None to turn coalescing off) """
+        cls.coalescer = coalescer
+
+    @classmethod
+    def set_metrics_sink(cls, sink):
+        """ instrument every request executed, passing its RequestMetrics to sink.record (see metrics.py). None
+        turns the instrumentation off. """
+        cls.metrics_sink = sink
+
+    @classmethod
+    def get_pool(cls):
+        if cls.pool is None:
+            cls.configure()
+        return cls.pool
+
+    @classmethod
+    def execute_request(cls, request, pool=None, timeout=None):
+        return cls.execute_many([request], pool=pool, timeout=timeout)[0]
+
+    @classmethod
+    def submit_many(cls, requests, max_inflight=None, pool=None, timeout=None):
+        """ send the requests and return the RequestBatch without waiting. Call batch.poll() from your event loop
+        until it returns True, then check batch.errors. """
+        return RequestBatch(requests, pool or cls.get_pool(), max_inflight=max_inflight, timeout=timeout,
+                            sink=cls.metrics_sink).start()
+
+    @classmethod
+    def execute_many(cls, requests, max_inflight=None, raise_errors=True, pool=None, timeout=None):
+        """Execute the requests concurrently on one session and return them (in the given order).
+
+        Parameters
+        ----------
+        requests : list of Request
+        max_inflight : maximum number of outstanding requests (None for no limit)
+        raise_errors : if True, raise the first request failure once all requests are complete. Otherwise the
+                       failures are ignored (requests which succeeded still have their response).
+        timeout : seconds each request is given to complete before it fails with RequestTimeout (None for no limit)
+        """
+        batch = RequestBatch(requests, pool or cls.get_pool(), max_inflight=max_inflight, timeout=timeout,
+                             sink=cls.metrics_sink)
+        return batch.wait(raise_errors=raise_errors)
+
+
+class ChunkPlanner(object):
+    """Split a request with many symbols and fields into size bounded sub-requests, execute them concurrently and
+    merge the results back into the response of the original request (including the security and field errors).
+    Repeated symbols are only requested once.
+
+    Parameters
+    ----------
+    max_securities : maximum number of securities per sub-request
+    max_fields : maximum number of fields per sub-request
+    max_inflight : maximum number of sub-requests outstanding at once (None for no limit)
+    """
+
+    def __init__(self, max_securities=100, max_fields=25, max_inflight=None):
+        assert max_securities > 0 and max_fields > 0
+        self.max_securities = max_securities
+        self.max_fields = max_fields
+        self.max_inflight = max_inflight
+
+    def plan(self, request):
+        """ return the list of sub-requests, ordered by field chunk then security chunk """
+        sids, flds = unique(request.symbols), list(request.fields)
+        ms, mf = self.max_securities, self.max_fields
+        return [request.subset(sids[i:i + ms], flds[j:j + mf])
+                for j in range(0, len(flds), mf) for i in range(0, len(sids), ms)]
+
+    def execute(self, request, pool=None, timeout=None):
+        parts = self.plan(request)
+        request.metrics is not None and [p.instrument() for p in parts]
+        parts and Terminal.execute_many(parts, max_inflight=self.max_inflight, pool=pool, timeout=timeout)
+        request.metrics is not None and request.metrics.merge([p.metrics for p in parts])
+        request.merge_responses(parts)
+        request.has_exception and request.raise_exception()
+        return request
+
+
+class CoalescedRequest(object):
+    """ the terminal request shared by the requests coalesced into it (all with the same coalesce_key) """
+
+    def __init__(self, key, symbols):
+        self.key = key
+        self.symbols = [] if symbols is not None else None
+        self.requests = []
+        self.source = None
+        self.exc_info = None
+        self.done = threading.Event()
+
+    def covers(self, request):
+        """ True if the request only needs symbols already requested """
+        return self.symbols is None or set(request.symbols) <= set(self.symbols)
+
+    def add(self, request):
+        self.requests.append(request)
+        if self.symbols is not None:
+            present = set(self.symbols)
+            self.symbols.extend(s for s in unique(request.symbols) if s not in present)
+
+    def run(self, pool, timeout):
+        try:
+            self.source = Terminal.execute_request(self.requests[0].widen(self.symbols), pool=pool, timeout=timeout)
+        except Exception:
+            import sys
+            self.exc_info = sys.exc_info()
         finally:
-            session.Stop()
-            session.do_cleanup()
+            self.done.set()
+
+    def result(self, request):
+        """ set the response of the request, raising if the terminal request failed """
+        self.done.wait()
+        if self.exc_info:
+            raise self.exc_info[1], None, self.exc_info[2]
+        request.take_response(self.source)
+        request.has_exception and request.raise_exception()
+        return request
+
+
+class RequestCoalescer(object):
+    """Share terminal requests between identical or overlapping requests executed concurrently in the process.
+
+    Requests with the same coalesce_key (same type, fields, overrides, dates, ...) only differ by their symbols. A
+    request whose symbols are all part of a request already sent waits for that request. Otherwise it starts a new
+    terminal request, which waits window seconds for other requests to join and sends the union of their symbols.
+    Each request then takes its own symbols (and their errors) from the shared response, so the response frames
+    may be shared between the requests. Streamed (see Request.stream) and instrumented requests are not coalesced,
+    the shared request would not deliver their chunks or collect their metrics.
+
+    Parameters
+    ----------
+    window : seconds a new terminal request waits for other requests to join it (0 to only share requests in flight)
+    max_symbols : maximum number of symbols of a terminal request (None for no limit)
+    pool : SessionPool (defaults to the Terminal pool)
+    """
+
+    def __init__(self, window=0.002, max_symbols=None, pool=None):
+        self.window = window
+        self.max_symbols = max_symbols
+        self.pool = pool
+        self.collecting = {}
+        self.inflight = defaultdict(list)
+        self.requests = 0
+        self.sent = 0
+        self._lock = threading.Lock()
+
+    def join(self, key, request):
+        """ return (CoalescedRequest, True if the caller must send it) """
+        self.requests += 1
+        for coalesced in self.inflight.get(key, []):
+            if coalesced.covers(request):
+                coalesced.add(request)
+                return coalesced, False
+        coalesced = self.collecting.get(key, None)
+        if coalesced is not None and (self.max_symbols is None or coalesced.symbols is None or
+                                      len(set(coalesced.symbols) | set(request.symbols)) <= self.max_symbols):
+            coalesced.add(request)
+            return coalesced, False
+        coalesced = CoalescedRequest(key, getattr(request, 'symbols', None))
+        coalesced.add(request)
+        self.collecting[key] = coalesced
+        self.sent += 1
+        return coalesced, True
+
+    def execute(self, request, timeout=None):
+        shareable = request.batchable and not request.is_streaming and request.metrics is None
+        key = request.coalesce_key() if shareable else None
+        if key is None:
+            with self._lock:
+                self.requests += 1
+                self.sent += 1
+            return Terminal.execute_request(request, pool=self.pool, timeout=timeout)
+
+        with self._lock:
+            coalesced, send = self.join(key, request)
+        if send:
+            self.window and time.sleep(self.window)
+            with self._lock:
+                self.collecting.get(key, None) is coalesced and self.collecting.pop(key)
+                self.inflight[key].append(coalesced)
+            try:
+                coalesced.run(self.pool, timeout)
+            finally:
+                with self._lock:
+                    self.inflight[key].remove(coalesced)
+                    self.inflight[key] or self.inflight.pop(key)
+        return coalesced.result(request)
 
 
 if __name__ == '__main__':
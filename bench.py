@@ -0,0 +1,320 @@
+"""
+micro benchmarks for the bbg decode paths. They run against the fake element trees so no terminal is needed.
+Note the fake elements are far cheaper than COM elements, so these measure the python side of decoding only.
+
+Running from command prompt ::
+
+> python bench.py historical --dates 5000 --fields 50
+> python bench.py decode --dates 5000 --fields 50 --missing 0.1
+> python bench.py bulk --securities 3000
+> python bench.py mktdata --tickers 500 --ticks 100000
+> python bench.py assemble --securities 2000 --dates 250 --fields 5
+> python bench.py ticks --ticks 100000
+> python bench.py pipeline --scale 100x20x500
+> python bench.py pipeline --capture session.cap
+"""
+from datetime import date, datetime, timedelta
+from bbg import HistoricalDataRequest, IntrdayBarRequest, IntradayTickRequest, ReferenceDataRequest, SessionPool, \
+    RowDecoder, Terminal, XmlHelper
+from fake import FakeElement, FakeService, FakeSession, FakeTransport, RandomTicks, SyntheticResponder, SEQUENCE
+from mktdata import SubscriptionManager
+from scheduler import response_cells
+from pandas import DataFrame, concat
+import numpy as np
+import multiprocessing
+import time
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+
+class CountingElement(FakeElement):
+    """ FakeElement which counts the accesses to its COM style (capitalized) properties and the calls to its
+    methods (a bound method fetched once and called per cell counts each call) """
+    calls = [0]
+
+    def __getattribute__(self, name):
+        attr = object.__getattribute__(self, name)
+        if name[0].isupper():
+            if callable(attr):
+                return CountingElement.counted(attr)
+            CountingElement.calls[0] += 1
+        return attr
+
+    @staticmethod
+    def counted(method):
+        def call(*args):
+            CountingElement.calls[0] += 1
+            return method(*args)
+        return call
+
+
+def com_calls(fn):
+    """ return the number of element accesses made by fn """
+    CountingElement.calls[0] = 0
+    fn()
+    return CountingElement.calls[0]
+
+
+def best_of(fn, repeat=3):
+    """ return the best wall time (seconds) of repeat calls to fn """
+    best = None
+    for _ in range(repeat):
+        t0 = time.time()
+        fn()
+        elapsed = time.time() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def report(name, cells, elapsed, baseline=None, calls=None, unit='cells'):
+    speedup = ' (x%.1f)' % (baseline / elapsed) if baseline else ''
+    calls = ' %5.2f element calls/cell' % (float(calls) / cells) if calls is not None else ''
+    print '%-30s %10.4fs %14s %s/sec%s%s' % (name, elapsed, '{:,.0f}'.format(cells / elapsed), unit, calls, speedup)
+
+
+def historical_node(sid, fields, ndates, cls=FakeElement, missing=0):
+    """ return a historical securityData element with ndates rows of the fields, every 1/missing th cell
+    is left out """
+    d0 = date(2000, 1, 3)
+    skip = missing and int(1. / missing) or 0
+    rows = [[('date', d0 + timedelta(i))] + [(f, float(i + j)) for j, f in enumerate(fields)
+                                             if not skip or (i * len(fields) + j) % skip] for i in range(ndates)]
+    return cls('securityData', [('security', sid), ('sequenceNumber', 0),
+                                ('fieldData', cls.array('fieldData', rows, datatype=SEQUENCE))])
+
+
+def bench_historical(args):
+    """ HistoricalDataRequest.on_security_data_node: row (RowDecoder) vs columnar decoding """
+    fields = ['fld%d' % i for i in range(args.fields)]
+    node = historical_node('bench us equity', fields, args.dates)
+    counted = historical_node('bench us equity', fields, args.dates, cls=CountingElement)
+    cells = args.dates * (args.fields + 1)
+    baseline = None
+    for columnar in (0, 1):
+        req = HistoricalDataRequest('bench us equity', fields, columnar=columnar)
+        elapsed = best_of(lambda: req.on_security_data_node(node), args.repeat)
+        calls = com_calls(lambda: req.on_security_data_node(counted))
+        report('historical columnar=%s' % columnar, cells, elapsed, baseline, calls)
+        baseline = baseline or elapsed
+
+
+def bench_decode(args):
+    """ per row decoding: generic (HasElement, GetElement and as_value per field) vs compiled RowDecoder """
+    fields = ['date'] + ['fld%d' % i for i in range(args.fields)]
+    farr = historical_node('bench us equity', fields[1:], args.dates, missing=args.missing).GetElement('fieldData')
+    counted = historical_node('bench us equity', fields[1:], args.dates, CountingElement,
+                              args.missing).GetElement('fieldData')
+    rows, crows = [farr.GetValue(i) for i in range(args.dates)], [counted.GetValue(i) for i in range(args.dates)]
+    cells = args.dates * len(fields)
+    generic = lambda rows: [XmlHelper.get_child_values(row, fields) for row in rows]
+
+    def compiled(rows):
+        decoder = RowDecoder(fields)
+        return [decoder.values(row) for row in rows]
+
+    assert args.missing or generic(rows) == compiled(rows), 'decoders disagree'
+    baseline = None
+    for name, fn in (('generic', generic), ('compiled', compiled)):
+        elapsed = best_of(lambda: fn(rows), args.repeat)
+        report('decode %s' % name, cells, elapsed, baseline, com_calls(lambda: fn(crows)))
+        baseline = baseline or elapsed
+
+
+def bench_bulk(args):
+    """ bulk field reference data: a DataFrame per security (bulk=frame) vs one long frame (bulk=long) """
+    pool = SessionPool(FakeTransport())
+    sids = ['sec%d us equity' % i for i in range(args.securities)]
+    baseline = None
+    for bulk in ('frame', 'long'):
+        run = lambda: Terminal.execute_request(ReferenceDataRequest(sids, ['px_last', 'bulk_dvd'], bulk=bulk), pool)
+        elapsed = best_of(run, args.repeat)
+        report('bulk=%s' % bulk, len(sids), elapsed, baseline, unit='securities')
+        baseline = baseline or elapsed
+
+
+def bench_compact(args):
+    """ descriptive reference data: object columns vs compact (interned strings, categorical and typed columns) """
+    pool = SessionPool(FakeTransport())
+    sids = ['sec%d us equity' % i for i in range(args.securities)]
+    kinds = ['cat_', 'cat_', 'cat_', 'dt_', 'int_', 'px_']
+    fields = [kinds[i % len(kinds)] + 'fld%d' % i for i in range(args.fields)]
+    baseline, base_mem = None, None
+    for compact in (0, 1):
+        run = lambda: Terminal.execute_request(ReferenceDataRequest(sids, fields, compact=compact), pool)
+        elapsed = best_of(run, args.repeat)
+        mem = run().response.memory_usage(index=True, deep=True).sum()
+        report('compact=%s' % compact, len(sids) * len(fields), elapsed, baseline)
+        print '%-30s %10.1fMB%s' % ('  frame memory', mem / 1024. ** 2,
+                                    ' (x%.1f smaller)' % (float(base_mem) / mem) if base_mem else '')
+        baseline, base_mem = baseline or elapsed, base_mem or mem
+
+
+def bench_assemble(args):
+    """ multi-security historical frame: concat/unstack of per-security frames vs the HistoricalBlock """
+    fields = ['fld%d' % i for i in range(args.fields)]
+    dates = np.arange(args.dates).astype('M8[D]').astype('M8[ns]')
+    req = HistoricalDataRequest('bench us equity', fields)
+    # every other security misses its first date so the dates must be aligned
+    req.response = dict(('sec%d us equity' % i, DataFrame(np.random.rand(args.dates - i % 2, args.fields),
+                                                          index=dates[i % 2:], columns=fields))
+                        for i in range(args.securities))
+    for frame in req.response.itervalues():
+        frame.index.name = 'date'
+
+    def unstack():
+        arr = []
+        for sid, frame in req.response.iteritems():
+            frame = frame.copy()
+            frame.insert(0, 'security', sid)
+            arr.append(frame.reset_index().set_index(['date', 'security']))
+        return concat(arr).unstack()
+
+    cells = args.securities * args.dates * args.fields
+    baseline = best_of(unstack, args.repeat)
+    report('assemble unstack', cells, baseline)
+    report('assemble block wide', cells, best_of(req.response_as_single, args.repeat), baseline)
+    report('assemble block long', cells, best_of(req.response_as_long, args.repeat), baseline)
+
+
+def bench_ticks(args):
+    """ IntradayTickRequest: decoding replayed synthetic tick events, then end to end with and without pages """
+    start = datetime(2020, 1, 2, 9, 30)
+    end = start + timedelta(minutes=max(1, args.ticks // 120))
+    req = IntradayTickRequest('bench us equity', start, end, ['BID', 'ASK'], conditions=True, exchange=True)
+    session = FakeSession(SyntheticResponder())
+    evts = session.responder(req.get_bbg_request(FakeService('//blp/refdata'), session), 0)
+
+    def decode():
+        req.ticks = req.new_buffer()
+        [req.on_event(e, e is evts[-1]) for e in evts]
+
+    decode()
+    report('ticks decode', len(req.response), best_of(decode, args.repeat), unit='ticks')
+    # the pages are executed on the Terminal pool
+    Terminal.configure(transport=FakeTransport())
+    baseline = None
+    for page in (None, 30):
+        run = lambda: IntradayTickRequest('bench us equity', start, end, ['BID', 'ASK'], conditions=True,
+                                          exchange=True, page=page).execute()
+        elapsed = best_of(run, args.repeat)
+        report('ticks page=%s' % page, len(req.response), elapsed, baseline, unit='ticks')
+        baseline = baseline or elapsed
+
+
+def bench_mktdata(args):
+    """ SubscriptionManager tick processing (ticks/sec) with and without conflation """
+    fields = ['fld%d' % i for i in range(args.fields)]
+    tickers = ['tkr%d us equity' % i for i in range(args.tickers)]
+    events = RandomTicks(ticks_per_event=100, fields_per_tick=min(3, args.fields))
+    baseline = None
+    for interval in (0, 1.):
+        subs = SubscriptionManager(fields, interval=interval, pool=SessionPool(FakeTransport(market_data=events)))
+        subs.subscribe(tickers)
+        subs.pump()  # subscription status
+        evts = [e for _ in range(args.ticks // 100) for e in events(subs.ps.session.subscriptions)]
+        elapsed = best_of(lambda: [subs.on_data(e) for e in evts], args.repeat)
+        report('mktdata interval=%s' % interval, len(evts) * 100, elapsed, baseline, unit='ticks')
+        baseline = baseline or elapsed
+        subs.close()
+
+
+def peak_rss():
+    """ return the peak resident memory (MB) of the process, None if unknown """
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def synthetic_requests(args):
+    """ return a reference, historical and intraday bar request of size args.scale (securities x fields x dates) """
+    nsids, nfields, ndates = map(int, args.scale.lower().split('x'))
+    sids = ['sec%d us equity' % i for i in range(nsids)]
+    fields = ['fld%d' % i for i in range(nfields)]
+    start = datetime(2000, 1, 3)
+    # the synthetic historical responses only have weekdays
+    end = start + timedelta(ndates // 5 * 7 + ndates % 5 - 1)
+    return [ReferenceDataRequest(sids, fields), HistoricalDataRequest(sids, fields, start, end),
+            IntrdayBarRequest(sids[0], 1, start, start + timedelta(minutes=ndates))]
+
+
+def run_pipeline(transport, request, repeat):
+    """ execute copies of the request repeat times on a new pool, return (sorted latencies, cells, growth of the
+    peak resident memory in MB or None if unknown) """
+    rss = peak_rss()
+    pool = SessionPool(transport)
+    latencies, cells = [], 0
+    for _ in range(repeat):
+        request = type(request).from_spec(request.to_spec())
+        t0 = time.time()
+        Terminal.execute_request(request, pool)
+        latencies.append(time.time() - t0)
+        cells = response_cells(request)
+    pool.close()
+    return sorted(latencies), cells, None if rss is None else peak_rss() - rss
+
+
+def run_pipeline_child(conn, transport, request, repeat):
+    conn.send(run_pipeline(transport, request, repeat))
+    conn.close()
+
+
+def bench_pipeline(args):
+    """ request pipeline (send, event dispatch, decode) per request type: cells/sec, latency and peak memory """
+    if args.capture:
+        from replay import ReplayTransport
+        transport = ReplayTransport(args.capture)
+        requests = transport.requests()
+    else:
+        transport = FakeTransport()
+        requests = synthetic_requests(args)
+    for request in requests:
+        if resource is None:
+            latencies, cells, rss = run_pipeline(transport, request, args.repeat)
+        else:
+            # the peak memory is a process wide high water mark, so each request type runs in a forked process
+            # and reports how much it raised the peak
+            recv, send = multiprocessing.Pipe(False)
+            child = multiprocessing.Process(target=run_pipeline_child, args=(send, transport, request, args.repeat))
+            child.start()
+            latencies, cells, rss = recv.recv()
+            child.join()
+        print '%-30s %10.4fs %14s cells/sec  latency min %.4fs median %.4fs  peak rss %s' % (
+            type(request).__name__, latencies[0], '{:,.0f}'.format(cells / latencies[0]), latencies[0],
+            latencies[len(latencies) // 2], '+%.1fMB' % rss if rss is not None else 'n/a')
+
+
+BENCHMARKS = {
+    'assemble': bench_assemble,
+    'bulk': bench_bulk,
+    'compact': bench_compact,
+    'decode': bench_decode,
+    'historical': bench_historical,
+    'mktdata': bench_mktdata,
+    'pipeline': bench_pipeline,
+    'ticks': bench_ticks,
+}
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('benchmark', nargs='*', help='benchmarks to run %s (default all)' % sorted(BENCHMARKS))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--dates', type=int, default=5000)
+    parser.add_argument('--fields', type=int, default=20)
+    parser.add_argument('--missing', type=float, default=0, help='fraction of missing cells (decode)')
+    parser.add_argument('--securities', type=int, default=3000)
+    parser.add_argument('--tickers', type=int, default=500)
+    parser.add_argument('--ticks', type=int, default=100000)
+    parser.add_argument('--scale', default='100x20x500',
+                        help='securities x fields x dates of the synthetic requests (pipeline)')
+    parser.add_argument('--capture', help='replay the requests of a RecordingTransport capture file (pipeline)')
+    args = parser.parse_args()
+    unknown = set(args.benchmark) - set(BENCHMARKS)
+    unknown and parser.error('unknown benchmarks %s' % sorted(unknown))
+    for name in args.benchmark or sorted(BENCHMARKS):
+        print '%s: %s' % (name, BENCHMARKS[name].__doc__.strip())
+        BENCHMARKS[name](args)
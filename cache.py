@@ -0,0 +1,414 @@
+"""
+caching of bloomberg results so repeated requests do not go back to the terminal
+
+Usage:
+
+> from bbg import HistoricalDataRequest
+> from cache import DiskCache
+> cache = DiskCache('c:/temp/bbgcache', max_bytes=2 * 1024 ** 3)
+> req = cache.execute(HistoricalDataRequest(['msft us equity', 'intc us equity'], ['px_open', 'px_last']))
+> print req.response, cache.stats
+"""
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from bbg import Terminal, ReferenceDataRequest, HistoricalDataRequest, unique
+from pandas import DataFrame, DatetimeIndex, Series
+import numpy as np
+import cPickle as pickle
+import hashlib
+import shelve
+import shutil
+import threading
+import time
+import os
+
+
+def freeze(overrides):
+    """ return a hashable, order independent version of the overrides map """
+    return tuple(sorted(overrides.iteritems())) if overrides else ()
+
+
+class CacheStats(object):
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.partial = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def add(self, hits=0, misses=0, partial=0, evictions=0):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            self.partial += partial
+            self.evictions += evictions
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses + self.partial
+        return float(self.hits) / total if total else np.nan
+
+    def __repr__(self):
+        return 'CacheStats(hits=%s, misses=%s, partial=%s, evictions=%s)' % (self.hits, self.misses, self.partial,
+                                                                             self.evictions)
+
+
+def execute_reference(request, store, stats, pool=None):
+    """Answer a ReferenceDataRequest cell by cell (security, field, overrides) from the store, requesting only the
+    missing cells from the terminal and returning the merged response in the requested order.
+
+    store : object with get(key) -> (hit, value) and put(key, value), put may return the number of entries it evicted
+
+    Requests decoding bulk fields into long frames (bulk='long') are not cached, the cells only hold row counts.
+    """
+    if request.bulk == 'long':
+        return Terminal.execute_request(request, pool=pool)
+    sids, flds, okey = unique(request.symbols), list(request.fields), freeze(request.overrides)
+    values, misses = {}, OrderedDict()
+    for sid in sids:
+        for fld in flds:
+            hit, value = store.get((sid, fld, okey))
+            if hit:
+                values[(sid, fld)] = value
+            else:
+                misses.setdefault(sid, []).append(fld)
+    nmisses = sum(len(m) for m in misses.itervalues())
+    stats.add(hits=len(sids) * len(flds) - nmisses, misses=nmisses)
+
+    # one request per distinct set of missing fields
+    groups = OrderedDict()
+    [groups.setdefault(tuple(mflds), []).append(sid) for sid, mflds in misses.iteritems()]
+    parts = [ReferenceDataRequest(gsids, list(gflds), overrides=request.overrides, response_type='map',
+                                  ignore_security_error=1, ignore_field_error=1) for gflds, gsids in groups.iteritems()]
+    parts and Terminal.execute_many(parts, pool=pool)
+    evictions = 0
+    for part in parts:
+        request.security_errors.extend(part.security_errors)
+        request.field_errors.extend(part.field_errors)
+        bad = set((e.security, e.field) for e in part.field_errors)
+        for sid, row in part.response.iteritems():
+            for fld, value in zip(part.fields, row):
+                values[(sid, fld)] = value
+                if (sid, fld) not in bad:
+                    evictions += store.put((sid, fld, okey), value) or 0
+    stats.add(evictions=evictions)
+
+    failed = set(e.security for e in request.security_errors)
+    sids = [sid for sid in sids if sid not in failed]
+    request.response = request.as_response(sids, [[values.get((sid, f), np.nan) for f in flds] for sid in sids])
+    request.has_exception and request.raise_exception()
+    return request
+
+
+def sizeof(value):
+    """ rough number of bytes held by a cached value """
+    if isinstance(value, DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    elif isinstance(value, basestring):
+        return 40 + len(value)
+    return 32
+
+
+class LRUStore(object):
+    """Thread safe in memory store of reference data cells, bounded by max_bytes (least recently used cells are
+    evicted first). A cell expires after the TTL of its field (field_ttls, keyed by upper case field name) or ttl.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 ** 2, ttl=300, field_ttls=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.field_ttls = dict((k.upper(), v) for k, v in (field_ttls or {}).iteritems())
+        self.nbytes = 0
+        self.evictions = 0
+        # key -> (expires, nbytes, value), ordered from least to most recently used
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def ttl_for(self, field):
+        return self.field_ttls.get(field.upper(), self.ttl)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return False, None
+            if entry[0] < time.time():
+                self.nbytes -= entry[1]
+                return False, None
+            self._entries[key] = entry
+            return True, entry[2]
+
+    def put(self, key, value):
+        """ store the value, return the number of cells evicted to make room for it """
+        ttl = self.ttl_for(key[1])
+        if ttl <= 0:
+            return 0
+        nbytes = sizeof(value)
+        evictions = 0
+        with self._lock:
+            old = self._entries.pop(key, None)
+            self.nbytes += nbytes - (old[1] if old else 0)
+            self._entries[key] = (time.time() + ttl, nbytes, value)
+            while self.nbytes > self.max_bytes and self._entries:
+                _, (_, size, _) = self._entries.popitem(last=False)
+                self.nbytes -= size
+                evictions += 1
+            self.evictions += evictions
+        return evictions
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class MemoryCache(object):
+    """In process cache of reference data, shared by all threads. Only the (security, field, overrides) cells which
+    are not cached are requested and the merged frame/map is returned in the requested order.
+
+    Parameters
+    ----------
+    max_bytes : memory bound of the cached values
+    ttl : default seconds a cell is valid for (0 to not cache)
+    field_ttls : map of field to seconds the field is valid for, ie {'NAME': 86400, 'PX_LAST': 0}
+    """
+
+    def __init__(self, max_bytes=256 * 1024 ** 2, ttl=300, field_ttls=None):
+        self.store = LRUStore(max_bytes=max_bytes, ttl=ttl, field_ttls=field_ttls)
+        self.stats = CacheStats()
+
+    def execute(self, request, bypass=False, pool=None):
+        if bypass or not isinstance(request, ReferenceDataRequest):
+            return Terminal.execute_request(request, pool=pool)
+        return execute_reference(request, self.store, self.stats, pool=pool)
+
+
+class ShelveStore(object):
+    """ reference data cells in a shelve file, each expiring ttl seconds after it was fetched """
+
+    def __init__(self, path, ttl=86400, max_entries=None):
+        self.db = shelve.open(path, protocol=pickle.HIGHEST_PROTOCOL)
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    def get(self, key):
+        entry = self.db.get(repr(key), None)
+        if entry is None or time.time() - entry[0] > self.ttl:
+            return False, None
+        return True, entry[1]
+
+    def put(self, key, value):
+        self.db[repr(key)] = (time.time(), value)
+
+    def evict(self):
+        """ remove the expired entries then the oldest until the store is within max_entries, return the count """
+        if self.max_entries is None or len(self.db) <= self.max_entries:
+            return 0
+        now = time.time()
+        fetched = sorted((entry[0], k) for k, entry in self.db.iteritems())
+        expired = [k for ts, k in fetched if now - ts > self.ttl]
+        excess = len(self.db) - len(expired) - self.max_entries
+        remove = expired + [k for ts, k in fetched if now - ts <= self.ttl][:max(excess, 0)]
+        for k in remove:
+            del self.db[k]
+        return len(remove)
+
+    def close(self):
+        self.db.close()
+
+
+class HistoryStore(object):
+    """Columnar history on disk, one directory per (security, field, periodicity, overrides) holding the dates and
+    values as .npy files (memory mapped when read) and the date range covered by previous requests.
+    """
+
+    def __init__(self, root, max_bytes=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.path.isdir(root) or os.makedirs(root)
+        # dirname -> [nbytes, last access]
+        self.index = {}
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            self.index[name] = [sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path)),
+                                os.path.getmtime(path)]
+
+    def dirname(self, key):
+        return hashlib.sha1(repr(key)).hexdigest()
+
+    def coverage(self, key):
+        """ return the (start, end) dates previously fetched for key or None """
+        path = os.path.join(self.root, self.dirname(key), 'meta.pkl')
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return pickle.load(f)['coverage']
+
+    def load(self, key):
+        """ return the (dates, values) arrays for the key """
+        name = self.dirname(key)
+        path = os.path.join(self.root, name)
+        if name not in self.index:
+            return np.empty(0, dtype='M8[ns]'), np.empty(0)
+        now = time.time()
+        os.utime(path, (now, now))
+        self.index[name][1] = now
+        values = os.path.join(path, 'values.npy')
+        try:
+            values = np.load(values, mmap_mode='r')
+        except ValueError:
+            # object arrays can not be memory mapped
+            values = np.load(values, allow_pickle=True)
+        return np.load(os.path.join(path, 'dates.npy'), mmap_mode='r'), values
+
+    def splice(self, key, start, end, covered_end, dates, values):
+        """ replace the stored history between start and end with dates/values and extend the coverage """
+        name = self.dirname(key)
+        path = os.path.join(self.root, name)
+        coverage = self.coverage(key)
+        if coverage is not None:
+            odates, ovalues = [np.array(a) for a in self.load(key)]
+            keep = (odates < np.datetime64(start)) | (odates >= np.datetime64(end + timedelta(1)))
+            dates = np.concatenate([odates[keep], dates])
+            values = np.concatenate([ovalues[keep], values])
+            order = np.argsort(dates, kind='mergesort')
+            dates, values = dates[order], values[order]
+
+        cstart, cend = start, covered_end
+        if coverage is not None:
+            cstart, cend = min(coverage[0], start), max(coverage[1], covered_end)
+        elif covered_end < start:
+            cend = None
+
+        os.path.isdir(path) or os.makedirs(path)
+        np.save(os.path.join(path, 'dates.npy'), dates.astype('M8[ns]'))
+        np.save(os.path.join(path, 'values.npy'), values)
+        with open(os.path.join(path, 'meta.pkl'), 'wb') as f:
+            pickle.dump({'key': key, 'coverage': (cstart, cend) if cend else None}, f, pickle.HIGHEST_PROTOCOL)
+        self.index[name] = [sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path)), time.time()]
+
+    @property
+    def nbytes(self):
+        return sum(nbytes for nbytes, _ in self.index.itervalues())
+
+    def evict(self, keep=()):
+        """ remove the least recently used histories until within max_bytes, return the count """
+        if self.max_bytes is None:
+            return 0
+        keep = set(self.dirname(k) for k in keep)
+        total, count = self.nbytes, 0
+        for name, (nbytes, _) in sorted(self.index.items(), key=lambda item: item[1][1]):
+            if total <= self.max_bytes:
+                break
+            if name not in keep:
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+                del self.index[name]
+                total -= nbytes
+                count += 1
+        return count
+
+
+class DiskCache(object):
+    """On disk cache for HistoricalDataRequest and ReferenceDataRequest.
+
+    Historical data is cached per (security, field, periodicity, overrides) with the date range it covers. Only the
+    missing date ranges are requested from the terminal and spliced into the stored history (the current day is
+    never marked as covered as its data may still change). Reference data is cached per (security, field, overrides)
+    and expires ref_ttl seconds after it is fetched.
+
+    Parameters
+    ----------
+    root : cache directory
+    max_bytes : size bound of the historical data, least recently used histories are evicted (None for no bound)
+    ref_ttl : seconds reference data is valid for
+    ref_max_entries : maximum number of cached reference data cells (None for no bound)
+    bypass : if True, execute requests directly against the terminal without reading or writing the cache
+    """
+
+    def __init__(self, root, max_bytes=None, ref_ttl=86400, ref_max_entries=None, bypass=False):
+        self.root = root
+        self.bypass = bypass
+        self.stats = CacheStats()
+        self.history = HistoryStore(os.path.join(root, 'history'), max_bytes=max_bytes)
+        self.reference = ShelveStore(os.path.join(root, 'reference.db'), ttl=ref_ttl, max_entries=ref_max_entries)
+
+    def execute(self, request, bypass=None, pool=None):
+        """ execute the request through the cache, returning the request with its response set """
+        bypass = self.bypass if bypass is None else bypass
+        if bypass or not isinstance(request, (HistoricalDataRequest, ReferenceDataRequest)):
+            return Terminal.execute_request(request, pool=pool)
+        elif isinstance(request, ReferenceDataRequest):
+            execute_reference(request, self.reference, self.stats, pool=pool)
+            self.stats.add(evictions=self.reference.evict())
+            return request
+        else:
+            return self.execute_historical(request, pool=pool)
+
+    def history_key(self, request, sid, fld):
+        return sid, fld, request.fetch_period, freeze(getattr(request, 'overrides', None))
+
+    def execute_historical(self, request, pool=None):
+        start, end = request.start.date(), request.end.date()
+        covered_end = min(end, datetime.today().date() - timedelta(1))
+        sids = unique(request.symbols)
+
+        # group the missing (security, field) cells by the date range to fetch
+        plan = OrderedDict()
+        for sid in sids:
+            for fld in request.fields:
+                coverage = self.history.coverage(self.history_key(request, sid, fld))
+                if coverage is None:
+                    ranges = [(start, end)]
+                    self.stats.add(misses=1)
+                else:
+                    ranges = []
+                    start < coverage[0] and ranges.append((start, coverage[0] - timedelta(1)))
+                    end > coverage[1] and ranges.append((coverage[1] + timedelta(1), end))
+                    self.stats.add(partial=1 if ranges else 0, hits=0 if ranges else 1)
+                [plan.setdefault(r, []).append((sid, fld)) for r in ranges]
+
+        parts = []
+        for (rstart, rend), cells in plan.iteritems():
+            psids, pflds = unique([c[0] for c in cells]), unique([c[1] for c in cells])
+            parts.append((rstart, rend, cells, HistoricalDataRequest(psids, pflds, start=rstart, end=rend,
+                                                                     period=request.fetch_period, ignore_security_error=1,
+                                                                     ignore_field_error=1, columnar=1)))
+        parts and Terminal.execute_many([p[-1] for p in parts], pool=pool)
+
+        for rstart, rend, cells, part in parts:
+            request.security_errors.extend(part.security_errors)
+            request.field_errors.extend(part.field_errors)
+            bad = set((e.security, e.field) for e in part.field_errors)
+            for sid, fld in cells:
+                frame = part.response.get(sid, None)
+                if frame is not None and (sid, fld) not in bad:
+                    self.history.splice(self.history_key(request, sid, fld), rstart, rend, covered_end,
+                                        frame.index.values, frame[fld].values)
+        request.security_errors = unique(request.security_errors)
+
+        failed = set(e.security for e in request.security_errors)
+        lo, hi = np.datetime64(start), np.datetime64(end + timedelta(1))
+        request.response = {}
+        for sid in sids:
+            if sid in failed:
+                continue
+            cols = {}
+            for fld in request.fields:
+                dates, values = self.history.load(self.history_key(request, sid, fld))
+                mask = (dates >= lo) & (dates < hi)
+                cols[fld] = (dates[mask], values[mask])
+            idx = DatetimeIndex(np.unique(np.concatenate([d for d, _ in cols.itervalues()])))
+            frame = DataFrame(dict((f, Series(v, index=DatetimeIndex(d))) for f, (d, v) in cols.iteritems()),
+                              index=idx, columns=request.fields)
+            frame.index.name = 'date'
+            request.response[sid] = frame if request.resampler is None else request.resampler.resample(frame)
+
+        self.stats.add(evictions=self.history.evict(keep=[self.history_key(request, s, f) for s in sids for f in request.fields]))
+        request.has_exception and request.raise_exception()
+        return request
+
+    def close(self):
+        self.reference.close()
@@ -0,0 +1,512 @@
+"""
+in-process fake of the blpapicom session and element tree. Lets the bbg request pipeline (pooling, decoding, etc)
+run without a terminal or win32com.
+
+Usage:
+
+> from bbg import Terminal, ReferenceDataRequest
+> from fake import FakeTransport
+> Terminal.configure(transport=FakeTransport())
+> print ReferenceDataRequest(['msft us equity', 'intc us equity'], ['px_last', 'name']).execute().response
+"""
+from collections import deque
+from datetime import date, datetime, time as dtime, timedelta
+from bbg import ResponseHandler, EventType, MessageList
+import threading
+import random
+
+# blpapi element data types
+BOOL, CHAR, BYTE, INT32, INT64, FLOAT32, FLOAT64, STRING, BYTEARRAY, DATE, TIME, DECIMAL, DATETIME, \
+    ENUMERATION, SEQUENCE, CHOICE = range(1, 17)
+
+
+def datatype_of(value):
+    """ return the blpapi datatype which best matches the python value """
+    if isinstance(value, bool):
+        return BOOL
+    elif isinstance(value, (int, long)):
+        return INT64
+    elif isinstance(value, float):
+        return FLOAT64
+    elif isinstance(value, basestring):
+        return STRING
+    elif isinstance(value, datetime):
+        return DATETIME
+    elif isinstance(value, date):
+        return DATE
+    elif isinstance(value, dtime):
+        return TIME
+    elif isinstance(value, (list, tuple, dict)):
+        return SEQUENCE
+    else:
+        raise ValueError('no blpapi datatype for %r' % (value,))
+
+
+class FakeElement(object):
+    """Mimic the blpapicom Element.
+
+    value can be a scalar, a list of (name, value) pairs for a sequence, or an array (list) of either. Use
+    FakeElement.array to make an array.
+    """
+
+    def __init__(self, name, value, datatype=None, is_array=False):
+        self.Name = name
+        self.IsArray = is_array
+        if is_array:
+            self._values = [v if isinstance(v, FakeElement) or not isinstance(v, list) else type(self)(name, v)
+                            for v in value]
+            if datatype is None:
+                datatype = value and datatype_of(value[0]) or SEQUENCE
+            self._children = []
+        elif isinstance(value, (list, tuple)) and datatype in (None, SEQUENCE, CHOICE):
+            datatype = datatype or SEQUENCE
+            self._children = [v if isinstance(v, FakeElement) else type(self)(n, v) for n, v in value]
+            self._values = []
+        else:
+            self._children = []
+            self._values = [value]
+        self.Datatype = datatype or datatype_of(value)
+        self._index = dict((c.Name, c) for c in self._children)
+
+    @classmethod
+    def array(cls, name, values, datatype=None):
+        return cls(name, values, datatype=datatype, is_array=True)
+
+    @property
+    def NumValues(self):
+        return len(self._values)
+
+    @property
+    def NumElements(self):
+        return len(self._children)
+
+    @property
+    def Value(self):
+        return self._values[0]
+
+    def GetValue(self, i):
+        return self._values[i]
+
+    def GetChoice(self):
+        assert self.Datatype == CHOICE, '%s is not a choice' % self.Name
+        return self._children[0]
+
+    def HasElement(self, name):
+        return name in self._index
+
+    def GetElement(self, name):
+        if isinstance(name, (int, long)):
+            return self._children[name]
+        try:
+            return self._index[name]
+        except KeyError:
+            raise Exception('Element %s has no child %s' % (self.Name, name))
+
+    @property
+    def Print(self):
+        if self.IsArray:
+            return '%s[] = {%s}' % (self.Name, ', '.join(v.Print if isinstance(v, FakeElement) else repr(v)
+                                                         for v in self._values))
+        elif self.Datatype == SEQUENCE:
+            return '%s = {%s}' % (self.Name, ', '.join(c.Print for c in self._children))
+        else:
+            return '%s = %r' % (self.Name, self.Value)
+
+
+class FakeCorrelationId(object):
+    def __init__(self, value):
+        self.Value = value
+
+
+class FakeMessage(object):
+    def __init__(self, msgtype, element, cid=None):
+        self.MessageTypeName = msgtype
+        self.AsElement = element
+        self.CorrelationId = FakeCorrelationId(cid)
+
+    def GetElement(self, name):
+        return self.AsElement.GetElement(name)
+
+    @property
+    def Print(self):
+        return '%s %s' % (self.MessageTypeName, self.AsElement.Print)
+
+
+class FakeEvent(MessageList):
+    pass
+
+
+class FakeSubscriptionList(object):
+    """ a subscription list created by FakeSession.CreateSubscriptionList """
+
+    def __init__(self):
+        self.entries = []
+
+    def Add(self, topic, fields, options='', cid=None):
+        fields = isinstance(fields, basestring) and fields.split(',') or list(fields)
+        self.entries.append((topic, [f.strip().upper() for f in fields], options, cid))
+
+
+class FakeRequestElement(object):
+    """ the writable element of a request (securities, fields, overrides, ...) """
+
+    def __init__(self, name):
+        self.name = name
+        self.values = []
+        self.elements = {}
+
+    def AppendValue(self, value):
+        self.values.append(value)
+
+    def AppendElement(self):
+        ele = FakeRequestElement(self.name)
+        self.values.append(ele)
+        return ele
+
+    def SetElement(self, name, value):
+        self.elements[name] = value
+
+    def GetElement(self, name):
+        return self.elements.setdefault(name, FakeRequestElement(name))
+
+
+class FakeRequest(FakeRequestElement):
+    """ a request created by FakeService.CreateRequest """
+
+    def Set(self, name, value):
+        self.elements[name] = value
+
+    def get(self, name, default=None):
+        """ return the list of appended values or the value set for name """
+        ele = self.elements.get(name, default)
+        return ele.values if isinstance(ele, FakeRequestElement) else ele
+
+
+class FakeService(object):
+    def __init__(self, name):
+        self.Name = name
+
+    def CreateRequest(self, name):
+        return FakeRequest(name)
+
+
+class FakeSession(ResponseHandler):
+    """Mimic the blpapicom ProviderSession (with the ResponseHandler mixed in as DispatchWithEvents does).
+
+    responder : callable(FakeRequest, correlation id) returning the list of FakeEvents sent back for the request
+    market_data : callable({cid: (topic, fields)}) returning the list of FakeEvents to deliver when the session
+                  has subscriptions and nothing else is queued
+    """
+
+    def __init__(self, responder, market_data=None):
+        ResponseHandler.__init__(self)
+        self.responder = responder
+        self.market_data = market_data
+        self.subscriptions = {}
+        self.started = False
+        self.opened = []
+        self.sent = []
+        self.cancelled = set()
+        self._queue = deque()
+        self._next_cid = 0
+
+    def Start(self):
+        self.started = True
+        return True
+
+    def Stop(self):
+        self.started = False
+        return True
+
+    def OpenService(self, name):
+        assert self.started, 'session not started'
+        self.opened.append(name)
+        return True
+
+    def GetService(self, name):
+        assert name in self.opened, 'service %s not opened' % name
+        return FakeService(name)
+
+    def SendRequest(self, request):
+        assert self.started, 'session not started'
+        self._next_cid += 1
+        self.sent.append(request)
+        self._queue.extend(self.responder(request, self._next_cid))
+        return FakeCorrelationId(self._next_cid)
+
+    def Cancel(self, cid):
+        self.cancelled.add(cid.Value)
+
+    def CreateSubscriptionList(self):
+        return FakeSubscriptionList()
+
+    def CreateCorrelationId(self, value):
+        return FakeCorrelationId(value)
+
+    def _subscription_status(self, msgtype, cid, topic, reason=None):
+        ele = FakeElement(msgtype, reason and [('reason', reason)] or [])
+        return FakeMessage(msgtype, ele, cid)
+
+    def Subscribe(self, sublist):
+        assert self.started, 'session not started'
+        msgs = []
+        for topic, fields, options, cid in sublist.entries:
+            if topic.upper().startswith('BAD_'):
+                reason = [('source', 'fake'), ('errorCode', 2), ('category', 'BAD_SEC'),
+                          ('description', 'Invalid security'), ('subcategory', 'INVALID_SECURITY')]
+                msgs.append(self._subscription_status('SubscriptionFailure', cid.Value, topic, reason))
+            else:
+                self.subscriptions[cid.Value] = (topic, fields)
+                msgs.append(self._subscription_status('SubscriptionStarted', cid.Value, topic))
+        self._queue.append(FakeEvent(EventType.SUBSCRIPTION_STATUS, msgs))
+
+    def Unsubscribe(self, sublist):
+        msgs = [self._subscription_status('SubscriptionTerminated', cid.Value, topic)
+                for topic, fields, options, cid in sublist.entries if self.subscriptions.pop(cid.Value, None)]
+        msgs and self._queue.append(FakeEvent(EventType.SUBSCRIPTION_STATUS, msgs))
+
+    def CreateDatetime(self, year, month, day, hour=0, minute=0, second=0):
+        return datetime(year, month, day, hour, minute, second)
+
+    def queue_events(self, evts):
+        """ queue the events for delivery by pump """
+        self._queue.extend(evts)
+
+    def terminate(self):
+        """ simulate the terminal dropping the session """
+        msg = FakeMessage('SessionTerminated', FakeElement('SessionTerminated', []))
+        self._queue.append(FakeEvent(EventType.SESSION_STATUS, [msg]))
+
+    @property
+    def pending(self):
+        """ True if pump has an event to deliver """
+        return bool(self._queue or (self.subscriptions and self.market_data))
+
+    def pump(self):
+        """ deliver the next queued event, return False if there was nothing to deliver """
+        if not self._queue and self.subscriptions and self.market_data:
+            self._queue.extend(self.market_data(self.subscriptions))
+        while self._queue and self.cancelled:
+            evt = self._queue[0]
+            msgs = [m for m in evt.messages if m.CorrelationId.Value not in self.cancelled]
+            if msgs:
+                evt.messages = msgs
+                break
+            self._queue.popleft()
+        if not self._queue:
+            return False
+        self.process_event(self._queue.popleft())
+        return True
+
+
+class FakeTransport(object):
+    """ transport whose sessions are FakeSessions answered by the responder (defaults to SyntheticResponder) and
+    ticked by market_data (defaults to RandomTicks) """
+
+    def __init__(self, responder=None, market_data=None):
+        self.responder = responder or SyntheticResponder()
+        self.market_data = market_data or RandomTicks()
+        self.sessions = []
+        self._wakeup = threading.Event()
+
+    def create_session(self):
+        session = FakeSession(self.responder, self.market_data)
+        self.sessions.append(session)
+        return session
+
+    def pump(self):
+        [s.pump() for s in self.sessions if s.started]
+
+    def wait(self, timeout):
+        """ return at once if a session has an event to deliver, otherwise sleep until wakeup or the timeout """
+        if not any(s.pending for s in self.sessions if s.started):
+            self._wakeup.wait(timeout)
+        self._wakeup.clear()
+
+    def wakeup(self):
+        self._wakeup.set()
+
+
+class SyntheticResponder(object):
+    """Generate deterministic responses for reference, historical and intraday bar requests.
+
+    Securities or fields starting with BAD_ produce security and field errors. Securities starting with LIMIT_
+    fail with a (transient) LIMIT security error the first limit_failures times they are requested. Reference data
+    fields starting with BULK_ produce bulk (array of sequence) values, with CAT_ one of 20 strings (ie a currency
+    or sector), with DT_ a date and with INT_ an integer.
+
+    msg_size : number of securities per message for reference data requests
+    ticks_per_minute : number of ticks per minute and event type for intraday tick requests
+    """
+    CONDITIONS = ['', 'R6', 'IS', 'OSN', 'R6,IS']
+    EXCHANGES = ['N', 'Q', 'P', 'Z', 'K']
+
+    def __init__(self, msg_size=10, ticks_per_minute=60, limit_failures=1):
+        self.msg_size = msg_size
+        self.ticks_per_minute = ticks_per_minute
+        self.limit_failures = limit_failures
+        self.limited = {}
+
+    def __call__(self, request, cid):
+        method = getattr(self, 'on_%s' % request.name, None)
+        if method is None:
+            raise NotImplementedError('no synthetic response for %s' % request.name)
+        msgs = [FakeMessage(request.name.replace('Request', 'Response'), ele, cid) for ele in method(request)]
+        evts = [FakeEvent(EventType.PARTIAL_RESPONSE, [m]) for m in msgs[:-1]]
+        evts.append(FakeEvent(EventType.RESPONSE, msgs[-1:]))
+        return evts
+
+    def value(self, sid, fld, *args):
+        """ deterministic value for the security and field """
+        rand = random.Random(hash((sid.upper(), fld.upper()) + args))
+        if fld.upper() in ('NAME', 'CRNCY', 'TICKER'):
+            return '%s %s' % (fld.upper(), sid.split()[0].upper())
+        elif fld.upper().startswith('CAT_'):
+            return '%s %d' % (fld.upper()[4:], rand.randint(1, 20))
+        elif fld.upper().startswith('DT_'):
+            return date(2000, 1, 1) + timedelta(rand.randint(0, 9000))
+        elif fld.upper().startswith('INT_'):
+            return rand.randint(0, 10 ** 6)
+        return round(rand.uniform(1, 100), 4)
+
+    def bulk_value(self, sid, fld):
+        """ deterministic dividend like table for the security (0 to 7 rows) """
+        rand = random.Random(hash((sid.upper(), fld.upper())))
+        rows = [[('Ex-Date', date(2015, 1, 1) + timedelta(91 * i)), ('Amount', self.value(sid, fld, i)),
+                 ('Frequency', FakeElement('Frequency', 'Quarterly', datatype=ENUMERATION))]
+                for i in range(rand.randint(0, 7))]
+        return FakeElement.array(fld, rows, datatype=SEQUENCE)
+
+    def is_error(self, sid):
+        """ True if the security must be answered with security_error """
+        if sid.upper().startswith('LIMIT_'):
+            failures = self.limited[sid] = self.limited.get(sid, 0) + 1
+            return failures <= self.limit_failures
+        return sid.upper().startswith('BAD_')
+
+    def security_error(self, sid):
+        if sid.upper().startswith('LIMIT_'):
+            return [('security', sid), ('securityError', [
+                ('source', 'fake'), ('code', 17), ('category', 'LIMIT'),
+                ('message', 'Daily limit reached'), ('subcategory', 'DAILY_LIMIT')])]
+        return [('security', sid), ('securityError', [
+            ('source', 'fake'), ('code', 15), ('category', 'BAD_SEC'),
+            ('message', 'Unknown/Invalid security'), ('subcategory', 'INVALID_SECURITY')])]
+
+    def field_exceptions(self, sid, flds):
+        return FakeElement.array('fieldExceptions', [
+            [('fieldId', f), ('errorInfo', [('source', 'fake'), ('code', 9), ('category', 'BAD_FLD'),
+                                            ('message', 'Field not valid'), ('subcategory', 'INVALID_FIELD')])]
+            for f in flds if f.upper().startswith('BAD_')], datatype=SEQUENCE)
+
+    def on_ReferenceDataRequest(self, request):
+        sids, flds = request.get('securities'), request.get('fields')
+        # the values depend on the overrides
+        ovrds = tuple(sorted((o.elements['fieldId'], o.elements['value']) for o in request.get('overrides', [])))
+        nodes = []
+        for seq, sid in enumerate(sids):
+            if self.is_error(sid):
+                nodes.append(self.security_error(sid))
+            else:
+                fdata = [(f, self.bulk_value(sid, f) if f.upper().startswith('BULK_') else self.value(sid, f, *ovrds))
+                         for f in flds if not f.upper().startswith('BAD_')]
+                nodes.append([('security', sid), ('sequenceNumber', seq), ('fieldData', fdata),
+                              ('fieldExceptions', self.field_exceptions(sid, flds))])
+        chunks = [nodes[i:i + self.msg_size] for i in range(0, len(nodes), self.msg_size)] or [[]]
+        return [FakeElement('ReferenceDataResponse', [
+            ('securityData', FakeElement.array('securityData', c, datatype=SEQUENCE))]) for c in chunks]
+
+    def on_HistoricalDataRequest(self, request):
+        sids, flds = request.get('securities'), request.get('fields')
+        start = datetime.strptime(request.get('startDate'), '%Y%m%d').date()
+        end = datetime.strptime(request.get('endDate'), '%Y%m%d').date()
+        dates = [start + timedelta(i) for i in range((end - start).days + 1)]
+        dates = [d for d in dates if d.weekday() < 5]
+        eles = []
+        for seq, sid in enumerate(sids):
+            if self.is_error(sid):
+                node = self.security_error(sid)
+            else:
+                rows = [[('date', d)] + [(f, self.value(sid, f, d.toordinal())) for f in flds
+                                         if not f.upper().startswith('BAD_')] for d in dates]
+                node = [('security', sid), ('sequenceNumber', seq),
+                        ('fieldExceptions', self.field_exceptions(sid, flds)),
+                        ('fieldData', FakeElement.array('fieldData', rows, datatype=SEQUENCE))]
+            eles.append(FakeElement('HistoricalDataResponse', [('securityData', node)]))
+        return eles
+
+    def on_IntradayBarRequest(self, request):
+        sid, interval = request.get('security'), request.get('interval')
+        start, end = request.get('startDateTime'), request.get('endDateTime')
+        bars, ts = [], start
+        while ts < end:
+            px = self.value(sid, 'px', ts.toordinal(), ts.hour, ts.minute)
+            bars.append([('time', ts), ('open', px), ('high', px + 1.), ('low', px - 1.), ('close', px + .5),
+                         ('volume', int(px * 100)), ('numEvents', int(px))])
+            ts += timedelta(minutes=interval)
+        chunks = [bars[i:i + 500] for i in range(0, len(bars), 500)] or [[]]
+        return [FakeElement('IntradayBarResponse', [
+            ('barData', [('barTickData', FakeElement.array('barTickData', c, datatype=SEQUENCE))])])
+            for c in chunks]
+
+    def ticks(self, sid, events, start, end, conditions=False, exchange=False):
+        """ return the deterministic tick rows (lists of (name, value)) of the security between start and end """
+        rand = random.Random(hash((sid.upper(), start)))
+        step = timedelta(seconds=60. / self.ticks_per_minute)
+        px = self.value(sid, 'px', start.toordinal())
+        ticks, ts = [], start
+        while ts < end:
+            for event in events:
+                px = round(max(.01, px + rand.gauss(0, .01)), 4)
+                tick = [('time', ts), ('type', event), ('value', px), ('size', float(rand.randint(1, 100) * 100))]
+                cond = rand.choice(self.CONDITIONS)
+                conditions and cond and tick.append(('conditionCodes', cond))
+                exchange and tick.append(('exchangeCode', rand.choice(self.EXCHANGES)))
+                ticks.append(tick)
+            ts += step
+        return ticks
+
+    def on_IntradayTickRequest(self, request):
+        ticks = self.ticks(request.get('security'), request.get('eventTypes'), request.get('startDateTime'),
+                           request.get('endDateTime'), request.get('includeConditionCodes'),
+                           request.get('includeExchangeCodes'))
+        chunks = [ticks[i:i + 1000] for i in range(0, len(ticks), 1000)] or [[]]
+        return [FakeElement('IntradayTickResponse', [
+            ('tickData', [('eidData', FakeElement.array('eidData', [], datatype=INT32)),
+                          ('tickData', FakeElement.array('tickData', c, datatype=SEQUENCE))])])
+            for c in chunks]
+
+
+class RandomTicks(object):
+    """Generate random walk MarketDataEvents for the subscriptions of a session (for load testing subscriptions).
+
+    ticks_per_event : number of ticks (messages) in each SUBSCRIPTION_DATA event
+    fields_per_tick : number of the subscribed fields updated by each tick (None for all)
+    seed : random seed
+    """
+
+    def __init__(self, ticks_per_event=10, fields_per_tick=None, seed=0):
+        self.ticks_per_event = ticks_per_event
+        self.fields_per_tick = fields_per_tick
+        self.rand = random.Random(seed)
+        self.prices = {}
+
+    def price(self, topic, fld):
+        key = (topic, fld)
+        px = self.prices.get(key, None)
+        if px is None:
+            px = SyntheticResponder().value(topic, fld)
+        px = self.prices[key] = round(max(.01, px + self.rand.gauss(0, .01)), 4)
+        return px
+
+    def __call__(self, subscriptions):
+        cids = subscriptions.keys()
+        msgs = []
+        for _ in range(self.ticks_per_event):
+            cid = self.rand.choice(cids)
+            topic, fields = subscriptions[cid]
+            if self.fields_per_tick and self.fields_per_tick < len(fields):
+                fields = self.rand.sample(fields, self.fields_per_tick)
+            ele = FakeElement('MarketDataEvents', [(f, self.price(topic, f)) for f in fields])
+            msgs.append(FakeMessage('MarketDataEvents', ele, cid))
+        return [FakeEvent(EventType.SUBSCRIPTION_DATA, msgs)]
@@ -0,0 +1,96 @@
+"""
+sinks for the RequestMetrics collected by instrumented requests. A sink is any object with a record(metrics) method.
+
+Usage:
+
+> from bbg import Terminal, ReferenceDataRequest
+> from metrics import HistogramSink
+> sink = HistogramSink()
+> Terminal.set_metrics_sink(sink)
+> ReferenceDataRequest(['msft us equity', 'intc us equity'], ['px_last', 'name']).execute()
+> print sink.summary()
+
+A single request can also be instrumented without a sink:
+
+> req = ReferenceDataRequest('msft us equity', 'px_last').instrument().execute()
+> print req.metrics
+"""
+from collections import defaultdict, deque
+from pandas import DataFrame, MultiIndex
+import numpy as np
+import logging
+import socket
+import threading
+
+
+class LoggingSink(object):
+    """ log one line per request """
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger('bbg.metrics')
+        self.level = level
+
+    def record(self, metrics):
+        self.logger.log(self.level, '%r', metrics)
+
+
+class StatsdSink(object):
+    """Send the metrics to a StatsD daemon over UDP: each timing as prefix.type.phase:ms|ms and each count as
+    prefix.type.name:n|c (plus prefix.type.failed:1|c for failed requests).
+    """
+
+    def __init__(self, host='localhost', port=8125, prefix='bbg'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def lines(self, metrics):
+        name = '%s.%s' % (self.prefix, metrics.request_type)
+        lines = ['%s.%s:%.3f|ms' % (name, phase, t * 1000.) for phase, t in sorted(metrics.timings.iteritems())]
+        lines.extend('%s.%s:%d|c' % (name, k, n) for k, n in sorted(metrics.counts.iteritems()))
+        metrics.failed and lines.append('%s.failed:1|c' % name)
+        return lines
+
+    def record(self, metrics):
+        try:
+            self.sock.sendto('\n'.join(self.lines(metrics)), self.address)
+        except socket.error:
+            # metrics must never fail the request
+            pass
+
+
+class HistogramSink(object):
+    """Keep the timings and counts of the requests in memory, by request type.
+
+    maxlen : number of requests kept per request type (the oldest are dropped)
+    """
+
+    def __init__(self, maxlen=10000):
+        self.maxlen = maxlen
+        self.values = defaultdict(lambda: defaultdict(lambda: deque(maxlen=maxlen)))
+        self.failures = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, metrics):
+        with self._lock:
+            values = self.values[metrics.request_type]
+            for name, v in metrics.timings.items() + metrics.counts.items():
+                values[name].append(v)
+            self.failures[metrics.request_type] += metrics.failed
+
+    def summary(self, percentiles=(50, 90, 99)):
+        """ return a DataFrame indexed by (request type, metric) with the count, mean, percentiles and max """
+        rows, index = [], []
+        with self._lock:
+            for rtype, values in sorted(self.values.iteritems()):
+                for name, vals in sorted(values.iteritems()):
+                    arr = np.asarray(vals, dtype=float)
+                    rows.append([len(arr), arr.mean()] + list(np.percentile(arr, percentiles)) + [arr.max()])
+                    index.append((rtype, name))
+        columns = ['count', 'mean'] + ['p%s' % p for p in percentiles] + ['max']
+        return DataFrame(rows, columns=columns, index=MultiIndex.from_tuples(index) if index else None)
+
+    def clear(self):
+        with self._lock:
+            self.values.clear()
+            self.failures.clear()
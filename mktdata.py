@@ -0,0 +1,323 @@
+"""
+real time subscriptions to //blp/mktdata using the bloomberg COM API v3.
+
+Ticks update a preallocated (ticker x field) array of latest values in place, so the snapshot frame is a view on
+that array and is not rebuilt per tick. Each ticker keeps a fixed size ring buffer of its (conflated) updates.
+
+Usage:
+
+> from mktdata import SubscriptionManager
+> subs = SubscriptionManager(['bid', 'ask', 'last_price'], capacity=5000)
+> subs.subscribe(['msft us equity', 'intc us equity'])
+> subs.subscribe('spx index', interval=1.)  # keep at most one update per second in the history
+> subs.run(10)
+> print subs.snapshot()
+> print subs.history('msft us equity')
+> subs.close()
+"""
+from bbg import Terminal, SessionPool, EventType, XmlHelper, SecurityError, SessionError
+from pandas import DataFrame, DatetimeIndex
+import numpy as np
+import time
+
+
+class TickRing(object):
+    """Fixed size ring buffer of (time, row of field values), one column per field. Once full the oldest
+    updates are overwritten.
+
+    Parameters
+    ----------
+    capacity : number of updates kept
+    nfields : number of fields (columns)
+    """
+
+    def __init__(self, capacity, nfields):
+        assert capacity > 0
+        self.capacity = capacity
+        self.times = np.zeros(capacity, dtype=np.int64)
+        self.values = np.empty((capacity, nfields), dtype=np.float64)
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, ns, row):
+        i = self.count % self.capacity
+        self.times[i] = ns
+        self.values[i] = row
+        self.count += 1
+
+    def ordered(self):
+        """ return the (times, values) arrays oldest first (copies) """
+        n, i = len(self), self.count % self.capacity
+        if self.count <= self.capacity:
+            return self.times[:n].copy(), self.values[:n].copy()
+        return np.concatenate([self.times[i:], self.times[:i]]), np.concatenate([self.values[i:], self.values[:i]])
+
+    def frame(self, columns):
+        times, values = self.ordered()
+        return DataFrame(values, index=DatetimeIndex(times.view('datetime64[ns]'), name='time'), columns=columns)
+
+
+class Ticker(object):
+    """ subscription state of one ticker """
+
+    def __init__(self, name, cid, interval, capacity, nfields):
+        self.name = name
+        self.cid = cid
+        self.interval = interval
+        self.ring = TickRing(capacity, nfields)
+        self.row = None  # row in the latest values array
+        self.status = 'Pending'
+        self.dirty = False
+        self.last_flush = 0.
+
+
+class SubscriptionManager(object):
+    """Batched subscriptions to //blp/mktdata with client side conflation.
+
+    Parameters
+    ----------
+    fields : fields subscribed for every ticker (the columns of the snapshot and history)
+    capacity : number of updates kept per ticker in its history ring buffer
+    interval : default conflation interval in seconds. Ticks arriving within the interval update the snapshot but
+               only the latest values are recorded in the history (0 to record every tick)
+    options : subscription options passed to bloomberg (ie 'interval=5.0' for server side summaries)
+    pool : SessionPool, a session is held from the pool until close. Defaults to a dedicated pool of one session
+           on the Terminal pool's transport, so the subscriptions do not hold the session requests are sent on
+    on_update : optional callable(ticker, row) called when an update is recorded in the history. row is a view
+                on the ticker's latest values (do not keep a reference).
+
+    Numeric values are kept in float arrays, non numeric values (ie TRADING_STATUS) are kept in the snapshot as
+    NaN and available through latest_values().
+    """
+    SERVICE = '//blp/mktdata'
+
+    def __init__(self, fields, capacity=1024, interval=0, options='', pool=None, on_update=None):
+        fields = isinstance(fields, basestring) and [fields] or fields
+        self.fields = [f.upper() for f in fields]
+        self.columns = dict((f, i) for i, f in enumerate(self.fields))
+        self.capacity = capacity
+        self.interval = interval
+        self.options = options
+        self.owns_pool = pool is None
+        self.pool = pool or SessionPool(transport=Terminal.get_pool().transport, size=1)
+        self.on_update = on_update
+        self.ps = None
+        self.tickers = []  # snapshot row order
+        self.by_name = {}
+        self.by_cid = {}
+        self.text = {}
+        self.errors = []
+        self.latest = np.empty((0, len(self.fields)))
+        self._frame = None
+        self._next_cid = 0
+
+    def start(self):
+        if self.ps is None:
+            self.ps = self.pool.acquire()
+            try:
+                self.ps.get_service(self.SERVICE)
+            except Exception:
+                self.close(discard=True)
+                raise
+            self.ps.session.do_init(self)
+        return self
+
+    def _resize(self, tickers):
+        """ rebuild the latest values array for the new set of tickers (only done when tickers change) """
+        latest = np.empty((len(tickers), len(self.fields)))
+        latest.fill(np.nan)
+        for row, t in enumerate(tickers):
+            if t.row is not None:
+                latest[row] = self.latest[t.row]
+        for row, t in enumerate(tickers):
+            t.row = row
+        self.tickers, self.latest, self._frame = tickers, latest, None
+
+    def _subscription_list(self, session, tickers):
+        sublist = session.CreateSubscriptionList()
+        fields = ','.join(self.fields)
+        for t in tickers:
+            sublist.Add(t.name, fields, self.options, session.CreateCorrelationId(t.cid))
+        return sublist
+
+    def subscribe(self, tickers, interval=None):
+        """ subscribe to the tickers with a single subscription list, interval overrides the default conflation """
+        self.start()
+        tickers = isinstance(tickers, basestring) and [tickers] or tickers
+        interval = self.interval if interval is None else interval
+        added = []
+        for name in tickers:
+            if name in self.by_name:
+                self.by_name[name].interval = interval
+            else:
+                self._next_cid += 1
+                t = Ticker(name, self._next_cid, interval, self.capacity, len(self.fields))
+                added.append(t)
+        if added:
+            self._resize(self.tickers + added)
+            for t in added:
+                self.by_name[t.name] = self.by_cid[t.cid] = t
+            self._send('Subscribe', added)
+        return self
+
+    def unsubscribe(self, tickers):
+        """ unsubscribe from the tickers with a single subscription list """
+        tickers = isinstance(tickers, basestring) and [tickers] or tickers
+        removed = [self.by_name[n] for n in tickers if n in self.by_name]
+        if removed:
+            self.ps and self._send('Unsubscribe', removed)
+            self._resize([t for t in self.tickers if t not in removed])
+            for t in removed:
+                del self.by_name[t.name], self.by_cid[t.cid]
+                self.text.pop(t.name, None)
+        return self
+
+    def _send(self, method, tickers):
+        try:
+            session = self.ps.session
+            getattr(session, method)(self._subscription_list(session, tickers))
+        except Exception, e:
+            raise SessionError('failed to %s: %s' % (method.lower(), e))
+
+    def resubscribe(self):
+        """ replace a failed session and subscribe to all the tickers again """
+        self.close(discard=True)
+        self.start()
+        self.tickers and self._send('Subscribe', self.tickers)
+
+    # event handling (called by the ResponseHandler)
+    def on_admin_event(self, evt):
+        if evt.EventType == EventType.SUBSCRIPTION_DATA:
+            self.on_data(evt)
+        elif evt.EventType == EventType.SUBSCRIPTION_STATUS:
+            self.on_status(evt)
+
+    def on_event(self, evt, is_final):
+        pass
+
+    def on_data(self, evt):
+        now = time.time()
+        ns = long(now * 1e9)
+        fields, columns, latest = self.fields, self.columns, self.latest
+        iter = evt.CreateMessageIterator()
+        while iter.Next():
+            msg = iter.Message
+            t = self.by_cid.get(XmlHelper.correlation_id(msg.CorrelationId), None)
+            if t is None:  # unsubscribed
+                continue
+            row = latest[t.row]
+            ele = msg.AsElement
+            for f in fields:
+                if ele.HasElement(f):
+                    fele = ele.GetElement(f)
+                    if fele.Datatype in (2, 3, 4, 5, 6, 7, 12):
+                        row[columns[f]] = fele.Value
+                    else:
+                        self.text.setdefault(t.name, {})[f] = XmlHelper.as_value(fele)
+            if t.interval and now - t.last_flush < t.interval:
+                t.dirty = True
+            else:
+                self._record(t, row, now, ns)
+
+    def _record(self, t, row, now, ns):
+        t.ring.append(ns, row)
+        t.dirty, t.last_flush = False, now
+        self.on_update and self.on_update(t.name, row)
+
+    def on_status(self, evt):
+        iter = evt.CreateMessageIterator()
+        while iter.Next():
+            msg = iter.Message
+            t = self.by_cid.get(XmlHelper.correlation_id(msg.CorrelationId), None)
+            if t is None:
+                continue
+            t.status = str(msg.MessageTypeName)
+            if t.status == 'SubscriptionFailure':
+                self.errors.append(self.as_security_error(t.name, msg.AsElement))
+
+    @staticmethod
+    def as_security_error(ticker, ele):
+        reason = ele.GetElement('reason')
+        get = lambda n: reason.HasElement(n) and XmlHelper.as_value(reason.GetElement(n)) or None
+        return SecurityError(security=ticker, source=get('source'), code=get('errorCode'),
+                             category=get('category'), message=get('description'), subcategory=get('subcategory'))
+
+    def flush(self, now=None):
+        """ record the conflated updates of tickers whose interval has elapsed """
+        now = now or time.time()
+        ns = long(now * 1e9)
+        for t in self.tickers:
+            if t.dirty and now - t.last_flush >= t.interval:
+                self._record(t, self.latest[t.row], now, ns)
+
+    def next_wait(self, timeout):
+        """ seconds to sleep waiting for events: timeout capped by the next conflated update to flush """
+        flushes = [t.last_flush + t.interval for t in self.tickers if t.dirty]
+        if not flushes:
+            return timeout
+        # a flush already due is 0, not a full timeout
+        return max(0, min(timeout, min(flushes) - time.time()))
+
+    def pump(self, timeout=0):
+        """ deliver waiting events and flush conflated updates. timeout is the number of seconds to sleep in the
+        transport until events arrive (0 to not block) """
+        self.start()
+        timeout and self.pool.transport.wait(self.next_wait(timeout))
+        self.pool.transport.pump()
+        session = self.ps.session
+        if session.has_deferred_exception:
+            exc_info = session.exc_info
+            if isinstance(exc_info[1], SessionError):
+                self.resubscribe()
+            else:
+                session.do_init(self)
+                raise exc_info[1], None, exc_info[2]
+        elif not self.ps.is_healthy:
+            self.resubscribe()
+        self.flush()
+
+    def run(self, duration):
+        """ pump events for duration seconds """
+        end = time.time() + duration
+        now = time.time()
+        while now < end:
+            self.pump(end - now)
+            now = time.time()
+
+    def snapshot(self):
+        """ the latest numeric values as a (ticker x field) DataFrame. The frame is a view on the latest values
+        array, so it reflects new ticks without being rebuilt (copy it to freeze the values). """
+        if self._frame is None:
+            self._frame = DataFrame(self.latest, index=[t.name for t in self.tickers], columns=self.fields,
+                                    copy=False)
+        return self._frame
+
+    def latest_values(self, ticker):
+        """ return a dict of the latest values (including non numeric fields) of the ticker """
+        row = self.latest[self.by_name[ticker].row]
+        values = dict((f, row[i]) for i, f in enumerate(self.fields))
+        values.update(self.text.get(ticker, {}))
+        return values
+
+    def history(self, ticker):
+        """ return the recorded updates of the ticker as a DataFrame indexed by receive time """
+        return self.by_name[ticker].ring.frame(self.fields)
+
+    def status(self):
+        return dict((t.name, t.status) for t in self.tickers)
+
+    def close(self, discard=False):
+        """ release the session (the subscriptions are cancelled when the session is discarded) """
+        ps, self.ps = self.ps, None
+        if ps is not None:
+            if not discard and ps.is_healthy and self.tickers:
+                try:
+                    ps.session.Unsubscribe(self._subscription_list(ps.session, self.tickers))
+                except Exception:
+                    discard = True
+            ps.session and ps.session.do_cleanup()
+            self.pool.release(ps, discard=discard)
+        # stop the session of a dedicated pool (the pool can still start one again)
+        self.owns_pool and self.pool.close()
@@ -0,0 +1,201 @@
+"""
+record the events of a terminal session to a file and replay them offline (no terminal or win32com needed).
+
+Recording (on the terminal machine) ::
+
+> from bbg import Terminal, ComTransport
+> from replay import RecordingTransport
+> transport = RecordingTransport(ComTransport(), 'session.cap')
+> Terminal.configure(transport=transport)
+> ... run the requests ...
+> transport.close()
+
+Replaying (anywhere) ::
+
+> from replay import ReplayTransport
+> Terminal.configure(transport=ReplayTransport('session.cap'))
+> ... run the same requests, each is answered with the events recorded for it ...
+
+The requests of a capture can be rebuilt with ReplayTransport.requests(), bench.py pipeline --capture uses them.
+"""
+from collections import deque, OrderedDict
+from datetime import date, datetime, time as dtime
+from bbg import EventType, XmlHelper, Request
+from fake import FakeTransport, FakeElement, FakeMessage, FakeEvent, SEQUENCE, CHOICE, DATE, TIME, DATETIME
+import cPickle as pickle
+import threading
+import json
+
+
+def request_key(request):
+    """ return the canonical (json spec) key of the request, None if it has no spec """
+    try:
+        return json.dumps(request.to_spec(), sort_keys=True)
+    except NotImplementedError:
+        return None
+
+
+def capture_scalar(dtype, v):
+    """ convert a COM element value to a python value which can be pickled """
+    if dtype == DATE:
+        return date(v.year, v.month, v.day) if v else None
+    elif dtype == TIME:
+        return dtime(v.hour, v.minute, v.second) if v else None
+    elif dtype == DATETIME:
+        return datetime(v.year, v.month, v.day, v.hour, v.minute, v.second) if v else None
+    return v
+
+
+def capture_element(ele):
+    """ return the element tree as nested (name, datatype, is_array, value or children) tuples """
+    name, dtype = str(ele.Name), ele.Datatype
+    if ele.IsArray:
+        if dtype in (SEQUENCE, CHOICE):
+            values = [capture_element(ele.GetValue(i)) for i in range(ele.NumValues)]
+        else:
+            values = [capture_scalar(dtype, ele.GetValue(i)) for i in range(ele.NumValues)]
+        return name, dtype, True, values
+    elif dtype == SEQUENCE:
+        return name, dtype, False, [capture_element(ele.GetElement(i)) for i in range(ele.NumElements)]
+    elif dtype == CHOICE:
+        return name, dtype, False, [capture_element(ele.GetChoice())]
+    return name, dtype, False, capture_scalar(dtype, ele.Value)
+
+
+def rebuild_element(captured):
+    """ return the FakeElement tree of a captured element """
+    name, dtype, is_array, value = captured
+    if is_array:
+        values = [rebuild_element(v) for v in value] if dtype in (SEQUENCE, CHOICE) else value
+        return FakeElement.array(name, values, datatype=dtype)
+    elif dtype in (SEQUENCE, CHOICE):
+        return FakeElement(name, [(c[0], rebuild_element(c)) for c in value], datatype=dtype)
+    return FakeElement(name, value, datatype=dtype)
+
+
+class SessionRecorder(object):
+    """ captures the events processed by one session (set as the session's recorder) """
+
+    def __init__(self, transport, index):
+        self.transport = transport
+        self.index = index
+
+    def record(self, evt):
+        msgs = []
+        iter = evt.CreateMessageIterator()
+        while iter.Next():
+            msg = iter.Message
+            msgs.append((str(msg.MessageTypeName), XmlHelper.correlation_id(msg.CorrelationId),
+                         capture_element(msg.AsElement)))
+        self.transport.write(('event', self.index, evt.EventType, msgs))
+
+
+class RecordingTransport(object):
+    """Transport which records the requests sent and the events received by the sessions of another transport.
+
+    Parameters
+    ----------
+    transport : the transport recorded (ie ComTransport)
+    path : capture file, records are appended as they occur
+    """
+
+    def __init__(self, transport, path):
+        self.transport = transport
+        self.thread_affine = getattr(transport, 'thread_affine', False)
+        self.path = path
+        self.nsessions = 0
+        self._file = open(path, 'ab')
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        with self._lock:
+            self._file and pickle.dump(record, self._file, pickle.HIGHEST_PROTOCOL)
+
+    def create_session(self):
+        session = self.transport.create_session()
+        with self._lock:
+            session.recorder = SessionRecorder(self, self.nsessions)
+            self.nsessions += 1
+        return session
+
+    def sent(self, session, request, cid):
+        """ called by RequestBatch with each request sent """
+        recorder = getattr(session, 'recorder', None)
+        recorder and self.write(('request', recorder.index, request_key(request), XmlHelper.correlation_id(cid)))
+
+    def pump(self):
+        self.transport.pump()
+
+    def wait(self, timeout):
+        self.transport.wait(timeout)
+
+    def wakeup(self):
+        self.transport.wakeup()
+
+    def close(self):
+        with self._lock:
+            f, self._file = self._file, None
+        f and f.close()
+
+
+def load_capture(path):
+    """ return the list of records of a capture file """
+    records = []
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                records.append(pickle.load(f))
+            except EOFError:
+                return records
+
+
+class ReplayTransport(FakeTransport):
+    """FakeTransport answering each request with the events recorded for an identical request (same spec). Identical
+    requests recorded several times are answered in the recorded order, cycling when exhausted.
+
+    A request which was not recorded fails with a RequestFailure.
+
+    Parameters
+    ----------
+    path : capture file written by a RecordingTransport
+    """
+
+    def __init__(self, path):
+        FakeTransport.__init__(self, responder=lambda request, cid: [])
+        self.path = path
+        self.keys = []
+        self.responses = {}
+        self.load(load_capture(path))
+
+    def load(self, records):
+        bycid = {}
+        for rec in records:
+            if rec[0] == 'event':
+                _, index, evttype, msgs = rec
+                groups = OrderedDict()
+                [groups.setdefault(cid, []).append((msgtype, ele)) for msgtype, cid, ele in msgs]
+                for cid, cmsgs in groups.iteritems():
+                    bycid.setdefault((index, cid), []).append((evttype, cmsgs))
+        for rec in records:
+            if rec[0] == 'request':
+                _, index, key, cid = rec
+                key not in self.responses and self.keys.append(key)
+                self.responses.setdefault(key, deque()).append(bycid.get((index, cid), []))
+
+    def requests(self):
+        """ return a Request (rebuilt from its spec) for each distinct recorded request """
+        return [Request.from_spec(json.loads(key)) for key in self.keys if key]
+
+    def events(self, key, cid):
+        """ return the FakeEvents replaying the response recorded for key with the correlation id cid """
+        recorded = self.responses.get(key, None)
+        if not recorded:
+            ele = FakeElement('RequestFailure', [('reason', [('description', 'no recorded response')])])
+            return [FakeEvent(EventType.REQUEST_STATUS, [FakeMessage('RequestFailure', ele, cid)])]
+        evts = recorded[0]
+        recorded.rotate(-1)
+        return [FakeEvent(evttype, [FakeMessage(msgtype, rebuild_element(ele), cid) for msgtype, ele in msgs])
+                for evttype, msgs in evts]
+
+    def sent(self, session, request, cid):
+        session.queue_events(self.events(request_key(request), XmlHelper.correlation_id(cid)))
@@ -0,0 +1,377 @@
+"""
+rate limited execution of bloomberg requests. Requests are queued by priority (interactive requests jump ahead of
+backfills), throttled by token buckets on requests/sec and cells/min, and securities failing with a transient error
+(ie a LIMIT or TIMEOUT security error) are retried with backoff without requesting the other securities again.
+
+Usage:
+
+> from bbg import HistoricalDataRequest, ReferenceDataRequest
+> from scheduler import RequestScheduler, DataBudget, BACKFILL
+> scheduler = RequestScheduler(requests_per_sec=5, cells_per_min=500000, budget=DataBudget(10 ** 7))
+> tickets = [scheduler.submit(HistoricalDataRequest(sids, 'px_last', start='1990-01-01'), BACKFILL) for sids in chunks]
+> req = scheduler.execute(ReferenceDataRequest('msft us equity', 'px_last'))   # sent before the queued backfills
+> [t.result() for t in tickets]
+> print scheduler.budget.consumed, scheduler.stats
+> scheduler.close()
+"""
+from bbg import Terminal, HistoricalDataRequest, ReferenceDataRequest, RequestTimeout, ResponseError, unique
+from collections import defaultdict
+import numpy as np
+import Queue
+import itertools
+import threading
+import time
+import sys
+
+# request priorities, the lowest is sent first
+INTERACTIVE = 0
+BACKFILL = 10
+
+# number of business days in a period
+PERIOD_DAYS = {'DAILY': 1, 'WEEKLY': 5, 'MONTHLY': 21, 'QUARTERLY': 63, 'SEMI-ANNUAL': 126, 'YEARLY': 252}
+
+
+def estimate_cells(request):
+    """ return the number of cells (data points) the request is expected to return """
+    if isinstance(request, ReferenceDataRequest):
+        return len(unique(request.symbols)) * len(request.fields)
+    if isinstance(request, HistoricalDataRequest):
+        days = np.busday_count(request.start.date(), request.end.date()) + 1
+        periods = max(1, days // PERIOD_DAYS[request.fetch_period])
+        return len(unique(request.symbols)) * len(request.fields) * periods
+    return 1
+
+
+def response_cells(request):
+    """ return the number of cells of the decoded response """
+    response = request.response
+    if isinstance(response, dict):
+        return sum(f.size for f in response.itervalues())
+    return getattr(response, 'size', 0)
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class DataBudget(object):
+    """Count the data points (cells) consumed by the scheduled requests.
+
+    limit : maximum number of cells, a request expected to exceed it fails with BudgetExceeded (None for no limit)
+    """
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.consumed = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    @property
+    def remaining(self):
+        return None if self.limit is None else max(0, self.limit - self.consumed)
+
+    def check(self, cells):
+        """ raise BudgetExceeded if consuming cells would exceed the limit """
+        with self._lock:
+            if self.limit is not None and self.consumed + cells > self.limit:
+                raise BudgetExceeded('%s cells requested with %s of %s left' % (cells, self.remaining, self.limit))
+
+    def consume(self, cells):
+        with self._lock:
+            self.consumed += cells
+            self.requests += 1
+
+
+class TokenBucket(object):
+    """Tokens refilled at rate per second up to capacity (defaults to one second of tokens).
+
+    The rate is halved by slow_down (down to 1/64th of the initial rate) and raised back by speed_up.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.max_rate = self.rate = float(rate)
+        self.min_rate = self.max_rate / 64
+        self.capacity = float(capacity or max(1., self.rate))
+        self.tokens = self.capacity
+        self.updated = time.time()
+        self._lock = threading.Lock()
+
+    def refill(self):
+        now = time.time()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, n=1):
+        """ return the seconds until n tokens are available (0 if they are) """
+        with self._lock:
+            self.refill()
+            return max(0., (min(n, self.capacity) - self.tokens) / self.rate)
+
+    def take(self, n=1):
+        """ take n tokens, more than are available leaves the bucket in debt """
+        with self._lock:
+            self.refill()
+            self.tokens -= n
+
+    def acquire(self, n=1):
+        """ block until n tokens are available and take them, returning the seconds waited. More than capacity
+        tokens are taken once the bucket is full, leaving it in debt. """
+        waited = 0.
+        while True:
+            with self._lock:
+                self.refill()
+                needed = min(n, self.capacity)
+                if self.tokens >= needed:
+                    self.tokens -= n
+                    return waited
+                delay = (needed - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def slow_down(self):
+        with self._lock:
+            self.refill()
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def speed_up(self, step=.1):
+        with self._lock:
+            self.refill()
+            self.rate = min(self.max_rate, self.rate + self.max_rate * step)
+
+
+class ScheduledRequest(object):
+    """ a request queued on the RequestScheduler, call result() to wait for it """
+
+    def __init__(self, request, priority):
+        self.request = request
+        self.priority = priority
+        # securities are only retried for requests which can be subset
+        self.pending = unique(request.symbols) if self.retries_securities(request) else None
+        self.parts = []
+        self.attempt = 0
+        self.part = None  # request of the current attempt, once built
+        self.throttled = 0.
+        self.throttled_since = None
+        self.exc_info = None
+        self.done = threading.Event()
+
+    @staticmethod
+    def retries_securities(request):
+        return isinstance(request, (ReferenceDataRequest, HistoricalDataRequest))
+
+    def attempt_request(self):
+        """ return the request to send for this attempt """
+        request = self.request
+        if self.pending is not None:
+            return request.subset(self.pending, request.fields)
+        if self.attempt == 0:
+            return request
+        # a failed request may hold a partial response, so a copy is sent again
+        return type(request).from_spec(request.to_spec())
+
+    def finish(self, exc_info=None):
+        self.exc_info = exc_info
+        self.done.set()
+
+    def result(self, timeout=None):
+        """ wait for the request to complete and return it, raising its failure """
+        if not self.done.wait(timeout):
+            raise RequestTimeout('scheduled request not complete after %ss' % timeout)
+        if self.exc_info:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.request
+
+
+class RequestScheduler(object):
+    """Queue requests by priority and execute them from worker threads within the rate limits.
+
+    Reference and historical requests are sent as subset requests. Securities failing with a transient security
+    error are requested again (and only them) after backoff * 2 ** attempt seconds, up to max_retries times, before
+    the parts are merged into the request. Other requests are sent again whole when they fail with a transient
+    ResponseError or a RequestTimeout. A LIMIT error halves the rates, which then recover with each success.
+
+    Parameters
+    ----------
+    requests_per_sec : maximum rate of terminal requests (None for no limit)
+    cells_per_min : maximum rate of cells requested, estimated before sending (None for no limit)
+    workers : number of requests executed concurrently
+    max_retries : maximum number of times a failed security (or request) is retried
+    backoff : seconds before the first retry, doubled with each retry
+    budget : DataBudget counting the cells consumed (a DataBudget with no limit if None)
+    pool : SessionPool (defaults to the Terminal pool)
+    timeout : seconds each terminal request is given to complete (None for no limit)
+    transient : error categories which are retried
+    """
+
+    def __init__(self, requests_per_sec=None, cells_per_min=None, workers=1, max_retries=3, backoff=1.,
+                 budget=None, pool=None, timeout=None, transient=('LIMIT', 'TIMEOUT')):
+        self.request_bucket = requests_per_sec and TokenBucket(requests_per_sec) or None
+        self.cell_bucket = cells_per_min and TokenBucket(cells_per_min / 60., capacity=cells_per_min) or None
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.budget = budget or DataBudget()
+        self.pool = pool
+        self.timeout = timeout
+        self.transient = set(transient)
+        self.stats = defaultdict(int)
+        self.queue = Queue.PriorityQueue()
+        self.sequence = itertools.count()
+        self.closed = False
+        self.timers = set()  # pending retries
+        self._lock = threading.Lock()
+        self._throttle_lock = threading.Lock()
+        self._queued = threading.Condition()
+        self.workers = [threading.Thread(target=self.work, name='bbg-scheduler-%d' % i) for i in range(workers)]
+        [w.setDaemon(True) for w in self.workers]
+        [w.start() for w in self.workers]
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.stats[name] += n
+
+    def submit(self, request, priority=INTERACTIVE):
+        """ queue the request and return its ScheduledRequest """
+        assert not self.closed, 'scheduler is closed'
+        ticket = ScheduledRequest(request, priority)
+        self.enqueue(ticket)
+        return ticket
+
+    def execute(self, request, priority=INTERACTIVE, timeout=None):
+        """ execute the request through the scheduler and return it """
+        return self.submit(request, priority).result(timeout)
+
+    def enqueue(self, ticket):
+        self.queue.put((ticket.priority, next(self.sequence), ticket))
+        with self._queued:
+            self._queued.notify_all()
+
+    def work(self):
+        while True:
+            _, seq, ticket = self.queue.get()
+            if ticket is None:
+                break
+            try:
+                delay = self.throttle(ticket)
+                if delay:
+                    # queue the ticket again rather than wait with it, so that a higher priority ticket queued
+                    # meanwhile is sent first
+                    self.queue.put((ticket.priority, seq, ticket))
+                    with self._queued:
+                        self._queued.wait(delay)
+                    continue
+                self.run(ticket)
+            except Exception:
+                ticket.finish(sys.exc_info())
+
+    def throttle(self, ticket):
+        """ check the budget and take the rate limit tokens for the ticket's next request. Return 0 once they are
+        taken, otherwise the seconds until they are available (nothing is taken). """
+        if ticket.part is None:
+            ticket.part = ticket.attempt_request()
+        cells = estimate_cells(ticket.part)
+        self.budget.check(cells)
+        buckets = [(b, n) for b, n in ((self.request_bucket, 1), (self.cell_bucket, cells)) if b is not None]
+        with self._throttle_lock:
+            delay = max([b.delay(n) for b, n in buckets] or [0.])
+            if delay:
+                ticket.throttled_since = ticket.throttled_since or time.time()
+                return delay
+            [b.take(n) for b, n in buckets]
+        if ticket.throttled_since is not None:
+            waited, ticket.throttled_since = time.time() - ticket.throttled_since, None
+            ticket.throttled += waited
+            self.count('throttled_ms', int(waited * 1000))
+        return 0.
+
+    def send(self, request):
+        self.count('sent')
+        if request.batchable:
+            return Terminal.execute_request(request, pool=self.pool, timeout=self.timeout)
+        return request.execute(timeout=self.timeout)
+
+    def adapt(self, categories):
+        """ slow down on a LIMIT error, speed up otherwise """
+        buckets = [b for b in (self.request_bucket, self.cell_bucket) if b is not None]
+        if 'LIMIT' in categories:
+            self.count('limited')
+            [b.slow_down() for b in buckets]
+        else:
+            [b.speed_up() for b in buckets]
+
+    def retry(self, ticket):
+        """ queue the ticket again after the backoff, return False if it is out of retries or the scheduler is
+        closed """
+        if ticket.attempt >= self.max_retries:
+            return False
+        with self._lock:
+            if self.closed:
+                return False
+            delay = self.backoff * 2 ** ticket.attempt
+            ticket.attempt += 1
+            self.stats['retries'] += 1
+            timer = threading.Timer(delay, self.retry_due, [ticket])
+            timer.setDaemon(True)
+            self.timers.add(timer)
+            timer.start()
+        return True
+
+    def retry_due(self, ticket):
+        self.enqueue(ticket)
+        with self._lock:
+            self.timers.discard(threading.current_thread())
+
+    def run(self, ticket):
+        request = ticket.request
+        part, ticket.part = ticket.part, None
+        part is not request and request.metrics is not None and part.instrument()
+        try:
+            self.send(part)
+        except (ResponseError, RequestTimeout) as e:
+            category = getattr(e, 'category', 'TIMEOUT')
+            self.adapt([category])
+            if category in self.transient and self.retry(ticket):
+                return
+            raise
+
+        categories = [e.category for e in part.security_errors]
+        self.adapt(categories)
+        if ticket.pending is None:
+            ticket.parts.append(part)
+            if part is not request:
+                request.metrics is not None and request.metrics.merge([part.metrics])
+                request.take_response(part)
+            self.complete(ticket)
+            return
+
+        failed = unique([e.security for e in part.security_errors if e.category in self.transient])
+        errors = part.security_errors
+        ticket.parts.append(part)
+        if failed and ticket.attempt < self.max_retries:
+            # the failed securities are taken from the retry
+            part.security_errors = [e for e in errors if e.security not in set(failed)]
+            ticket.pending = failed
+            if self.retry(ticket):
+                return
+            # the scheduler was closed, the failures are kept
+            part.security_errors = errors
+        request.metrics is not None and request.metrics.merge([p.metrics for p in ticket.parts])
+        request.merge_responses(ticket.parts)
+        self.complete(ticket)
+
+    def complete(self, ticket):
+        request = ticket.request
+        self.budget.consume(sum(response_cells(p) for p in ticket.parts))
+        request.metrics is not None and request.metrics.add('throttle', ticket.throttled)
+        ticket.parts = []
+        request.has_exception and request.raise_exception()
+        ticket.finish()
+
+    def close(self):
+        """ stop the workers once the queued requests and the pending retries are executed. Requests failing after
+        close are not retried again. """
+        with self._lock:
+            self.closed = True
+            timers = list(self.timers)
+        [t.join() for t in timers]
+        [self.queue.put((sys.maxint, next(self.sequence), None)) for _ in self.workers]
+        [w.join() for w in self.workers]
@@ -1,54 +1,650 @@
 """
-Expose the Bloomberg Desktop API as an XML RPC server. Useful when running a virtual machine locally.
+Expose the Bloomberg Desktop API as an XML RPC server. Useful when running a virtual machine locally. A Client given
+several servers (ie one per terminal VM) splits large requests across them by security.
+
+The stream server (terminal_as_stream_server / StreamClient) is a faster alternative. The client sends a json
+description of the request and the server streams back each decoded partial response as soon as it is available,
+with DataFrame columns sent as raw (optionally zlib compressed) NumPy buffers.
 """
-from bbg3 import Terminal
+from bbg3 import Request, RequestBatch, RequestMetrics, SessionPool, ComTransport, Terminal, CompactRows, unique
+from collections import OrderedDict
 from socket import gethostname
-from SimpleXMLRPCServer import SimpleXMLRPCServer
-from xmlrpclib import Binary, ServerProxy
+from SimpleXMLRPCServer import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+from xmlrpclib import Binary, ServerProxy, ProtocolError
+import httplib
+from pandas import DataFrame, Index, MultiIndex, Categorical
+import numpy as np
+import SocketServer
+import socket
+import struct
+import json
+import zlib
 import pickle
 import logging
+import threading
+import Queue
+import time
 import sys
 
+try:
+    import pythoncom
+except ImportError:
+    pythoncom = None
+
 _logger = logging.getLogger(__name__)
 
 
-def terminal_as_server(hostport=None):
+class Job(object):
+    """ a request being executed for one or more clients, collecting the response chunks as they are decoded """
+
+    def __init__(self, key, request):
+        self.key = key
+        self.request = request
+        self.chunks = []
+        self.error = None
+        self.security_errors = []
+        self.field_errors = []
+        self.done = False
+        self._cond = threading.Condition()
+
+    def add_chunk(self, chunk):
+        with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+
+    def finish(self, error=None):
+        with self._cond:
+            self.error = error
+            self.security_errors = list(self.request.security_errors)
+            self.field_errors = list(self.request.field_errors)
+            self.done = True
+            self._cond.notify_all()
+
+    def iter_chunks(self):
+        """ yield all the chunks of the job (including those decoded before the call) until it is done """
+        i = 0
+        while True:
+            with self._cond:
+                while i >= len(self.chunks) and not self.done:
+                    self._cond.wait()
+                if i >= len(self.chunks):
+                    return
+                chunk = self.chunks[i]
+            i += 1
+            yield chunk
+
+    def result(self, request):
+        """ set the response and errors of the (client's copy of the) request, raising if the job failed """
+        request.response_from_chunks(list(self.iter_chunks()))
+        request.security_errors = list(self.security_errors)
+        request.field_errors = list(self.field_errors)
+        if self.error:
+            request.has_exception and request.raise_exception()
+            raise Exception(self.error)
+        return request
+
+
+class TerminalWorker(threading.Thread):
+    """Thread owning its terminal sessions. COM is initialized on the thread and the sessions' events are pumped
+    there. The waiting jobs (up to batch_size) are sent together on one session with a RequestBatch.
+    """
+
+    def __init__(self, dispatcher, transport, batch_size):
+        threading.Thread.__init__(self, name='TerminalWorker')
+        self.daemon = True
+        self.dispatcher = dispatcher
+        self.transport = transport
+        self.batch_size = batch_size
+
+    def run(self):
+        pythoncom and pythoncom.CoInitialize()
+        pool = SessionPool(transport=self.transport)
+        queue = self.dispatcher.queue
+        while True:
+            jobs = [queue.get()]
+            while len(jobs) < self.batch_size:
+                try:
+                    jobs.append(queue.get_nowait())
+                except Queue.Empty:
+                    break
+            try:
+                self.execute(jobs, pool)
+            finally:
+                [self.dispatcher.finished(job) for job in jobs]
+
+    def execute(self, jobs, pool):
+        batched = [job for job in jobs if job.request.batchable]
+        if batched:
+            [job.request.stream(job.add_chunk, buffered=False) for job in batched]
+            try:
+                batch = RequestBatch([job.request for job in batched], pool, timeout=self.dispatcher.request_timeout,
+                                     sink=Terminal.metrics_sink)
+                batch.wait(raise_errors=False)
+                errors = dict((id(request), str(exc_info[1]) or repr(exc_info[1])) for request, exc_info in batch.errors)
+            except Exception, e:
+                _logger.exception('request batch failed')
+                errors = dict((id(job.request), str(e) or repr(e)) for job in batched)
+            [job.request.stream(None) for job in batched]
+            [self.finish(job, errors.get(id(job.request), None)) for job in batched]
+
+        for job in jobs:
+            if not job.request.batchable:
+                error = None
+                try:
+                    timeout = self.dispatcher.request_timeout
+                    [job.add_chunk(chunk) for chunk in job.request.execute_iter(buffered=False, timeout=timeout)]
+                except Exception, e:
+                    error = str(e) or repr(e)
+                self.finish(job, error)
+
+    def finish(self, job, error=None):
+        """ wake the waiters of the job once identical requests can no longer be coalesced onto it """
+        self.dispatcher.finished(job)
+        job.finish(error)
+
+
+class TerminalDispatcher(object):
+    """Bounded queue of requests executed by TerminalWorker threads. Identical requests (same spec) submitted while
+    one is queued or executing are coalesced: they share the single terminal call and all receive its chunks.
+
+    Parameters
+    ----------
+    workers : number of worker threads, each with its own session
+    max_queue : maximum number of queued requests, submit fails when the queue stays full for queue_timeout seconds
+    batch_size : maximum number of queued requests a worker sends together
+    transport_factory : callable returning the transport of a worker (defaults to ComTransport)
+    request_timeout : seconds a request is given on the terminal before it fails (None for no limit)
+    """
+
+    def __init__(self, workers=1, max_queue=100, batch_size=16, transport_factory=None, queue_timeout=30,
+                 request_timeout=None):
+        self.queue = Queue.Queue(max_queue)
+        self.queue_timeout = queue_timeout
+        self.request_timeout = request_timeout
+        self.inflight = {}
+        self._lock = threading.Lock()
+        transport_factory = transport_factory or ComTransport
+        self.workers = [TerminalWorker(self, transport_factory(), batch_size) for _ in range(workers)]
+        [w.start() for w in self.workers]
+
+    @staticmethod
+    def coalesce_key(request):
+        try:
+            return json.dumps(request.to_spec(), sort_keys=True)
+        except (NotImplementedError, TypeError, ValueError):
+            # no spec, or one which is not serializable (ie datetime or numpy override values)
+            return None
+
+    def submit(self, request):
+        """ return the Job executing the request (or an identical request already in flight) """
+        key = self.coalesce_key(request)
+        with self._lock:
+            job = self.inflight.get(key, None) if key else None
+            if job is not None:
+                return job
+            job = Job(key, request)
+            if key:
+                self.inflight[key] = job
+        try:
+            self.queue.put(job, timeout=self.queue_timeout)
+        except Queue.Full:
+            self.finished(job)
+            job.finish('server busy: request queue is full')
+        return job
+
+    def finished(self, job):
+        with self._lock:
+            if job.key and self.inflight.get(job.key, None) is job:
+                del self.inflight[job.key]
+
+
+class KeepAliveRequestHandler(SimpleXMLRPCRequestHandler):
+    """ HTTP/1.1 so the client connections are kept open between requests """
+    protocol_version = 'HTTP/1.1'
+
+
+class ThreadedXMLRPCServer(SocketServer.ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+    def __init__(self, addr, **kwargs):
+        kwargs.setdefault('requestHandler', KeepAliveRequestHandler)
+        kwargs.setdefault('logRequests', False)
+        SimpleXMLRPCServer.__init__(self, addr, **kwargs)
+
+
+def terminal_as_server(hostport=None, workers=1, max_queue=100, request_timeout=None):
+    dispatcher = TerminalDispatcher(workers=workers, max_queue=max_queue, request_timeout=request_timeout)
+
     class BbgServer(object):
         def execute_request(self, brequest):
             request = pickle.loads(brequest.data)
-            response = Terminal.execute_request(request)
+            response = dispatcher.submit(request).result(request)
             return Binary(pickle.dumps(response))
     methods = BbgServer()
     hostport = hostport or (gethostname(), 3030)
-    server = SimpleXMLRPCServer(hostport)
+    server = ThreadedXMLRPCServer(hostport)
     server.register_instance(methods)
     _logger.info('starting server on %s:%s' % hostport)
     server.serve_forever()
 
 
-class Client(object):
-    def __init__(self, url):
+class ServerEndpoint(object):
+    """Persistent connections to one terminal_as_server. Each ServerProxy keeps its HTTP connection open between
+    calls, up to connections proxies are kept idle for reuse. A server which can not be reached is skipped for
+    retry_after seconds.
+    """
+    # errors meaning the server (or the connection to it) is down, rather than a failed request
+    CONNECTION_ERRORS = (socket.error, httplib.HTTPException, ProtocolError, EOFError)
+
+    def __init__(self, url, connections=2, retry_after=30):
         self.url = url
-        self.proxy = ServerProxy(url, allow_none=1)
+        self.connections = connections
+        self.retry_after = retry_after
+        self.idle = []
+        self.inflight = 0
+        self.requests = 0
+        self.failures = 0
+        self.down_until = 0
+        self._lock = threading.Lock()
+
+    @property
+    def healthy(self):
+        return self.down_until <= time.time()
+
+    def call(self, brequest):
+        """ return the binary response of the request, marking the server down if it can not be reached """
+        with self._lock:
+            # a ServerProxy can not be tested for truth, it would call __nonzero__ on the server
+            proxy = self.idle.pop() if self.idle else ServerProxy(self.url, allow_none=1)
+            self.inflight += 1
+            self.requests += 1
+        try:
+            bresponse = proxy.execute_request(brequest)
+        except self.CONNECTION_ERRORS:
+            with self._lock:
+                self.failures += 1
+                self.down_until = time.time() + self.retry_after
+            raise
+        finally:
+            with self._lock:
+                self.inflight -= 1
+        with self._lock:
+            len(self.idle) < self.connections and self.idle.append(proxy)
+            self.down_until = 0
+        return bresponse
 
-    def execte_request(self, request):
+    def __repr__(self):
+        return '<ServerEndpoint %s %s inflight=%s requests=%s failures=%s>' % (
+            self.url, self.healthy and 'UP' or 'DOWN', self.inflight, self.requests, self.failures)
+
+
+class Client(object):
+    """Client of terminal_as_server, balancing the requests over one or more servers.
+
+    Requests are sent to the healthy server with the fewest requests in flight, and to the next one when the server
+    can not be reached. With several healthy servers, reference and historical requests are split by security into
+    one part per server (or per max_securities securities), executed in parallel and merged back into the request.
+    The parts are sent by up to connections threads per healthy server.
+
+    urls : url or list of urls of the servers
+    connections : number of idle keep-alive connections kept per server, and of parts sent to it concurrently
+    max_securities : maximum number of securities per part (None to only split by server)
+    retry_after : seconds an unreachable server is skipped
+    """
+
+    def __init__(self, urls, connections=2, max_securities=None, retry_after=30):
+        self.urls = isinstance(urls, basestring) and [urls] or list(urls)
+        self.endpoints = [ServerEndpoint(url, connections, retry_after) for url in self.urls]
+        self.connections = connections
+        self.max_securities = max_securities
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return self.urls[0]
+
+    def ranked_endpoints(self):
+        """ return the endpoints to try in order: healthy ones by requests in flight, then the ones down """
+        with self._lock:
+            # rotate so idle servers share the load
+            self.endpoints.append(self.endpoints.pop(0))
+            endpoints = list(self.endpoints)
+        return sorted(endpoints, key=lambda e: (not e.healthy, e.inflight))
+
+    def send(self, request):
+        """ execute the request on the first server which can be reached and return the response request """
         brequest = Binary(pickle.dumps(request))
-        bresponse = self.proxy.execute_request(brequest)
-        return pickle.loads(bresponse.data)
+        error = None
+        for endpoint in self.ranked_endpoints():
+            try:
+                bresponse = endpoint.call(brequest)
+            except ServerEndpoint.CONNECTION_ERRORS, e:
+                _logger.warn('server %s failed (%s), trying the next one' % (endpoint.url, e))
+                error = sys.exc_info()
+                continue
+            response = pickle.loads(bresponse.data)
+            if request.metrics is not None:
+                # the response carries the metrics of the server side execution when the server instruments requests
+                response.metrics = response.metrics or request.metrics
+                response.metrics.count('bytes_sent', len(brequest.data))
+                response.metrics.count('bytes_received', len(bresponse.data))
+            return response
+        raise error[0], error[1], error[2]
+
+    def split(self, request):
+        """ return the parts of the request to execute in parallel (None if it is sent whole) """
+        symbols = getattr(request, 'symbols', None)
+        healthy = len([e for e in self.endpoints if e.healthy])
+        if symbols is None or not request.batchable:
+            return None
+        sids = unique(symbols)
+        size = -(-len(sids) // max(1, healthy))
+        size = self.max_securities and min(size, self.max_securities) or size
+        if len(sids) <= size:
+            return None
+        try:
+            return [request.subset(sids[i:i + size], request.fields) for i in range(0, len(sids), size)]
+        except NotImplementedError:
+            return None
+
+    def execute_request(self, request):
+        parts = self.split(request)
+        if parts is None:
+            return self.send(request)
+
+        request.metrics is not None and [p.instrument() for p in parts]
+        results, errors = [None] * len(parts), []
+        todo = Queue.Queue()
+        [todo.put(i) for i in range(len(parts))]
+
+        def run():
+            # stop taking parts once one has failed
+            while not errors:
+                try:
+                    i = todo.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    results[i] = self.send(parts[i])
+                except Exception:
+                    errors.append(sys.exc_info())
+
+        healthy = len([e for e in self.endpoints if e.healthy]) or 1
+        nthreads = min(len(parts), healthy * self.connections)
+        threads = [threading.Thread(target=run, name='bbg-client-%d' % i) for i in range(nthreads)]
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+        request.metrics is not None and request.metrics.merge([p.metrics for p in results])
+        request.merge_responses(results)
+        request.has_exception and request.raise_exception()
+        return request
+
+    # previous (misspelled) name
+    execte_request = execute_request
+
+
+# message kinds of the stream protocol
+SPEC, FRAME, KEYED_FRAME, MAP, END = 'S', 'F', 'K', 'M', 'E'
+_HEADER = struct.Struct('!cI')
+
+
+def send_msg(sock, kind, payload):
+    sock.sendall(_HEADER.pack(kind, len(payload)))
+    sock.sendall(payload)
+    return _HEADER.size + len(payload)
+
+
+def recv_exact(sock, n):
+    buf = bytearray(n)
+    view = memoryview(buf)
+    while n:
+        read = sock.recv_into(view, n)
+        if not read:
+            raise EOFError('connection closed')
+        view, n = view[read:], n - read
+    return bytes(buf)
+
+
+def recv_msg(sock):
+    """ return (kind, payload) of the next message """
+    kind, size = _HEADER.unpack(recv_exact(sock, _HEADER.size))
+    return kind, recv_exact(sock, size)
+
+
+def _str(v):
+    """ json strings are unicode, the rest of the library uses str """
+    return str(v) if isinstance(v, unicode) else v
+
+
+class TableCodec(object):
+    """Encode a table (index plus columns) as a json header followed by the column buffers.
+
+    Numeric, boolean and datetime64 columns are sent as their raw bytes, categoricals as codes plus categories and
+    object columns as json (or pickle when they hold non json values such as dates or bulk data frames). Each buffer
+    is zlib compressed when compress (the zlib level) is not 0.
+    """
+
+    def __init__(self, compress=6):
+        self.compress = compress
+
+    def encode_array(self, arr):
+        """ return (spec, buffer) for the array """
+        if isinstance(arr, Categorical):
+            spec = {'kind': 'cat', 'categories': list(arr.categories), 'dtype': arr.codes.dtype.str}
+            buf = arr.codes.tobytes()
+        elif arr.dtype != object:
+            spec = {'kind': 'raw', 'dtype': arr.dtype.str}
+            buf = np.ascontiguousarray(arr).tobytes()
+        else:
+            try:
+                spec, buf = {'kind': 'json'}, json.dumps(arr.tolist())
+            except (TypeError, ValueError):
+                spec, buf = {'kind': 'pickle'}, pickle.dumps(arr, pickle.HIGHEST_PROTOCOL)
+        if self.compress:
+            buf = zlib.compress(buf, self.compress)
+        spec['z'] = bool(self.compress)
+        spec['size'] = len(buf)
+        return spec, buf
+
+    def decode_array(self, spec, buf):
+        if spec['z']:
+            buf = zlib.decompress(buf)
+        kind = spec['kind']
+        if kind == 'raw':
+            return np.frombuffer(bytearray(buf), dtype=spec['dtype'])
+        elif kind == 'cat':
+            return Categorical.from_codes(np.frombuffer(bytearray(buf), dtype=spec['dtype']), map(_str, spec['categories']))
+        elif kind == 'json':
+            arr = json.loads(buf)
+            result = np.empty(len(arr), dtype=object)
+            result[:] = map(_str, arr)
+            return result
+        else:
+            return pickle.loads(buf)
+
+    def encode(self, index, columns, names, index_name=None, key=None):
+        specs, bufs = zip(*[self.encode_array(a) for a in [index] + list(columns)])
+        header = json.dumps({'key': key, 'names': list(names), 'index_name': index_name, 'specs': specs})
+        return struct.pack('!I', len(header)) + header + ''.join(bufs)
+
+    def decode(self, payload):
+        """ return (header, index, columns) """
+        size = struct.unpack('!I', payload[:4])[0]
+        header = json.loads(payload[4:4 + size])
+        pos, arrays = 4 + size, []
+        for spec in header['specs']:
+            arrays.append(self.decode_array(spec, payload[pos:pos + spec['size']]))
+            pos += spec['size']
+        return header, arrays[0], arrays[1:]
+
+    def encode_frame(self, frame, key=None):
+        if isinstance(frame.index, MultiIndex):
+            # the levels are sent as the leading columns and index_name is the list of their names
+            levels = list(frame.index.names)
+            frame = frame.reset_index()
+            return self.encode(np.arange(len(frame)), [frame[c].values for c in frame.columns], list(frame.columns),
+                               index_name=levels, key=key)
+        return self.encode(frame.index.values, [frame[c].values for c in frame.columns], list(frame.columns),
+                           index_name=frame.index.name, key=key)
+
+    def decode_frame(self, payload):
+        """ return (key, frame) """
+        header, index, columns = self.decode(payload)
+        names, index_name = map(_str, header['names']), header['index_name']
+        if isinstance(index_name, list):
+            frame = DataFrame(OrderedDict(zip(names, columns)), columns=names)
+            return _str(header['key']), frame.set_index(map(_str, index_name))
+        frame = DataFrame(OrderedDict(zip(names, columns)), index=Index(index, name=_str(index_name)), columns=names)
+        return _str(header['key']), frame
+
+    def encode_map(self, response):
+        """ encode a map response chunk (security -> list of values) column by column """
+        sids = list(response)
+        rows = [response[sid] for sid in sids]
+        columns = []
+        for i in range(len(rows[0]) if rows else 0):
+            col = np.empty(len(rows), dtype=object)
+            for j, row in enumerate(rows):
+                col[j] = row[i]
+            columns.append(col)
+        return self.encode(np.array(sids, dtype=object), columns, range(len(columns)))
+
+    def decode_map(self, payload):
+        header, index, columns = self.decode(payload)
+        return dict((sid, [c[i] for c in columns]) for i, sid in enumerate(index))
+
+
+class StreamHandler(SocketServer.BaseRequestHandler):
+    """ execute the request spec sent by the client, streaming back each chunk as it is decoded """
+
+    def handle(self):
+        kind, payload = recv_msg(self.request)
+        assert kind == SPEC, 'expected a request spec'
+        spec = json.loads(payload)
+        codec = TableCodec(spec.get('compress', 6))
+        sink = Terminal.metrics_sink
+        # the stream's metrics are recorded separately from the (possibly coalesced) terminal request
+        metrics = sink is not None and RequestMetrics('stream.%s' % spec['request']['type'])
+        sent = 0
+        job = self.server.dispatcher.submit(Request.from_spec(spec['request']))
+        for chunk in job.iter_chunks():
+            t0 = time.time()
+            if isinstance(chunk, tuple):
+                sent += send_msg(self.request, KEYED_FRAME, codec.encode_frame(chunk[1], key=chunk[0]))
+            elif isinstance(chunk, dict):
+                sent += send_msg(self.request, MAP, codec.encode_map(chunk))
+            elif isinstance(chunk, CompactRows):
+                sent += send_msg(self.request, FRAME, codec.encode_frame(chunk.frame))
+            else:
+                sent += send_msg(self.request, FRAME, codec.encode_frame(chunk))
+            metrics and metrics.add('encode', time.time() - t0)
+        if job.error:
+            _logger.warn('failed to execute %s: %s' % (spec['request']['type'], job.error))
+        end = {'error': job.error, 'security_errors': [list(e) for e in job.security_errors],
+               'field_errors': [list(e) for e in job.field_errors]}
+        sent += send_msg(self.request, END, json.dumps(end))
+        if metrics:
+            metrics.failed = bool(job.error)
+            metrics.count('messages', len(job.chunks) + 1)
+            metrics.count('bytes_received', _HEADER.size + len(payload))
+            metrics.count('bytes_sent', sent)
+            sink.record(metrics)
+
+
+class StreamServer(SocketServer.ThreadingTCPServer):
+    """ threaded stream server, the requests are executed by the dispatcher's workers """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, hostport, dispatcher):
+        SocketServer.ThreadingTCPServer.__init__(self, hostport, StreamHandler)
+        self.dispatcher = dispatcher
+
+
+def terminal_as_stream_server(hostport=None, workers=1, max_queue=100, request_timeout=None):
+    hostport = hostport or (gethostname(), 3031)
+    dispatcher = TerminalDispatcher(workers=workers, max_queue=max_queue, request_timeout=request_timeout)
+    server = StreamServer(hostport, dispatcher)
+    _logger.info('starting stream server on %s:%s' % hostport)
+    server.serve_forever()
+
+
+class StreamClient(object):
+    """Client of terminal_as_stream_server.
+
+    hostport : (host, port) of the stream server
+    compress : zlib level the server should use for the response buffers (0 for none)
+    """
+
+    def __init__(self, hostport, compress=6, timeout=None):
+        self.hostport = hostport
+        self.compress = compress
+        self.timeout = timeout
+
+    def execute_iter(self, request):
+        """ yield the response chunks of the request as the server sends them """
+        from bbg3 import SecurityError, FieldError
+        metrics = request.metrics
+        sock = socket.create_connection(self.hostport, self.timeout)
+        try:
+            sent_at = time.time()
+            sent = send_msg(sock, SPEC, json.dumps({'request': request.to_spec(), 'compress': self.compress}))
+            metrics is not None and metrics.count('bytes_sent', sent)
+            codec = TableCodec()
+            while True:
+                kind, payload = recv_msg(sock)
+                if metrics is not None:
+                    metrics.counts['messages'] or metrics.add('first_message', time.time() - sent_at)
+                    metrics.count('messages')
+                    metrics.count('bytes_received', _HEADER.size + len(payload))
+                if kind == FRAME:
+                    yield codec.decode_frame(payload)[1]
+                elif kind == KEYED_FRAME:
+                    yield codec.decode_frame(payload)
+                elif kind == MAP:
+                    yield codec.decode_map(payload)
+                else:
+                    end = json.loads(payload)
+                    metrics is not None and metrics.add('server', time.time() - sent_at)
+                    break
+        finally:
+            sock.close()
+        request.security_errors = [SecurityError(*map(_str, e)) for e in end['security_errors']]
+        request.field_errors = [FieldError(*map(_str, e)) for e in end['field_errors']]
+        if end['error']:
+            request.has_exception and request.raise_exception()
+            raise Exception(end['error'])
+
+    def execute_request(self, request):
+        request.response_from_chunks(list(self.execute_iter(request)))
+        return request
+
+    # same name as Client
+    execte_request = execute_request
 
 
 if __name__ == '__main__':
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument('--hostport', help='hostport to bind server to')
+    parser.add_argument('--stream', action='store_true', help='run the stream server rather than the xml rpc server')
+    parser.add_argument('--workers', type=int, default=1, help='number of threads executing requests on the terminal')
+    parser.add_argument('--max-queue', type=int, default=100, help='maximum number of queued requests')
+    parser.add_argument('--timeout', type=float, help='seconds a request is given on the terminal before it fails')
     args = parser.parse_args()
 
     if args.hostport:
-        hostport = tuple( args.hostport.split(':') )
+        host, port = args.hostport.split(':')
+        hostport = (host, int(port))
     else:
         hostport = None
     # start the server
-    terminal_as_server(hostport)
+    if args.stream:
+        terminal_as_stream_server(hostport, workers=args.workers, max_queue=args.max_queue, request_timeout=args.timeout)
+    else:
+        terminal_as_server(hostport, workers=args.workers, max_queue=args.max_queue, request_timeout=args.timeout)
 
 
 
@@ -0,0 +1,154 @@
+"""
+bounded memory execution of large historical requests. Decoded securities are kept in memory up to a ceiling, then
+flushed column by column to a file which is read back through memory maps, so only the securities and fields asked
+for are ever loaded.
+
+Usage:
+
+> from bbg import HistoricalDataRequest
+> from spill import SpillStore
+> store = SpillStore('c:/temp/backfill', max_memory=128 * 1024 ** 2)
+> req = HistoricalDataRequest(sids, ['px_open', 'px_last'], start='1990-01-01', spill=store).execute()
+> frame = req.response['msft us equity']
+> closes = req.response.frame('msft us equity', fields=['px_last'])
+> store.close()
+
+A store written to an explicit path can be reopened later with SpillStore(path).
+"""
+from collections import OrderedDict
+from pandas import DataFrame, DatetimeIndex
+import numpy as np
+import cPickle as pickle
+import tempfile
+import shutil
+import os
+
+
+class SpillStore(object):
+    """Mapping of security to historical frame, spilled to a columnar file once max_memory bytes are buffered.
+
+    Numeric, boolean and datetime columns are stored as raw bytes and read back through np.memmap, other columns
+    are pickled.
+
+    Parameters
+    ----------
+    path : directory of the store (a temporary directory, removed by close, if None)
+    max_memory : bytes of decoded frames buffered in memory before they are flushed to disk
+    """
+    DATA = 'columns.bin'
+    INDEX = 'index.pkl'
+
+    def __init__(self, path=None, max_memory=256 * 1024 ** 2):
+        self.temporary = path is None
+        self.path = path or tempfile.mkdtemp(prefix='bbgspill')
+        self.max_memory = max_memory
+        self.buffer = OrderedDict()
+        self.buffered = 0
+        # security -> (index column, OrderedDict of field -> column), a column is (kind, dtype, offset, size)
+        self.index = OrderedDict()
+        os.path.isdir(self.path) or os.makedirs(self.path)
+        if os.path.exists(self.filename(self.INDEX)):
+            with open(self.filename(self.INDEX), 'rb') as f:
+                self.index = pickle.load(f)
+
+    def filename(self, name):
+        return os.path.join(self.path, name)
+
+    def add(self, sid, frame):
+        """ store the frame of the security, flushing the buffer to disk once it exceeds max_memory """
+        self.discard(sid)
+        self.buffer[sid] = frame
+        self.buffered += frame.memory_usage(index=True).sum()
+        if self.buffered > self.max_memory:
+            self.flush()
+
+    def discard(self, sid):
+        frame = self.buffer.pop(sid, None)
+        if frame is not None:
+            self.buffered -= frame.memory_usage(index=True).sum()
+        self.index.pop(sid, None)
+
+    @staticmethod
+    def write_column(f, arr):
+        """ append the array to the open data file, returning its column spec """
+        offset = f.tell()
+        if arr.dtype.kind in 'biufM':
+            f.write(np.ascontiguousarray(arr).tobytes())
+            return 'raw', arr.dtype.str, offset, len(arr)
+        buf = pickle.dumps(arr, pickle.HIGHEST_PROTOCOL)
+        f.write(buf)
+        return 'pickle', None, offset, len(buf)
+
+    def flush(self):
+        """ write the buffered frames to disk """
+        if self.buffer:
+            with open(self.filename(self.DATA), 'ab') as f:
+                f.seek(0, os.SEEK_END)
+                for sid, frame in self.buffer.iteritems():
+                    icol = self.write_column(f, DatetimeIndex(frame.index).values)
+                    cols = OrderedDict((c, self.write_column(f, frame[c].values)) for c in frame.columns)
+                    self.index[sid] = (icol, cols)
+            self.buffer.clear()
+            self.buffered = 0
+        with open(self.filename(self.INDEX), 'wb') as f:
+            pickle.dump(self.index, f, pickle.HIGHEST_PROTOCOL)
+
+    def read_column(self, spec):
+        kind, dtype, offset, size = spec
+        if kind == 'raw':
+            if not size:
+                return np.empty(0, dtype=dtype)
+            return np.memmap(self.filename(self.DATA), dtype=dtype, mode='r', offset=offset, shape=(size,))
+        with open(self.filename(self.DATA), 'rb') as f:
+            f.seek(offset)
+            return pickle.loads(f.read(size))
+
+    def frame(self, sid, fields=None):
+        """ return the frame of the security with only the fields (all if None) loaded """
+        frame = self.buffer.get(sid, None)
+        if frame is not None:
+            return frame if fields is None else frame.reindex(columns=fields)
+        icol, cols = self.index[sid]
+        fields = list(cols) if fields is None else fields
+        index = DatetimeIndex(self.read_column(icol), name='date')
+        data = OrderedDict((f, self.read_column(cols[f]) if f in cols else np.full(len(index), np.nan)) for f in fields)
+        return DataFrame(data, index=index, columns=fields)
+
+    def __getitem__(self, sid):
+        return self.frame(sid)
+
+    def __contains__(self, sid):
+        return sid in self.buffer or sid in self.index
+
+    def __len__(self):
+        return len(self.index) + len(self.buffer)
+
+    def __iter__(self):
+        return self.iterkeys()
+
+    def iterkeys(self):
+        for sid in self.index:
+            yield sid
+        for sid in self.buffer:
+            yield sid
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def iteritems(self):
+        """ yield (security, frame), loading one frame at a time """
+        for sid in self.keys():
+            yield sid, self.frame(sid)
+
+    def itervalues(self):
+        for _, frame in self.iteritems():
+            yield frame
+
+    def close(self):
+        """ flush the buffered frames, or remove the store if it is temporary """
+        if self.temporary:
+            self.buffer.clear()
+            self.index.clear()
+            shutil.rmtree(self.path, ignore_errors=True)
+        else:
+            self.flush()
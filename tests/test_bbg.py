@@ -0,0 +1,560 @@
+from datetime import datetime
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bbg import Terminal, ReferenceDataRequest, HistoricalDataRequest, IntrdayBarRequest, MultiIntradayBarRequest, \
+    HistoricalBlock, PeriodResampler, RequestCoalescer, ChunkPlanner, SessionPool, SessionError, MultiOverrideRequest, \
+    IntradayTickRequest, TickBuffer, CompactRows, compact_column
+from fake import FakeTransport, SyntheticResponder
+from pandas import DataFrame, concat, date_range
+import numpy as np
+
+
+def run_with_timeout(fn, timeout=10):
+    """ return fn() run on a thread, failing if it does not complete within timeout seconds """
+    result, error = [], []
+
+    def run():
+        try:
+            result.append(fn())
+        except Exception:
+            error.append(sys.exc_info())
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    thread.join(timeout)
+    if error:
+        raise error[0][0], error[0][1], error[0][2]
+    assert result, 'did not complete within %ss' % timeout
+    return result[0]
+
+
+class FakeTerminalTest(unittest.TestCase):
+    """ executes the requests on a FakeTransport answered by the SyntheticResponder """
+    msg_size = 10
+
+    def setUp(self):
+        self.transport = FakeTransport(SyntheticResponder(msg_size=self.msg_size))
+        Terminal.configure(transport=self.transport)
+
+    def tearDown(self):
+        Terminal.pool.close()
+        Terminal.pool = None
+
+
+class SilentResponder(SyntheticResponder):
+    """ never answers requests for securities starting with SILENT_ """
+
+    def __call__(self, request, cid):
+        if any(s.startswith('SILENT_') for s in request.get('securities') or []):
+            return []
+        return SyntheticResponder.__call__(self, request, cid)
+
+
+class SessionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.transport = FakeTransport()
+        self.pool = SessionPool(self.transport, size=2)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_sessions_reused(self):
+        for sid in ('a us equity', 'b us equity'):
+            Terminal.execute_request(ReferenceDataRequest(sid, 'px_last'), pool=self.pool)
+        self.assertEqual(len(self.transport.sessions), 1)
+        self.assertEqual(self.transport.sessions[0].opened, ['//blp/refdata'])
+
+    def test_unhealthy_session_replaced(self):
+        ps = self.pool.acquire()
+        ps.session.alive = False
+        self.pool.release(ps)
+        self.assertFalse(ps.is_healthy)
+        ps = self.pool.acquire()
+        self.assertEqual(len(self.transport.sessions), 2)
+        self.assertTrue(ps.session is self.transport.sessions[1])
+        self.pool.release(ps)
+
+    def test_acquire_blocks_at_size(self):
+        held = [self.pool.acquire(), self.pool.acquire()]
+        acquired = []
+        thread = threading.Thread(target=lambda: acquired.append(self.pool.acquire()))
+        thread.daemon = True
+        thread.start()
+        thread.join(.1)
+        self.assertEqual(acquired, [])
+        self.pool.release(held[0])
+        thread.join(5)
+        self.assertTrue(acquired[0] is held[0])
+        [self.pool.release(ps) for ps in acquired + held[1:]]
+
+    def test_idle_sessions_expire(self):
+        self.pool.idle_timeout = 0
+        self.pool.release(self.pool.acquire())
+        time.sleep(.01)
+        self.assertEqual(self.pool.reap(), 1)
+        self.assertFalse(self.transport.sessions[0].started)
+
+
+class ThreadAffineTransport(FakeTransport):
+    thread_affine = True
+
+
+class ThreadAffinePoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.transport = ThreadAffineTransport()
+        self.pool = SessionPool(self.transport, size=2)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def in_thread(self, fn):
+        results = []
+        thread = threading.Thread(target=lambda: results.append(fn()))
+        thread.daemon = True
+        thread.start()
+        thread.join(5)
+        return results[0], thread
+
+    def test_idle_session_given_to_its_thread(self):
+        mine = self.pool.acquire()
+        self.pool.release(mine)
+        other, thread = self.in_thread(self.pool.acquire)
+        self.assertFalse(other is mine)
+        self.assertTrue(other.thread is thread)
+        self.assertTrue(self.pool.acquire() is mine)
+        self.pool.release(mine)
+
+    def test_session_of_other_thread_stopped_when_full(self):
+        held = self.pool.acquire()
+        self.pool.release(self.in_thread(self.pool.acquire)[0])
+        # the idle session of the exited thread is stopped rather than given to this thread
+        ps = self.pool.acquire()
+        self.assertEqual(len(self.transport.sessions), 3)
+        self.assertFalse(self.transport.sessions[1].started)
+        self.pool.release(ps)
+        # a live thread finding only the idle sessions of other threads makes room by stopping one
+        self.pool.release(held)
+        block = threading.Event()
+
+        def acquire():
+            ps = self.pool.acquire()
+            block.wait(5)
+            return ps
+        thread = threading.Thread(target=acquire)
+        thread.daemon = True
+        thread.start()
+        time.sleep(.1)
+        self.assertEqual(len(self.transport.sessions), 4)
+        self.assertEqual([s.started for s in self.transport.sessions], [True, False, False, True])
+        block.set()
+        thread.join(5)
+
+    def test_requests_from_other_threads(self):
+        Terminal.execute_request(ReferenceDataRequest('a us equity', 'px_last'), pool=self.pool)
+        req, _ = self.in_thread(lambda: run_with_timeout(lambda: Terminal.execute_request(
+            ReferenceDataRequest('b us equity', 'px_last'), pool=self.pool)))
+        self.assertEqual(list(req.response.index), ['b us equity'])
+        self.assertEqual(len(self.transport.sessions), 2)
+
+
+class RequestBatchTest(FakeTerminalTest):
+
+    def test_responses_routed_by_correlation_id(self):
+        reqs = [ReferenceDataRequest(['s%d us equity' % i, 'x us equity'], ['px_last', 'name']) for i in range(5)]
+        Terminal.execute_many(reqs, max_inflight=2)
+        for i, req in enumerate(reqs):
+            self.assertEqual(list(req.response.index), ['s%d us equity' % i, 'x us equity'])
+            self.assertEqual(req.response.name[0], 'NAME S%d' % i)
+
+    def test_session_terminated_fails_outstanding_requests(self):
+        Terminal.configure(transport=FakeTransport(SilentResponder()))
+        done, silent = ReferenceDataRequest('a us equity', 'px_last'), ReferenceDataRequest('SILENT_b', 'px_last')
+        batch = Terminal.submit_many([done, silent])
+        batch.poll(0.1)
+        self.assertFalse(batch.done)
+        Terminal.pool.transport.sessions[0].terminate()
+        self.assertRaises(SessionError, lambda: run_with_timeout(lambda: batch.wait()))
+        self.assertEqual(list(done.response.index), ['a us equity'])
+        self.assertEqual([r for r, _ in batch.errors], [silent])
+        # the pool replaces the terminated session
+        req = run_with_timeout(lambda: Terminal.execute_request(ReferenceDataRequest('c us equity', 'px_last')))
+        self.assertEqual(list(req.response.index), ['c us equity'])
+
+    def test_session_terminated_before_any_response(self):
+        Terminal.configure(transport=FakeTransport(SilentResponder()))
+        silent = ReferenceDataRequest('SILENT_b', 'px_last')
+        batch = Terminal.submit_many([silent])
+        Terminal.pool.transport.sessions[0].terminate()
+        self.assertRaises(SessionError, lambda: run_with_timeout(lambda: batch.wait()))
+        self.assertEqual([r for r, _ in batch.errors], [silent])
+        self.assertTrue(batch.done)
+
+    def test_next_wait_capped_by_deadline(self):
+        Terminal.configure(transport=FakeTransport(SilentResponder()))
+        batch = Terminal.submit_many([ReferenceDataRequest('SILENT_a', 'px_last')], timeout=60)
+        batch.poll()
+        self.assertTrue(9 < batch.next_wait(10) <= 10)
+        # a deadline already due must not sleep the full timeout
+        key, (cid, deadline) = batch.sent.items()[0]
+        batch.sent[key] = (cid, time.time() - 1)
+        self.assertEqual(batch.next_wait(10), 0)
+        batch.sent.clear()
+        self.assertEqual(batch.next_wait(10), 10)
+        batch.close(discard=True)
+
+
+class ExecuteIterTest(FakeTerminalTest):
+
+    def test_chunks(self):
+        sids = ['s%d us equity' % i for i in range(25)]
+        chunks = list(ReferenceDataRequest(sids, ['px_last']).execute_iter())
+        self.assertEqual([len(c) for c in chunks], [10, 10, 5])
+
+    def test_abandoned_generator_releases_session(self):
+        sids = ['s%d us equity' % i for i in range(25)]
+        gen = ReferenceDataRequest(sids, ['px_last']).execute_iter()
+        next(gen)
+        gen.close()
+        req = run_with_timeout(lambda: Terminal.execute_request(ReferenceDataRequest('msft us equity', 'px_last')))
+        self.assertEqual(list(req.response.index), ['msft us equity'])
+
+    def test_bulk_long_frames_streamed_last(self):
+        sids = ['s%d us equity' % i for i in range(25)]
+        chunks = list(ReferenceDataRequest(sids, ['px_last', 'bulk_dvd'], bulk='long').execute_iter())
+        self.assertEqual([len(c) for c in chunks[:3]], [10, 10, 5])
+        self.assertEqual([c[0] for c in chunks[3:]], ['bulk_dvd'])
+        expected = ReferenceDataRequest(sids, ['px_last', 'bulk_dvd'], bulk='long').execute()
+        self.assertEqual(list(chunks[3][1].index), list(expected.bulk_response['bulk_dvd'].index))
+
+
+class HistoricalDataRequestTest(FakeTerminalTest):
+
+    def sent(self):
+        return self.transport.sessions[0].sent[-1]
+
+    def test_calendar_periods_requested_when_derived(self):
+        kwargs = dict(start='2020-01-01', end='2020-03-31')
+        HistoricalDataRequest('a us equity', 'px_last', period='WEEKLY', derive=1, **kwargs).execute()
+        self.assertEqual((self.sent().get('periodicitySelection'), self.sent().get('periodicityAdjustment')),
+                         ('DAILY', 'CALENDAR'))
+        # the periods the terminal returns keep its default adjustment
+        HistoricalDataRequest('a us equity', 'px_last', period='WEEKLY', **kwargs).execute()
+        self.assertEqual((self.sent().get('periodicitySelection'), self.sent().get('periodicityAdjustment')),
+                         ('WEEKLY', None))
+        HistoricalDataRequest('a us equity', 'px_last', **kwargs).execute()
+        self.assertEqual((self.sent().get('periodicitySelection'), self.sent().get('periodicityAdjustment')),
+                         ('DAILY', None))
+
+    def test_response_as_single(self):
+        req = HistoricalDataRequest(['b us equity', 'a us equity'], ['px_open', 'px_last'], start='2020-01-01',
+                                    end='2020-01-31').execute()
+        single = req.response_as_single()
+        self.assertEqual(list(single.columns.levels[1]), ['a us equity', 'b us equity'])
+        self.assertEqual(list(single[('px_last', 'b us equity')]), list(req.response['b us equity'].px_last))
+        self.assertEqual(len(req.response_as_long()), 2 * 23)
+
+    def test_derived_period(self):
+        req = HistoricalDataRequest(['a us equity'], ['px_open', 'px_last'], start='2020-01-01', end='2020-01-15',
+                                    period='WEEKLY', derive=1).execute()
+        self.assertEqual(self.sent().get('periodicitySelection'), 'DAILY')
+        frame = req.response['a us equity']
+        self.assertEqual([d.strftime('%Y-%m-%d') for d in frame.index], ['2020-01-03', '2020-01-10', '2020-01-15'])
+        daily = HistoricalDataRequest(['a us equity'], ['px_open', 'px_last'], start='2020-01-01',
+                                      end='2020-01-15').execute().response['a us equity']
+        # the week of 2020-01-06 to 2020-01-10
+        self.assertEqual(frame.px_open[1], daily.px_open[3])
+        self.assertEqual(frame.px_last[1], daily.px_last[7])
+
+
+class ChunkPlannerTest(FakeTerminalTest):
+
+    def test_chunks_merged_in_order(self):
+        sids = ['s%d us equity' % i for i in range(7)] + ['BAD_x', 's0 us equity']
+        fields = ['px_last', 'name', 'px_open']
+        planner = ChunkPlanner(max_securities=3, max_fields=2)
+        self.assertEqual(len(planner.plan(ReferenceDataRequest(sids, fields))), 6)
+        req = planner.execute(ReferenceDataRequest(sids, fields, ignore_security_error=1))
+        # repeated symbols are requested once
+        expected = ReferenceDataRequest(sids[:-1], fields, ignore_security_error=1).execute()
+        self.assertEqual(list(req.response.columns), fields)
+        self.assertTrue(req.response.equals(expected.response))
+        self.assertEqual([e.security for e in req.security_errors], ['BAD_x'])
+
+    def test_no_symbols_or_fields(self):
+        planner = ChunkPlanner()
+        for kwargs in ({}, {'response_type': 'map'}, {'compact': 1}):
+            self.assertEqual(len(planner.execute(ReferenceDataRequest([], ['px_last'], **kwargs)).response), 0)
+            self.assertEqual(len(planner.execute(ReferenceDataRequest(['a us equity'], [], **kwargs)).response), 0)
+        self.assertEqual(planner.execute(HistoricalDataRequest([], ['px_last'])).response, {})
+        self.assertEqual(self.transport.sessions, [])
+
+
+class CompactReferenceDataTest(FakeTerminalTest):
+    msg_size = 3
+    sids = ['s%d us equity' % i for i in range(8)]
+    fields = ['px_last', 'name', 'int_volume', 'dt_listed', 'cat_sector']
+
+    def test_typed_columns(self):
+        frame = ReferenceDataRequest(self.sids, self.fields, compact=1).execute().response
+        expected = ReferenceDataRequest(self.sids, self.fields).execute().response
+        self.assertEqual([str(t) for t in frame.dtypes], ['float64', 'category', 'int64', 'datetime64[ns]', 'category'])
+        self.assertEqual(list(frame.index), self.sids)
+        self.assertEqual(frame.index.name, 'security')
+        for f in ('px_last', 'name', 'int_volume', 'cat_sector'):
+            self.assertEqual(list(frame[f]), list(expected[f]))
+        self.assertEqual(list(frame.dt_listed.dt.date), list(expected.dt_listed))
+
+    def test_map_response(self):
+        rows = ReferenceDataRequest(self.sids, self.fields, response_type='map', compact=1).execute().response
+        expected = ReferenceDataRequest(self.sids, self.fields, response_type='map').execute().response
+        self.assertTrue(isinstance(rows, CompactRows))
+        self.assertEqual(rows.keys(), self.sids)
+        self.assertEqual(len(rows), len(expected))
+        self.assertTrue('s0 us equity' in rows and rows.get('x') is None)
+        for sid, row in rows.iteritems():
+            # dt_listed is a numpy datetime64 in the compact row
+            self.assertEqual(row[:3] + row[4:], expected[sid][:3] + expected[sid][4:])
+
+    def test_streamed_chunks(self):
+        req = ReferenceDataRequest(self.sids, self.fields, compact=1)
+        chunks = list(req.execute_iter())
+        self.assertEqual([len(c) for c in chunks], [3, 3, 2])
+        frame = ReferenceDataRequest.compact_concat(chunks)
+        self.assertEqual(str(frame.cat_sector.dtype), 'category')
+        self.assertTrue(frame.equals(ReferenceDataRequest(self.sids, self.fields, compact=1).execute().response))
+
+    def test_compact_column(self):
+        self.assertEqual(compact_column([1, 2, 3], 5).dtype, np.int64)
+        self.assertEqual(compact_column([1, None, 3], 5).dtype, np.float64)
+        self.assertEqual(compact_column([True, False], 1).dtype, np.bool_)
+        self.assertEqual(list(compact_column(['a', 'b', 'a']).categories), ['a', 'b'])
+        self.assertEqual(compact_column([DataFrame(), 'a']).dtype, object)
+        # values not matching the datatype are kept as objects
+        self.assertEqual(compact_column(['a', 1.5], 7).dtype, object)
+
+
+class MultiOverrideRequestTest(FakeTerminalTest):
+
+    def test_frame_indexed_by_override_map(self):
+        sids, fields = ['a us equity', 'BAD_x', 'b us equity'], ['px_last', 'name']
+        overrides = [{'SETTLE_DT': '20200102'}, {'SETTLE_DT': '20200103'}, {'SETTLE_DT': '20200102'}]
+        req = MultiOverrideRequest(sids, fields, overrides, keys=['t1', 't2', 't1b'], max_inflight=1,
+                                   ignore_security_error=1).execute()
+        # identical override maps share a request
+        self.assertEqual(len(self.transport.sessions), 1)
+        self.assertEqual(len(self.transport.sessions[0].sent), 2)
+        self.assertEqual(list(req.response.columns), fields)
+        self.assertEqual(req.response.index.names, ['overrides', 'security'])
+        self.assertEqual(list(req.response.index), [(k, s) for k in ('t1', 't2', 't1b') for s in sids[::2]])
+        self.assertEqual([e.security for e in req.security_errors], ['BAD_x'])
+        for key, omap in zip(['t1', 't2'], overrides):
+            expected = ReferenceDataRequest(sids[::2], fields, overrides=omap).execute().response
+            self.assertEqual(req.response.loc[key].values.tolist(), expected.values.tolist())
+        self.assertTrue(req.response.loc['t1'].equals(req.response.loc['t1b']))
+        self.assertNotEqual(req.response.loc['t1'].px_last.tolist(), req.response.loc['t2'].px_last.tolist())
+
+    def test_security_error_raised(self):
+        req = MultiOverrideRequest(['a us equity', 'BAD_x'], 'px_last', [{'SETTLE_DT': '20200102'}, None])
+        self.assertRaises(Exception, req.execute)
+
+    def test_execute_iter(self):
+        req = MultiOverrideRequest(['a us equity'], ['px_last'], [{'SETTLE_DT': '20200102'}, {}])
+        chunks = list(req.execute_iter())
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual(list(chunks[0].index), [(0, 'a us equity'), (1, 'a us equity')])
+
+
+class RequestCoalescerTest(FakeTerminalTest):
+
+    def setUp(self):
+        FakeTerminalTest.setUp(self)
+        self.coalescer = RequestCoalescer(window=.2)
+
+    def test_concurrent_requests_share_one_request(self):
+        reqs = [ReferenceDataRequest(['a us equity', 's%d us equity' % i], ['px_last']) for i in range(3)]
+        threads = [threading.Thread(target=self.coalescer.execute, args=(r,)) for r in reqs]
+        [t.start() for t in threads]
+        [t.join(10) for t in threads]
+        self.assertEqual((self.coalescer.requests, self.coalescer.sent), (3, 1))
+        self.assertEqual(len(self.transport.sessions[0].sent), 1)
+        for i, req in enumerate(reqs):
+            self.assertEqual(list(req.response.index), ['a us equity', 's%d us equity' % i])
+
+    def test_unserializable_request_sent_alone(self):
+        req = ReferenceDataRequest(['a us equity'], ['px_last'], overrides={'SETTLE_DT': datetime(2020, 1, 2)})
+        self.assertEqual(req.coalesce_key(), None)
+        req = ReferenceDataRequest(['a us equity'], ['px_last'], overrides={'PX_SCALE': np.float32(1.)})
+        self.coalescer.execute(req)
+        self.assertEqual(list(req.response.index), ['a us equity'])
+        self.assertEqual(self.coalescer.sent, 1)
+
+    def test_streamed_and_instrumented_requests_sent_alone(self):
+        chunks = []
+        streamed = ReferenceDataRequest(['a us equity', 'b us equity'], ['px_last']).stream(chunks.append)
+        self.coalescer.execute(streamed)
+        self.assertEqual([len(c) for c in chunks], [2])
+        instrumented = ReferenceDataRequest(['a us equity', 'b us equity'], ['px_last']).instrument()
+        self.coalescer.execute(instrumented)
+        self.assertEqual(instrumented.metrics.counts['messages'], 1)
+        self.assertEqual(self.coalescer.sent, 2)
+
+
+class HistoricalBlockTest(unittest.TestCase):
+
+    def setUp(self):
+        dates = date_range('2020-01-01', periods=5, name='date')
+        self.frames = {'b': DataFrame({'px': np.arange(5.), 'vol': np.arange(5.) * 10}, index=dates,
+                                      columns=['px', 'vol']),
+                       'a': DataFrame({'vol': [7.], 'px': [1.]}, index=dates[2:3] + np.timedelta64(5, 'D'),
+                                      columns=['vol', 'px'])}
+
+    def test_wide_matches_unstack(self):
+        wide = HistoricalBlock.from_frames(self.frames, ['px', 'vol']).wide()
+        expected = concat([f.assign(security=sid).reset_index().set_index(['date', 'security'])
+                           for sid, f in self.frames.iteritems()]).unstack()[['px', 'vol']]
+        self.assertEqual(list(wide.columns), list(expected.columns))
+        self.assertEqual(list(wide.index), list(expected.index))
+        np.testing.assert_array_equal(wide.values, expected.values)
+
+    def test_long(self):
+        frame = HistoricalBlock.from_frames(self.frames, ['px', 'vol']).long()
+        self.assertEqual(list(frame.columns), ['date', 'security', 'px', 'vol'])
+        self.assertEqual(len(frame), 6)
+        last = frame.iloc[-1]
+        self.assertEqual((last.date.strftime('%Y-%m-%d'), last.security, last.px, last.vol), ('2020-01-08', 'a', 1., 7.))
+
+    def test_object_fields(self):
+        frames = {'a': DataFrame({'name': ['x', 'y']}, index=date_range('2020-01-01', periods=2))}
+        block = HistoricalBlock.from_frames(frames, ['name', 'px'])
+        self.assertEqual(block.values.dtype, object)
+        self.assertEqual(list(block.wide()[('name', 'a')]), ['x', 'y'])
+        self.assertTrue(block.wide()[('px', 'a')].isnull().all())
+
+
+class IntradayBarTest(FakeTerminalTest):
+    start = datetime(2020, 1, 2, 9, 30)
+    end = datetime(2020, 1, 3, 5, 30)
+
+    def test_typed_bars(self):
+        # 1200 bars in 3 messages, more than the initial capacity of the buffer
+        frame = IntrdayBarRequest('a us equity', 1, self.start, self.end).execute().response
+        self.assertEqual(len(frame), 1200)
+        self.assertEqual(list(frame.columns), ['open', 'high', 'low', 'close', 'volume', 'events'])
+        self.assertEqual([str(t) for t in frame.dtypes], ['float64'] * 4 + ['int64'] * 2)
+        self.assertEqual(frame.index[0], self.start)
+        self.assertTrue((np.diff(frame.index.values) == np.timedelta64(60, 's')).all())
+        self.assertTrue(np.allclose(frame.high - frame.low, 2.))
+
+    def test_unbuffered_chunks_own_their_data(self):
+        chunks = list(IntrdayBarRequest('a us equity', 1, self.start, self.end).execute_iter())
+        self.assertEqual([len(c) for c in chunks], [500, 500, 200])
+        self.assertEqual(chunks[0].index[-1], datetime(2020, 1, 2, 17, 49))
+        self.assertEqual(chunks[1].index[0], datetime(2020, 1, 2, 17, 50))
+
+    def test_multi_security_long_frame(self):
+        frame = MultiIntradayBarRequest(['a us equity', 'c us equity'], 60, self.start, self.end).execute().response
+        self.assertEqual(list(frame.columns[:2]), ['security', 'time'])
+        self.assertEqual(list(frame.security.unique()), ['a us equity', 'c us equity'])
+        self.assertEqual(len(frame), 40)
+
+
+class IntradayTickTest(FakeTerminalTest):
+    start = datetime(2020, 1, 2, 9, 30)
+    end = datetime(2020, 1, 2, 10, 0)
+
+    def test_typed_ticks(self):
+        # 60 ticks per minute and event type, 3600 ticks in 4 messages
+        req = IntradayTickRequest('a us equity', self.start, self.end, events=['TRADE', 'BID'], conditions=1,
+                                  exchange=1).execute()
+        frame = req.response
+        self.assertEqual(len(frame), 3600)
+        self.assertEqual(list(frame.columns), ['type', 'value', 'size', 'conditions', 'exchange'])
+        self.assertEqual([str(t) for t in frame.dtypes], ['category', 'float64', 'float64', 'category', 'category'])
+        self.assertEqual(list(frame.type.cat.categories), ['TRADE', 'BID'])
+        self.assertTrue(set(frame.exchange.unique()) <= set(SyntheticResponder.EXCHANGES))
+        self.assertTrue('' in set(frame.conditions.unique()))
+        self.assertEqual(frame.index[0], self.start)
+        self.assertEqual(frame.index[-1], datetime(2020, 1, 2, 9, 59, 59))
+
+    def test_without_codes(self):
+        frame = IntradayTickRequest('a us equity', self.start, self.end).execute().response
+        self.assertEqual(len(frame), 1800)
+        self.assertEqual(list(frame.conditions.unique()), [''])
+        self.assertEqual(list(frame.exchange.unique()), [''])
+
+    def test_unbuffered_chunks_own_their_data(self):
+        req = IntradayTickRequest('a us equity', self.start, self.end, exchange=1)
+        chunks = list(req.execute_iter())
+        self.assertEqual([len(c) for c in chunks], [1000, 800])
+        expected = IntradayTickRequest('a us equity', self.start, self.end, exchange=1).execute().response
+        self.assertTrue(concat(chunks).equals(expected))
+
+    def test_pages(self):
+        req = IntradayTickRequest('a us equity', self.start, self.end, events=['TRADE', 'ASK'], exchange=1, page=7,
+                                  max_inflight=2)
+        self.assertEqual([(p.start.minute, p.end.minute) for p in req.parts],
+                         [(30, 37), (37, 44), (44, 51), (51, 58), (58, 0)])
+        frame = req.execute().response
+        expected = IntradayTickRequest('a us equity', self.start, self.end, events=['TRADE', 'ASK'],
+                                       exchange=1).execute().response
+        # the pages are sent on one session and cover the window without overlap
+        self.assertEqual(len(self.transport.sessions[0].sent), 6)
+        self.assertTrue(frame.index.equals(expected.index))
+        self.assertEqual(list(frame.type), list(expected.type))
+        self.assertEqual(list(frame.type.cat.categories), ['TRADE', 'ASK'])
+        self.assertTrue(frame.index.is_monotonic_increasing)
+        # the chunks of a paged request are the frame of all the pages
+        req = IntradayTickRequest('a us equity', self.start, self.end, events=['TRADE', 'ASK'], exchange=1, page=7)
+        self.assertTrue(concat(list(req.execute_iter())).equals(frame))
+
+    def test_merge_remaps_codes(self):
+        a, b = TickBuffer(capacity=1), TickBuffer(capacity=1)
+        for buf, types in ((a, ['TRADE', 'BID']), (b, ['BID', 'ASK', 'TRADE'])):
+            buf.reserve(len(types))
+            for t in types:
+                buf.times[buf.size], buf.values[buf.size] = buf.size, (1., 100.)
+                buf.codes[buf.size] = (buf.code(0, t), buf.code(1, ''), buf.code(2, ''))
+                buf.size += 1
+        merged = TickBuffer.merge([a, b])
+        self.assertEqual(list(merged.frame().type), ['TRADE', 'BID', 'BID', 'ASK', 'TRADE'])
+        self.assertEqual(merged.categories[0], ['TRADE', 'BID', 'ASK'])
+
+
+class PeriodResamplerTest(unittest.TestCase):
+
+    def test_monthly_aggregations(self):
+        dates = date_range('2020-01-01', '2020-03-10', freq='B')
+        daily = DataFrame({'px_high': np.arange(len(dates), dtype=float), 'px_volume': 1.,
+                           'px_last': np.arange(len(dates), dtype=float)}, index=dates)
+        daily.px_last[-1] = np.nan
+        frame = PeriodResampler('MONTHLY').resample(daily)
+        # periods are labeled with their last trading date (2020-02-29 is a Saturday)
+        self.assertEqual([d.strftime('%Y-%m-%d') for d in frame.index], ['2020-01-31', '2020-02-28', '2020-03-10'])
+        self.assertEqual(list(frame.px_volume), [23., 20., 7.])
+        self.assertEqual(list(frame.px_high), [22., 42., 49.])
+        # the last non missing value
+        self.assertEqual(frame.px_last[-1], 48.)
+
+    def test_periods_without_data(self):
+        dates = date_range('2020-01-01', '2020-03-31', freq='B')
+        daily = DataFrame({'px_last': np.arange(len(dates), dtype=float)}, index=dates)
+        # no data in February and after 2020-03-25
+        daily.px_last[(dates.month == 2) | (dates > '2020-03-25')] = np.nan
+        frame = PeriodResampler('MONTHLY').resample(daily)
+        self.assertEqual([d.strftime('%Y-%m-%d') for d in frame.index], ['2020-01-31', '2020-03-25'])
+        quarter = PeriodResampler('QUARTERLY').resample(daily)
+        self.assertEqual([d.strftime('%Y-%m-%d') for d in quarter.index], ['2020-03-25'])
+        self.assertEqual(quarter.px_last[0], daily.px_last['2020-03-25'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,24 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bbg import ReferenceDataRequest
+from fake import FakeTransport
+import bench
+
+
+class PipelineTest(unittest.TestCase):
+
+    def test_run_pipeline(self):
+        request = ReferenceDataRequest(['s%d us equity' % i for i in range(20)], ['px_last', 'name'])
+        latencies, cells, rss = bench.run_pipeline(FakeTransport(), request, 3)
+        self.assertEqual(len(latencies), 3)
+        self.assertEqual(latencies, sorted(latencies))
+        self.assertEqual(cells, 40)
+        self.assertTrue(rss is None or rss >= 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
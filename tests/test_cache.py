@@ -0,0 +1,103 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bbg import Terminal, ReferenceDataRequest, HistoricalDataRequest
+from cache import MemoryCache, DiskCache
+from fake import FakeTransport, SyntheticResponder
+
+
+class CacheTest(unittest.TestCase):
+    """ executes the requests on a FakeTransport answered by the SyntheticResponder """
+
+    def setUp(self):
+        self.transport = FakeTransport(SyntheticResponder())
+        Terminal.configure(transport=self.transport)
+
+    def tearDown(self):
+        Terminal.pool.close()
+        Terminal.pool = None
+
+    def requests_sent(self):
+        return sum(len(s.sent) for s in self.transport.sessions)
+
+
+class MemoryCacheTest(CacheTest):
+
+    def test_only_missing_cells_requested(self):
+        cache = MemoryCache()
+        cache.execute(ReferenceDataRequest(['a us equity', 'b us equity'], ['px_last']))
+        req = cache.execute(ReferenceDataRequest(['b us equity', 'c us equity', 'a us equity'], ['px_last', 'name']))
+        self.assertEqual(list(req.response.index), ['b us equity', 'c us equity', 'a us equity'])
+        self.assertEqual(list(req.response.name), ['NAME B', 'NAME C', 'NAME A'])
+        self.assertEqual((cache.stats.hits, cache.stats.misses), (2, 6))
+        # one request per distinct set of missing fields
+        self.assertEqual([r.get('fields') for r in self.transport.sessions[0].sent][1:],
+                         [['name'], ['px_last', 'name']])
+
+    def test_evictions_counted_by_concurrent_requests(self):
+        # room for 10 float cells
+        cache = MemoryCache(max_bytes=320)
+        reqs = [ReferenceDataRequest(['s%d_%d us equity' % (t, i) for i in range(10)], ['px_last', 'px_open'])
+                for t in range(4)]
+        threads = [threading.Thread(target=cache.execute, args=(r,)) for r in reqs]
+        [t.start() for t in threads]
+        [t.join(10) for t in threads]
+        self.assertEqual(len(cache.store), 10)
+        self.assertEqual(cache.store.evictions, 70)
+        self.assertEqual(cache.stats.evictions, 70)
+
+    def test_bulk_long_not_cached(self):
+        cache = MemoryCache()
+        sids = ['a us equity', 'b us equity', 'c us equity']
+        expected = ReferenceDataRequest(sids, ['px_last', 'bulk_dvd'], bulk='long').execute()
+        for i in range(2):
+            req = cache.execute(ReferenceDataRequest(sids, ['px_last', 'bulk_dvd'], bulk='long'))
+            self.assertEqual(sorted(req.bulk_response), ['bulk_dvd'])
+            self.assertEqual(list(req.bulk_response['bulk_dvd'].index), list(expected.bulk_response['bulk_dvd'].index))
+        self.assertEqual(self.requests_sent(), 3)
+        self.assertEqual(len(cache.store), 0)
+
+
+class DiskCacheTest(CacheTest):
+
+    def setUp(self):
+        CacheTest.setUp(self)
+        self.root = tempfile.mkdtemp()
+        self.cache = DiskCache(self.root)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.root, ignore_errors=True)
+        CacheTest.tearDown(self)
+
+    def historical(self, fields):
+        return HistoricalDataRequest(['a us equity', 'b us equity'], fields, start='2020-01-01', end='2020-01-31',
+                                     ignore_field_error=1)
+
+    def test_historical_hits(self):
+        first = self.cache.execute(self.historical(['px_last']))
+        second = self.cache.execute(self.historical(['px_last']))
+        self.assertEqual(self.requests_sent(), 1)
+        self.assertEqual((self.cache.stats.hits, self.cache.stats.misses), (2, 2))
+        self.assertTrue(second.response['a us equity'].equals(first.response['a us equity']))
+
+    def test_historical_field_errors_not_cached(self):
+        req = self.cache.execute(self.historical(['px_last', 'bad_fld']))
+        self.assertEqual(sorted(set(e.field for e in req.field_errors)), ['bad_fld'])
+        req = self.historical(['px_last', 'bad_fld'])
+        self.assertEqual(self.cache.history.coverage(self.cache.history_key(req, 'a us equity', 'bad_fld')), None)
+        self.cache.execute(req)
+        # only the failed cells are requested again
+        self.assertEqual(self.requests_sent(), 2)
+        self.assertEqual(self.transport.sessions[0].sent[-1].get('fields'), ['bad_fld'])
+        self.assertEqual(len(req.field_errors), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+from datetime import date
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bbg import Terminal, HistoricalDataRequest, RowDecoder, ColumnDecoder, BulkBuffer, XmlHelper
+from fake import FakeElement, FakeTransport, SEQUENCE
+import numpy as np
+import bench
+
+
+def row(*items):
+    return FakeElement('fieldData', list(items))
+
+
+class RowDecoderTest(unittest.TestCase):
+
+    def test_values_in_field_order(self):
+        decoder = RowDecoder(['px_last', 'name'])
+        self.assertEqual(decoder.values(row(('name', 'MSFT'), ('px_last', 1.5))), [1.5, 'MSFT'])
+        self.assertEqual(decoder.values(row(('name', 'INTC'), ('px_last', 2.5))), [2.5, 'INTC'])
+
+    def test_missing_field_is_nan(self):
+        decoder = RowDecoder(['date', 'px_open', 'px_last'])
+        decoder.values(row(('date', 1), ('px_open', 1.), ('px_last', 2.)))
+        vals = decoder.values(row(('date', 2), ('px_last', 3.)))
+        self.assertEqual(vals[::2], [2, 3.])
+        self.assertTrue(vals[1] != vals[1])
+
+    def test_same_size_row_with_other_elements(self):
+        # relativeDate in place of the missing px_open must not shift the values into the wrong columns
+        decoder = RowDecoder(['date', 'px_open', 'px_last'])
+        decoder.values(row(('date', 1), ('px_open', 1.), ('px_last', 2.)))
+        vals = decoder.values(row(('date', 2), ('relativeDate', '-1D'), ('px_last', 3.)))
+        self.assertEqual([vals[0], vals[2]], [2, 3.])
+        self.assertTrue(vals[1] != vals[1])
+        # the layout still applies to complete rows
+        self.assertEqual(decoder.values(row(('date', 3), ('px_open', 4.), ('px_last', 5.))), [3, 4., 5.])
+
+    def test_duplicate_fields(self):
+        decoder = RowDecoder(['px_last', 'px_last', 'name'])
+        for i in range(2):
+            self.assertEqual(decoder.values(row(('px_last', 1.5), ('name', 'A'))), [1.5, 1.5, 'A'])
+
+    def test_case_insensitive_names(self):
+        decoder = RowDecoder(['px_last'])
+        self.assertEqual(decoder.values(row(('PX_LAST', 1.5))), [1.5])
+
+    def test_field_seen_late_or_never(self):
+        decoder = RowDecoder(['date', 'px_last', 'name', 'px_open'])
+        self.assertEqual(decoder.values(row(('date', 1), ('px_last', 1.)))[:2], [1, 1.])
+        vals = decoder.values(row(('date', 2), ('px_last', 2.), ('name', 'A')))
+        self.assertEqual(vals[:3], [2, 2., 'A'])
+        self.assertTrue(np.isnan(vals[3]))
+        self.assertEqual(decoder.datatypes[:3], [5, 7, 8])
+
+    def test_datatype_change_on_complete_rows(self):
+        decoder = RowDecoder(['date', 'px_last'])
+        self.assertEqual(decoder.values(row(('date', date(2020, 1, 2)), ('px_last', 1.))), [date(2020, 1, 2), 1.])
+        self.assertEqual(decoder.values(row(('date', 'N.A.'), ('px_last', 2.))), ['N.A.', 2.])
+
+    def test_element_calls(self):
+        fields = ['date'] + ['fld%d' % i for i in range(10)]
+        # GetElement and Value per cell for complete rows, against HasElement, GetElement, Datatype and Value
+        for missing, limit in ((0, 2.2), (.1, 3.)):
+            farr = bench.historical_node('x', fields[1:], 100, bench.CountingElement, missing).GetElement('fieldData')
+            rows = [farr.GetValue(i) for i in range(100)]
+            decoder = RowDecoder(fields)
+            calls = bench.com_calls(lambda: [decoder.values(r) for r in rows])
+            self.assertTrue(calls < limit * 100 * len(fields), (missing, calls))
+
+    def test_matches_generic_decoding(self):
+        fields = ['px_last', 'name', 'volume']
+        rows = [row(('px_last', float(i)), ('name', 'N%d' % i), ('volume', i)) for i in range(5)]
+        decoder = RowDecoder(fields)
+        self.assertEqual([decoder.values(r) for r in rows], [XmlHelper.get_child_values(r, fields) for r in rows])
+
+
+class ColumnDecoderTest(unittest.TestCase):
+
+    def test_typed_columns(self):
+        rows = [[('date', date(2020, 1, d)), ('px_last', float(d)), ('volume', d * 100), ('name', 'N%d' % d)]
+                for d in range(1, 6)]
+        del rows[2][1]
+        frame = ColumnDecoder(['date', 'px_last', 'volume', 'name', 'px_open']).frame(
+            FakeElement.array('fieldData', rows, datatype=SEQUENCE))
+        self.assertEqual(frame.index.name, 'date')
+        self.assertEqual(str(frame.index.dtype), 'datetime64[ns]')
+        self.assertEqual(frame.index[-1].strftime('%Y-%m-%d'), '2020-01-05')
+        self.assertEqual([str(frame[c].dtype) for c in frame.columns], ['float64', 'int64', 'object', 'float64'])
+        self.assertEqual(list(frame.volume), [100, 200, 300, 400, 500])
+        self.assertTrue(np.isnan(frame.px_last[2]) and frame.px_last[3] == 4.)
+        self.assertTrue(frame.px_open.isnull().all())
+
+    def test_value_of_another_datatype(self):
+        rows = [[('date', date(2020, 1, d)), ('px_last', float(d)), ('dt', date(2019, 1, d)), ('name', 'N%d' % d)]
+                for d in range(1, 5)]
+        rows[2][1:] = [('px_last', 'N.A.'), ('dt', 'N.A.'), ('name', 7.5)]
+        del rows[0][1]
+        decoder = ColumnDecoder(['date', 'px_last', 'dt', 'name'])
+        frame = decoder.frame(FakeElement.array('fieldData', rows, datatype=SEQUENCE))
+        self.assertEqual([str(frame[c].dtype) for c in frame.columns], ['object'] * 3)
+        self.assertTrue(np.isnan(frame.px_last[0]))
+        self.assertEqual(list(frame.px_last[1:]), [2., 'N.A.', 4.])
+        self.assertEqual([str(v)[:10] for v in frame.dt], ['2019-01-01', '2019-01-02', 'N.A.', '2019-01-04'])
+        self.assertEqual(list(frame.name), ['N1', 'N2', 7.5, 'N4'])
+        # the columns of the next call are typed again
+        rows = [[('date', date(2020, 2, d)), ('px_last', float(d)), ('dt', date(2019, 2, d)), ('name', 'M%d' % d)]
+                for d in range(1, 3)]
+        frame = decoder.frame(FakeElement.array('fieldData', rows, datatype=SEQUENCE))
+        self.assertEqual([str(frame[c].dtype) for c in frame.columns], ['float64', 'datetime64[ns]', 'object'])
+
+    def test_matches_row_decoding(self):
+        Terminal.configure(transport=FakeTransport())
+        try:
+            kwargs = dict(start='2020-01-01', end='2020-03-31')
+            rows = HistoricalDataRequest(['a us equity', 'b us equity'], ['px_last', 'int_volume'], **kwargs).execute()
+            cols = HistoricalDataRequest(['a us equity', 'b us equity'], ['px_last', 'int_volume'], columnar=1,
+                                         **kwargs).execute()
+        finally:
+            Terminal.pool.close()
+            Terminal.pool = None
+        for sid in ('a us equity', 'b us equity'):
+            expected, frame = rows.response[sid], cols.response[sid]
+            self.assertEqual(list(frame.index.date), list(expected.index))
+            self.assertEqual(list(frame.px_last), list(expected.px_last))
+            self.assertEqual(list(frame.int_volume), list(expected.int_volume))
+            self.assertEqual(frame.int_volume.dtype, np.int64)
+
+
+
+class BulkBufferTest(unittest.TestCase):
+
+    def bulk(self, rows):
+        return FakeElement.array('bulk_dvd', rows, datatype=SEQUENCE)
+
+    def test_mixed_datatypes_across_securities(self):
+        buf = BulkBuffer()
+        buf.add('a', 'bulk_dvd', self.bulk([[('Ex-Date', date(2020, 1, 2)), ('Amount', 1.5)],
+                                            [('Ex-Date', date(2020, 4, 2)), ('Amount', 2.5)]]))
+        buf.add('b', 'bulk_dvd', self.bulk([[('Ex-Date', 'TBA'), ('Amount', 'N.A.')]]))
+        buf.add('c', 'bulk_dvd', self.bulk([[('Amount', 3.5)]]))
+        frame = buf.frame('bulk_dvd')
+        self.assertEqual(list(frame.index), [('a', 0), ('a', 1), ('b', 0), ('c', 0)])
+        self.assertEqual(list(frame.Amount), [1.5, 2.5, 'N.A.', 3.5])
+        self.assertEqual([str(v)[:10] for v in frame['Ex-Date']], ['2020-01-02', '2020-04-02', 'TBA', 'NaT'])
+
+    def test_typed_columns(self):
+        buf = BulkBuffer()
+        buf.add('a', 'bulk_dvd', self.bulk([[('Ex-Date', date(2020, 1, 2)), ('Amount', 1.5)]]))
+        buf.add('c', 'bulk_dvd', self.bulk([[('Amount', 3.5)]]))
+        frame = buf.frame('bulk_dvd')
+        self.assertEqual([str(frame[c].dtype) for c in frame.columns], ['datetime64[ns]', 'float64'])
+        self.assertTrue(frame['Ex-Date'].isnull()[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
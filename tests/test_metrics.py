@@ -0,0 +1,58 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bbg import Terminal, ReferenceDataRequest, HistoricalDataRequest, RequestMetrics
+from fake import FakeTransport, SyntheticResponder
+from metrics import HistogramSink, StatsdSink
+
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        Terminal.configure(transport=FakeTransport(SyntheticResponder(msg_size=10)))
+
+    def tearDown(self):
+        Terminal.set_metrics_sink(None)
+        Terminal.pool.close()
+        Terminal.pool = None
+
+    def test_instrumented_request(self):
+        sids = ['s%d us equity' % i for i in range(25)]
+        req = ReferenceDataRequest(sids, ['px_last', 'name']).instrument().execute()
+        metrics = req.metrics
+        self.assertEqual((metrics.counts['events'], metrics.counts['partials'], metrics.counts['messages']), (3, 2, 3))
+        self.assertEqual(metrics.counts['cells'], 50)
+        self.assertFalse(metrics.failed)
+        for phase in ('session', 'build', 'send', 'first_message', 'server', 'decode'):
+            self.assertTrue(metrics.timings[phase] >= 0, phase)
+        self.assertTrue(metrics.timings['server'] >= metrics.timings['first_message'])
+        # not instrumented by default
+        self.assertEqual(ReferenceDataRequest('a us equity', 'px_last').execute().metrics, None)
+
+    def test_sink_records_every_request(self):
+        sink = HistogramSink()
+        Terminal.set_metrics_sink(sink)
+        ReferenceDataRequest(['a us equity', 'b us equity'], ['px_last']).execute()
+        HistoricalDataRequest('a us equity', 'px_last', start='2020-01-01', end='2020-01-31').execute()
+        self.assertRaises(Exception, ReferenceDataRequest('BAD_a', 'px_last').execute)
+        summary = sink.summary()
+        self.assertEqual(summary.loc[('ReferenceDataRequest', 'cells'), 'count'], 2)
+        self.assertEqual(summary.loc[('ReferenceDataRequest', 'cells'), 'max'], 2)
+        self.assertEqual(summary.loc[('HistoricalDataRequest', 'cells'), 'max'], 23 * 2)
+        self.assertEqual(dict(sink.failures), {'ReferenceDataRequest': 1, 'HistoricalDataRequest': 0})
+
+    def test_statsd_lines(self):
+        metrics = RequestMetrics('ReferenceDataRequest')
+        metrics.add('send', .0015)
+        metrics.count('cells', 4)
+        metrics.failed = True
+        self.assertEqual(StatsdSink(prefix='x').lines(metrics),
+                         ['x.ReferenceDataRequest.send:1.500|ms', 'x.ReferenceDataRequest.cells:4|c',
+                          'x.ReferenceDataRequest.failed:1|c'])
+
+
+if __name__ == '__main__':
+    unittest.main()
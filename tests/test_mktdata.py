@@ -0,0 +1,70 @@
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bbg import Terminal, SessionPool, ReferenceDataRequest
+from fake import FakeTransport
+from mktdata import SubscriptionManager
+from test_bbg import run_with_timeout
+
+
+class SubscriptionManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = SessionPool(transport=FakeTransport())
+        self.subs = SubscriptionManager(['bid', 'ask'], interval=1, pool=self.pool)
+
+    def tearDown(self):
+        self.subs.close()
+        self.pool.close()
+
+    def test_snapshot_and_history(self):
+        self.subs.subscribe(['msft us equity', 'BAD_x'])
+        self.subs.run(.2)
+        self.assertEqual(self.subs.status(), {'msft us equity': 'SubscriptionStarted',
+                                              'BAD_x': 'SubscriptionFailure'})
+        self.assertEqual([e.security for e in self.subs.errors], ['BAD_x'])
+        snapshot = self.subs.snapshot()
+        self.assertEqual(list(snapshot.columns), ['BID', 'ASK'])
+        self.assertFalse(snapshot.loc['msft us equity'].isnull().any())
+        # conflated to one update per second
+        self.assertEqual(len(self.subs.history('msft us equity')), 1)
+
+    def test_next_wait_capped_by_flush(self):
+        self.subs.subscribe('msft us equity')
+        self.assertEqual(self.subs.next_wait(10), 10)
+        ticker = self.subs.by_name['msft us equity']
+        ticker.dirty, ticker.last_flush = True, time.time()
+        self.assertTrue(0 < self.subs.next_wait(10) <= 1)
+        # a flush already due must not sleep the full timeout
+        ticker.last_flush = time.time() - 5
+        self.assertEqual(self.subs.next_wait(10), 0)
+
+
+class DefaultPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        Terminal.configure(transport=FakeTransport())
+
+    def tearDown(self):
+        Terminal.pool.close()
+        Terminal.pool = None
+
+    def test_subscriptions_do_not_hold_the_request_session(self):
+        subs = SubscriptionManager(['bid', 'ask'])
+        subs.subscribe('msft us equity')
+        self.assertTrue(subs.pool is not Terminal.pool)
+        self.assertTrue(subs.pool.transport is Terminal.pool.transport)
+        req = run_with_timeout(lambda: ReferenceDataRequest('intc us equity', 'px_last').execute())
+        self.assertEqual(list(req.response.index), ['intc us equity'])
+        subs.run(.1)
+        self.assertEqual(subs.status(), {'msft us equity': 'SubscriptionStarted'})
+        subs.close()
+        self.assertFalse(subs.pool.transport.sessions[0].started)
+
+
+if __name__ == '__main__':
+    unittest.main()
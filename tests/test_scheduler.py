@@ -0,0 +1,70 @@
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bbg import Terminal, ReferenceDataRequest
+from fake import FakeTransport, SyntheticResponder
+from scheduler import RequestScheduler, DataBudget, BudgetExceeded, INTERACTIVE, BACKFILL
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.transport = FakeTransport(SyntheticResponder())
+        Terminal.configure(transport=self.transport)
+
+    def tearDown(self):
+        Terminal.pool.close()
+        Terminal.pool = None
+
+    def sent_securities(self):
+        return [r.get('securities') for s in self.transport.sessions for r in s.sent]
+
+    def test_transient_securities_retried(self):
+        scheduler = RequestScheduler(backoff=.01)
+        req = scheduler.execute(ReferenceDataRequest(['LIMIT_a', 'b us equity'], ['px_last']), timeout=5)
+        scheduler.close()
+        self.assertEqual(list(req.response.index), ['LIMIT_a', 'b us equity'])
+        self.assertEqual(req.security_errors, [])
+        self.assertEqual(self.sent_securities(), [['LIMIT_a', 'b us equity'], ['LIMIT_a']])
+        self.assertEqual((scheduler.stats['retries'], scheduler.stats['limited']), (1, 1))
+
+    def test_budget(self):
+        scheduler = RequestScheduler(budget=DataBudget(10))
+        scheduler.execute(ReferenceDataRequest(['a us equity', 'b us equity'], ['px_last', 'name']), timeout=5)
+        self.assertEqual(scheduler.budget.consumed, 4)
+        ticket = scheduler.submit(ReferenceDataRequest(['c us equity', 'd us equity'], ['a', 'b', 'c', 'd']))
+        self.assertRaises(BudgetExceeded, ticket.result, 5)
+        scheduler.close()
+
+    def test_priority_applies_after_throttling(self):
+        scheduler = RequestScheduler(requests_per_sec=4)
+        backfills = [scheduler.submit(ReferenceDataRequest('b%d us equity' % i, 'px_last'), BACKFILL)
+                     for i in range(6)]
+        time.sleep(.1)
+        interactive = scheduler.submit(ReferenceDataRequest('i us equity', 'px_last'), INTERACTIVE)
+        interactive.result(5)
+        [t.result(5) for t in backfills]
+        scheduler.close()
+        # the backfills within the bucket capacity went first, the throttled ones wait behind the interactive
+        sent = [s[0] for s in self.sent_securities()]
+        self.assertEqual(sent[:4], ['b0 us equity', 'b1 us equity', 'b2 us equity', 'b3 us equity'])
+        self.assertEqual(sent[4], 'i us equity')
+        self.assertTrue(scheduler.stats['throttled_ms'] > 0)
+
+    def test_close_drains_pending_retries(self):
+        scheduler = RequestScheduler(backoff=.3)
+        ticket = scheduler.submit(ReferenceDataRequest(['LIMIT_a', 'b us equity'], ['px_last']))
+        end = time.time() + 5
+        while not scheduler.stats['retries'] and time.time() < end:
+            time.sleep(.01)
+        scheduler.close()
+        req = ticket.result(5)
+        self.assertEqual(list(req.response.index), ['LIMIT_a', 'b us equity'])
+
+
+if __name__ == '__main__':
+    unittest.main()
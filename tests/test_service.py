@@ -0,0 +1,200 @@
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import bbg
+# service.py imports bbg.py under its upstream name
+sys.modules.setdefault('bbg3', bbg)
+
+from bbg import Terminal, ReferenceDataRequest, HistoricalDataRequest
+from fake import FakeTransport
+from test_bbg import SilentResponder
+from datetime import date, datetime
+from pandas import DataFrame, Categorical, date_range
+from pandas.util.testing import assert_frame_equal
+import numpy as np
+import service
+
+
+def start_stream_server():
+    """ return (server, hostport) of a stream server answered by a fake terminal """
+    dispatcher = service.TerminalDispatcher(workers=1, transport_factory=FakeTransport)
+    server = service.StreamServer(('127.0.0.1', 0), dispatcher)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, server.server_address
+
+
+class TableCodecTest(unittest.TestCase):
+
+    def test_frame_round_trip(self):
+        frame = DataFrame({'px': [1.5, np.nan, 3.], 'n': np.arange(3), 'flag': [True, False, True],
+                           'cat': Categorical(['x', 'y', 'x']), 'name': ['a', 'b', None],
+                           'dt': [date(2020, 1, 1), None, date(2020, 1, 3)]},
+                          index=date_range('2020-01-01', periods=3, name='date'),
+                          columns=['px', 'n', 'flag', 'cat', 'name', 'dt'])
+        for compress in (0, 6):
+            codec = service.TableCodec(compress)
+            key, decoded = codec.decode_frame(codec.encode_frame(frame, key='a us equity'))
+            self.assertEqual(key, 'a us equity')
+            assert_frame_equal(decoded, frame)
+            self.assertTrue(isinstance(decoded.name[0], str))
+
+    def test_map_round_trip(self):
+        codec = service.TableCodec()
+        response = {'a us equity': [1.5, 'NAME A'], 'b us equity': [np.nan, 'NAME B']}
+        decoded = codec.decode_map(codec.encode_map(response))
+        self.assertEqual(sorted(decoded), sorted(response))
+        self.assertEqual(decoded['a us equity'], [1.5, 'NAME A'])
+        self.assertTrue(np.isnan(decoded['b us equity'][0]))
+
+    def test_long_bulk_frame_round_trip(self):
+        Terminal.configure(transport=FakeTransport())
+        try:
+            req = ReferenceDataRequest(['a us equity', 'b us equity'], ['bulk_dvd'], bulk='long').execute()
+        finally:
+            Terminal.pool.close()
+            Terminal.pool = None
+        frame = req.bulk_response['bulk_dvd']
+        codec = service.TableCodec()
+        key, decoded = codec.decode_frame(codec.encode_frame(frame, key='bulk_dvd'))
+        self.assertEqual(key, 'bulk_dvd')
+        self.assertEqual(list(decoded.index.names), ['security', 'row'])
+        self.assertEqual(list(decoded.index), list(frame.index))
+        np.testing.assert_array_equal(decoded['Amount'].values, frame['Amount'].values)
+
+
+class TerminalDispatcherTest(unittest.TestCase):
+
+    def dispatcher(self, **kwargs):
+        return service.TerminalDispatcher(transport_factory=lambda: FakeTransport(SilentResponder()), **kwargs)
+
+    def test_identical_requests_coalesced(self):
+        dispatcher = self.dispatcher(request_timeout=.3)
+        silent = dispatcher.submit(ReferenceDataRequest('SILENT_a', 'px_last'))
+        self.assertTrue(dispatcher.submit(ReferenceDataRequest('SILENT_a', 'px_last')) is silent)
+        job = dispatcher.submit(ReferenceDataRequest('a us equity', 'px_last'))
+        self.assertTrue(job is not silent)
+        self.assertEqual(list(job.result(ReferenceDataRequest('a us equity', 'px_last')).response.index),
+                         ['a us equity'])
+        self.assertRaises(Exception, silent.result, ReferenceDataRequest('SILENT_a', 'px_last'))
+        # a finished job is no longer in flight, an identical request is executed again
+        self.assertTrue(silent.key not in dispatcher.inflight)
+        again = dispatcher.submit(ReferenceDataRequest('SILENT_a', 'px_last'))
+        self.assertTrue(again is not silent and not again.done)
+        self.assertRaises(Exception, again.result, ReferenceDataRequest('SILENT_a', 'px_last'))
+
+    def test_unserializable_request_not_coalesced(self):
+        dispatcher = self.dispatcher()
+        reqs = [ReferenceDataRequest('a us equity', 'px_last', overrides={'SETTLE_DT': datetime(2020, 1, 2)})
+                for _ in range(2)]
+        jobs = [dispatcher.submit(req) for req in reqs]
+        self.assertEqual(jobs[0].key, None)
+        self.assertFalse(jobs[1] is jobs[0])
+        for job, req in zip(jobs, reqs):
+            self.assertEqual(list(job.result(req).response.index), ['a us equity'])
+
+    def test_full_queue(self):
+        dispatcher = self.dispatcher(max_queue=1, batch_size=1, queue_timeout=.01, request_timeout=.3)
+        jobs = [dispatcher.submit(ReferenceDataRequest('SILENT_%d' % i, 'px_last')) for i in range(2)]
+        time.sleep(.05)
+        jobs.append(dispatcher.submit(ReferenceDataRequest('SILENT_2', 'px_last')))
+        busy = dispatcher.submit(ReferenceDataRequest('SILENT_3', 'px_last'))
+        self.assertTrue(busy.done)
+        self.assertEqual(busy.error, 'server busy: request queue is full')
+        [self.assertRaises(Exception, job.result, ReferenceDataRequest('x', 'px_last')) for job in jobs]
+
+
+class StreamClientTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server, hostport = start_stream_server()
+        cls.client = service.StreamClient(hostport)
+        Terminal.configure(transport=FakeTransport())
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        Terminal.pool.close()
+        Terminal.pool = None
+
+    def test_reference(self):
+        sids = ['s%d us equity' % i for i in range(25)]
+        remote = self.client.execute_request(ReferenceDataRequest(sids, ['px_last', 'name']))
+        local = ReferenceDataRequest(sids, ['px_last', 'name']).execute()
+        assert_frame_equal(remote.response, local.response)
+
+    def test_map_response_and_errors(self):
+        sids = ['a us equity', 'BAD_b', 'c us equity']
+        remote = self.client.execute_request(ReferenceDataRequest(sids, ['px_last', 'bad_fld'], response_type='map',
+                                                                  ignore_security_error=1, ignore_field_error=1))
+        local = ReferenceDataRequest(sids, ['px_last', 'bad_fld'], response_type='map', ignore_security_error=1,
+                                     ignore_field_error=1).execute()
+        self.assertEqual(sorted(remote.response), ['a us equity', 'c us equity'])
+        self.assertEqual(remote.response['a us equity'][0], local.response['a us equity'][0])
+        self.assertEqual(remote.security_errors, local.security_errors)
+        self.assertEqual(remote.field_errors, local.field_errors)
+        self.assertRaises(Exception, self.client.execute_request, ReferenceDataRequest(sids, ['px_last']))
+
+    def test_bulk_long(self):
+        sids = ['a us equity', 'b us equity', 'c us equity']
+        remote = self.client.execute_request(ReferenceDataRequest(sids, ['px_last', 'bulk_dvd'], bulk='long'))
+        local = ReferenceDataRequest(sids, ['px_last', 'bulk_dvd'], bulk='long').execute()
+        self.assertEqual(list(remote.response.bulk_dvd), list(local.response.bulk_dvd))
+        self.assertEqual(sorted(remote.bulk_response), ['bulk_dvd'])
+        remote_bulk, local_bulk = remote.bulk_response['bulk_dvd'], local.bulk_response['bulk_dvd']
+        self.assertEqual(list(remote_bulk.index), list(local_bulk.index))
+        np.testing.assert_array_equal(remote_bulk['Amount'].values, local_bulk['Amount'].values)
+
+    def test_historical(self):
+        req = HistoricalDataRequest(['a us equity', 'b us equity'], ['px_last'], start='2020-01-01', end='2020-01-31')
+        remote = self.client.execute_request(req)
+        self.assertEqual(sorted(remote.response), ['a us equity', 'b us equity'])
+        self.assertEqual(len(remote.response['a us equity']), 23)
+
+
+class ClientTest(unittest.TestCase):
+
+    def setUp(self):
+        Terminal.configure(transport=FakeTransport(), size=8)
+        self.client = service.Client(['http://127.0.0.1:1/', 'http://127.0.0.1:2/'], connections=2, max_securities=1)
+        self.running, self.max_running = 0, 0
+        self._lock = threading.Lock()
+        # execute the parts on the fake terminal rather than on a server
+        self.client.send = self.send
+
+    def tearDown(self):
+        Terminal.pool.close()
+        Terminal.pool = None
+
+    def send(self, request):
+        with self._lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            time.sleep(.01)
+            return Terminal.execute_request(request)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+    def test_parts_sent_by_bounded_threads(self):
+        sids = ['s%d us equity' % i for i in range(20)]
+        req = self.client.execute_request(ReferenceDataRequest(sids, ['px_last']))
+        self.assertEqual(list(req.response.index), sids)
+        self.assertEqual(self.max_running, 4)
+
+    def test_failed_part(self):
+        sids = ['s%d us equity' % i for i in range(10)] + ['BAD_x']
+        self.assertRaises(Exception, self.client.execute_request, ReferenceDataRequest(sids, ['px_last']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bbg import Terminal, HistoricalDataRequest
+from fake import FakeTransport
+from spill import SpillStore
+from pandas import DataFrame, date_range
+from pandas.util.testing import assert_frame_equal
+import numpy as np
+
+
+class SpillStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def frame(self, n=10):
+        return DataFrame({'px': np.arange(n, dtype=float), 'n': np.arange(n), 'name': ['x%d' % i for i in range(n)]},
+                         index=date_range('2020-01-01', periods=n, name='date'), columns=['px', 'n', 'name'])
+
+    def test_spilled_frames_read_back(self):
+        store = SpillStore(os.path.join(self.root, 'store'), max_memory=1)
+        store.add('a', self.frame())
+        store.add('b', self.frame(3))
+        self.assertEqual((len(store.buffer), len(store.index)), (0, 2))
+        assert_frame_equal(store['a'], self.frame())
+        assert_frame_equal(store.frame('b', fields=['n', 'missing']), self.frame(3).reindex(columns=['n', 'missing']))
+        icol, cols = store.index['a']
+        self.assertTrue(isinstance(store.read_column(cols['px']), np.memmap))
+        store.close()
+        # reopened from its path
+        store = SpillStore(os.path.join(self.root, 'store'))
+        self.assertEqual(store.keys(), ['a', 'b'])
+        assert_frame_equal(store['b'], self.frame(3))
+
+    def test_buffered_until_max_memory(self):
+        store = SpillStore(max_memory=10 ** 6)
+        store.add('a', self.frame())
+        self.assertEqual((len(store.buffer), len(store.index)), (1, 0))
+        self.assertTrue('a' in store)
+        path = store.path
+        store.close()
+        self.assertFalse(os.path.exists(path))
+
+    def test_historical_request(self):
+        Terminal.configure(transport=FakeTransport())
+        try:
+            sids = ['s%d us equity' % i for i in range(5)]
+            kwargs = dict(start='2020-01-01', end='2020-03-31')
+            store = SpillStore(max_memory=1000)
+            req = HistoricalDataRequest(sids, ['px_last', 'px_open'], spill=store, **kwargs).execute()
+            expected = HistoricalDataRequest(sids, ['px_last', 'px_open'], columnar=1, **kwargs).execute()
+        finally:
+            Terminal.pool.close()
+            Terminal.pool = None
+        self.assertTrue(req.response is store)
+        self.assertEqual(sorted(store.keys()), sids)
+        for sid in sids:
+            assert_frame_equal(store[sid], expected.response[sid])
+        store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()